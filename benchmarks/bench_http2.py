@@ -0,0 +1,265 @@
+"""
+Сравнение пропускной способности и p99-задержки клиента Mattermost
+в режимах HTTP/1.1 (пул соединений) и HTTP/2 (мультиплексирование).
+
+Заглушка сервера Mattermost поднимается локально в отдельном процессе
+(TLS с самоподписанным сертификатом, ALPN h2/http1.1).
+
+Запуск:
+    pip install -e ".[bench]"
+    python benchmarks/bench_http2.py --requests 5000 --concurrency 200 --latency 5
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from aiomost.mattermost_actions.mm_actions import MMBot
+
+
+def _make_certificate(directory: str):
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+         "-keyout", keyfile, "-out", certfile, "-days", "1",
+         "-subj", "/CN=127.0.0.1"],
+        check=True, capture_output=True,
+    )
+    return certfile, keyfile
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class _StubServer:
+    """
+    Минимальная заглушка Mattermost REST поверх TLS: HTTP/2 (h2) и HTTP/1.1 (h11),
+    протокол выбирается по ALPN. Каждый ответ задерживается на latency секунд.
+    """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.open_connections = 0
+        self.peak_connections = 0
+
+    def respond(self, method: str, path: str):
+        if path == "/stats":
+            return 200, {"peak_connections": self.peak_connections}
+        if path == "/reset":
+            self.peak_connections = self.open_connections
+            return 200, {}
+        status = 201 if method == "POST" else 200
+        return status, {"id": "p" * 26, "message": "ok"}
+
+    async def handle(self, reader, writer):
+        self.open_connections += 1
+        self.peak_connections = max(self.peak_connections, self.open_connections)
+        ssl_object = writer.get_extra_info("ssl_object")
+        try:
+            if ssl_object.selected_alpn_protocol() == "h2":
+                await self._serve_h2(reader, writer)
+            else:
+                await self._serve_h11(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.open_connections -= 1
+            writer.close()
+
+    async def _serve_h11(self, reader, writer):
+        import h11
+
+        conn = h11.Connection(h11.SERVER)
+        while True:
+            event = conn.next_event()
+            if event is h11.NEED_DATA:
+                data = await reader.read(65536)
+                conn.receive_data(data)
+                if not data:
+                    return
+                continue
+            if isinstance(event, h11.Request):
+                request = event
+            elif isinstance(event, h11.EndOfMessage):
+                path = request.target.decode()
+                if path not in ("/stats", "/reset"):
+                    await asyncio.sleep(self.latency)
+                status, body = self.respond(request.method.decode(), path)
+                payload = json.dumps(body).encode()
+                writer.write(conn.send(h11.Response(status_code=status, headers=[
+                    ("content-type", "application/json"),
+                    ("content-length", str(len(payload)))])))
+                writer.write(conn.send(h11.Data(data=payload)))
+                writer.write(conn.send(h11.EndOfMessage()))
+                await writer.drain()
+                conn.start_next_cycle()
+            elif isinstance(event, h11.ConnectionClosed):
+                return
+
+    async def _serve_h2(self, reader, writer):
+        import h2.config
+        import h2.connection
+        import h2.events
+
+        conn = h2.connection.H2Connection(
+            config=h2.config.H2Configuration(client_side=False))
+        conn.local_settings.max_concurrent_streams = 1000
+        conn.initiate_connection()
+        writer.write(conn.data_to_send())
+        requests = {}
+
+        async def reply(stream_id, method, path):
+            if path not in ("/stats", "/reset"):
+                await asyncio.sleep(self.latency)
+            status, body = self.respond(method, path)
+            payload = json.dumps(body).encode()
+            conn.send_headers(stream_id, [
+                (":status", str(status)),
+                ("content-type", "application/json"),
+                ("content-length", str(len(payload)))])
+            conn.send_data(stream_id, payload, end_stream=True)
+            writer.write(conn.data_to_send())
+
+        tasks = set()
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            for event in conn.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    headers = dict(event.headers)
+                    requests[event.stream_id] = (
+                        headers[b":method"].decode(), headers[b":path"].decode())
+                elif isinstance(event, h2.events.DataReceived):
+                    conn.acknowledge_received_data(
+                        event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, h2.events.StreamEnded):
+                    task = asyncio.ensure_future(
+                        reply(event.stream_id, *requests.pop(event.stream_id)))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                elif isinstance(event, h2.events.ConnectionTerminated):
+                    return
+            writer.write(conn.data_to_send())
+            await writer.drain()
+
+
+def _run_stub_server(port: int, certfile: str, keyfile: str, latency: float):
+    import ssl
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile, keyfile)
+    context.set_alpn_protocols(["h2", "http/1.1"])
+    stub = _StubServer(latency)
+
+    async def serve():
+        server = await asyncio.start_server(stub.handle, "127.0.0.1", port, ssl=context)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def _run_mode(url: str, http2: bool, total: int, concurrency: int) -> Dict:
+    bot = MMBot(url, "token", verify=False, http2=http2,
+                max_connections=concurrency, max_keepalive_connections=concurrency)
+    latencies: List[float] = []
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            if i % 2:
+                # edit_message печатает результат в stdout, поэтому PUT напрямую
+                await bot.send_request(f"api/v4/posts/{'p' * 26}", "PUT",
+                                       json_data={"id": "p" * 26, "message": f"edit {i}"})
+            else:
+                await bot.send_message("c" * 26, f"message {i}")
+            latencies.append(time.perf_counter() - started)
+
+    async with bot:
+        await bot.client.get(f"{url}/reset")
+        # Прогрев: установка соединений не должна попадать в замер
+        await asyncio.gather(*(bot.send_message("c" * 26, "warmup")
+                               for _ in range(concurrency)))
+        latencies.clear()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+        stats = (await bot.client.get(f"{url}/stats")).json()
+
+    return {
+        "mode": "http2" if http2 else "http1.1-pooled",
+        "negotiated": bot.http_version,
+        "requests": total,
+        "concurrency": concurrency,
+        "peak_connections": stats["peak_connections"],
+        "throughput_rps": round(total / elapsed, 1),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=5.0,
+                        help="Искусственная задержка сервера, мс")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = _make_certificate(directory)
+        port = _free_port()
+        server = multiprocessing.Process(
+            target=_run_stub_server,
+            args=(port, certfile, keyfile, args.latency / 1000),
+            daemon=True,
+        )
+        server.start()
+        try:
+            url = f"https://127.0.0.1:{port}"
+            for _ in range(100):
+                try:
+                    socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                    break
+                except OSError:
+                    time.sleep(0.05)
+
+            results = [
+                asyncio.run(_run_mode(url, False, args.requests, args.concurrency)),
+                asyncio.run(_run_mode(url, True, args.requests, args.concurrency)),
+            ]
+        finally:
+            server.terminate()
+            server.join()
+
+    json.dump({"benchmark": "http2", "latency_ms": args.latency, "results": results},
+              sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Стоимость разбора одного события WebSocket с разными JSON-бэкендами.
+
+Для каждого бэкенда (json - исходное поведение, orjson / msgspec - если
+установлены) измеряется среднее время на событие:
+  decode     - кадр и вложенная строка post (как в mattermost_ws_listener);
+  parse      - decode + построение MessageEvent;
+  update     - MattermostUpdate.to_json() для события без своей модели.
+
+Запуск:
+    pip install orjson msgspec  # необязательно
+    python benchmarks/bench_json.py --events 20000
+"""
+
+import argparse
+import json
+import time
+
+from aiomost.mattermost_json import codec
+from aiomost.mattermost_models.posts.posts_model import MessageEvent
+from aiomost.mattermost_websockets.mm_websockets import MattermostUpdate
+
+
+def _make_frame() -> str:
+    post = {
+        "id": "hzb3qi9w5fny8mz4usnwk8uydy", "create_at": 1700000000000,
+        "update_at": 1700000000000, "edit_at": 0, "delete_at": 0, "is_pinned": False,
+        "user_id": "p1ehb4r6kfbx9ctr1rjfx3m9ww", "channel_id": "4xp9fdt77pncbef59f4k1qe83o",
+        "root_id": "", "original_id": "", "message": "Привет! Проверка сборки #1234 " * 4,
+        "type": "", "props": {"disable_group_highlight": True}, "hashtags": "",
+        "pending_post_id": "", "reply_count": 0, "metadata": {"embeds": [], "files": []},
+    }
+    frame = {
+        "event": "posted", "seq": 42,
+        "broadcast": {"omit_users": None, "user_id": "", "team_id": "",
+                      "channel_id": "4xp9fdt77pncbef59f4k1qe83o"},
+        "data": {"channel_display_name": "Town Square", "channel_name": "town-square",
+                 "channel_type": "O", "post": json.dumps(post), "sender_name": "@alice",
+                 "set_online": True, "team_id": "ey5t8ukzyfrq7e9xmmx6t3yw1w",
+                 "mentions": json.dumps(["q3ba4wfkx3fm8rz3pugu4uzymc"])},
+    }
+    return json.dumps(frame)
+
+
+def _per_event_us(func, events: int) -> float:
+    for _ in range(min(events, 1000)):  # Прогрев
+        func()
+    started = time.perf_counter()
+    for _ in range(events):
+        func()
+    return (time.perf_counter() - started) / events * 1e6
+
+
+def _run_backend(name: str, raw: str, events: int):
+    codec.set_backend(name)
+
+    def decode():
+        frame = codec.loads(raw)
+        codec.loads(frame["data"]["post"])
+
+    def parse():
+        MessageEvent(**codec.loads(raw))
+
+    frame = codec.loads(raw)
+    update = MattermostUpdate("channel_viewed", frame["data"])
+
+    return {
+        "backend": name,
+        "decode_us": round(_per_event_us(decode, events), 2),
+        "parse_us": round(_per_event_us(parse, events), 2),
+        "update_to_json_us": round(_per_event_us(update.to_json, events), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=20000)
+    args = parser.parse_args()
+
+    raw = _make_frame()
+    previous = codec.backend
+    results = [_run_backend(name, raw, args.events) for name in codec.available_backends()]
+    codec.set_backend(previous)
+
+    baseline = next(r for r in results if r["backend"] == "json")
+    for result in results:
+        result["parse_speedup"] = round(baseline["parse_us"] / result["parse_us"], 2)
+    print(json.dumps({"frame_bytes": len(raw.encode()), "events": args.events,
+                      "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
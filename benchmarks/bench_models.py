@@ -0,0 +1,182 @@
+"""
+Стоимость разбора события posted слушателем: MessageEvent против LazyMessageEvent.
+
+Кадры - реалистичные posted: простое сообщение пользователя, сообщение со
+ссылкой (metadata.embeds с превью), файлом, реакциями и вложениями в props, и
+сообщение бота, которое слушатель отбрасывает. Событие строится так же, как в
+mattermost_ws_listener (_parse_event с фильтрами ботов и системных сообщений;
+кадр уже разобран codec.loads), затем выполняется сценарий доступа:
+  filter   - поля, которые читают слушатель и роутер: id, channel_id, create_at, user_id;
+  message  - то же + post.message (типичный хендлер);
+  full     - to_json() (обращение ко всем полям).
+Для сообщения бота измеряется только _parse_event.
+
+Время на событие - медиана по --rounds раундам, в каждом раунде берётся лучшее
+из --repeats прогонов. Модели чередуются внутри раунда, поэтому дрейф частоты
+процессора влияет на обе одинаково; spread - разброс раундов в процентах.
+Память: сколько байт и блоков выделено на одно событие, которое держится в
+очереди пула (tracemalloc, после сценария filter).
+
+Запуск:
+    python benchmarks/bench_models.py --events 20000 --rounds 7
+"""
+
+import argparse
+import gc
+import json
+import logging
+import statistics
+import time
+import tracemalloc
+
+from aiomost.mattermost_json import codec
+from aiomost.mattermost_websockets.mm_websockets import _parse_event
+
+MODELS = {"eager": False, "lazy": True}
+
+# Пакет включает DEBUG-логирование: без этого сценарий bot измерял бы вывод в stderr
+logging.getLogger("aiomost.mattermost_websockets.mm_websockets").setLevel(logging.WARNING)
+
+
+def _make_frame(kind: str) -> str:
+    rich = kind == "rich"
+    post = {
+        "id": "hzb3qi9w5fny8mz4usnwk8uydy", "create_at": 1700000000000,
+        "update_at": 1700000000000, "edit_at": 0, "delete_at": 0, "is_pinned": False,
+        "user_id": "p1ehb4r6kfbx9ctr1rjfx3m9ww", "channel_id": "4xp9fdt77pncbef59f4k1qe83o",
+        "root_id": "", "original_id": "", "message": "Привет! Проверка сборки #1234",
+        "type": "", "props": {"disable_group_highlight": True}, "hashtags": "",
+        "pending_post_id": "", "reply_count": 0, "metadata": {},
+    }
+    if rich:
+        post["message"] = "Сборка упала, подробности: https://ci.example.com/builds/1234 @bob"
+        post["file_ids"] = ["9fu3xpbo1jbn8bq8sxh1ygfk5a"]
+        post["props"]["attachments"] = [{
+            "text": "Статус: failed", "color": "#ff0000",
+            "actions": [{"id": "retry", "name": "Перезапустить", "type": "button",
+                         "integration": {"url": "https://bot.example.com/mattermost/action",
+                                         "context": {"action": "retry_1234"}}}],
+        }]
+        post["metadata"] = {
+            "embeds": [{"type": "opengraph", "url": "https://ci.example.com/builds/1234",
+                        "data": {"type": "website", "title": "Build #1234", "description":
+                                 "Pipeline failed at stage test" * 3, "site_name": "CI"}}],
+            "files": [{"id": "9fu3xpbo1jbn8bq8sxh1ygfk5a", "name": "log.txt", "size": 48213,
+                       "mime_type": "text/plain", "extension": "txt"}],
+            "reactions": [{"user_id": "q3ba4wfkx3fm8rz3pugu4uzymc", "emoji_name": "eyes",
+                           "create_at": 1700000000500}],
+            "images": {},
+        }
+    if kind == "bot":
+        post["props"]["from_bot"] = "true"
+    frame = {
+        "event": "posted", "seq": 42,
+        "broadcast": {"omit_users": None, "user_id": "", "team_id": "",
+                      "channel_id": "4xp9fdt77pncbef59f4k1qe83o"},
+        "data": {"channel_display_name": "Town Square", "channel_name": "town-square",
+                 "channel_type": "O", "post": json.dumps(post), "sender_name": "@alice",
+                 "set_online": True, "team_id": "ey5t8ukzyfrq7e9xmmx6t3yw1w",
+                 "mentions": json.dumps(["q3ba4wfkx3fm8rz3pugu4uzymc"] if rich else [])},
+    }
+    return json.dumps(frame)
+
+
+def _filter(event):
+    post = event.data.post
+    return post.id, post.channel_id, post.create_at, post.user_id
+
+
+def _message(event):
+    _filter(event)
+    return event.data.post.message
+
+
+def _full(event):
+    return event.to_json()
+
+
+def _parse_only(event):
+    return event
+
+
+SCENARIOS = {"filter": _filter, "message": _message, "full": _full}
+FRAMES = {"plain": SCENARIOS, "rich": SCENARIOS, "bot": {"parse": _parse_only}}
+
+
+def _run_us(lazy: bool, raw: str, access, events: int, repeats: int) -> float:
+    """Лучшее из repeats прогонов; кадр разбирается заново для каждого события."""
+    best = float("inf")
+    for _ in range(repeats):
+        # Свежие словари: ленивые модели разбирают поля на месте
+        frames = [codec.loads(raw) for _ in range(events)]
+        gc.disable()  # Как в timeit: сборщик мусора не попадает в замер
+        started = time.perf_counter()
+        for frame in frames:
+            access(_parse_event("posted", frame, lazy))
+        best = min(best, time.perf_counter() - started)
+        gc.enable()
+    return best / events * 1e6
+
+
+def _allocations(lazy: bool, raw: str, events: int):
+    frames = [codec.loads(raw) for _ in range(events)]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = []
+    for frame in frames:
+        event = _parse_event("posted", frame, lazy)
+        _filter(event)
+        kept.append(event)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    size = sum(stat.size_diff for stat in stats)
+    blocks = sum(stat.count_diff for stat in stats)
+    return round(size / events), round(blocks / events, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--alloc-events", type=int, default=2000)
+    args = parser.parse_args()
+
+    raws = {frame_name: _make_frame(frame_name) for frame_name in FRAMES}
+    samples = {}  # (frame, model, scenario) -> время каждого раунда
+    for _ in range(args.rounds):
+        for frame_name, scenarios in FRAMES.items():
+            for scenario, access in scenarios.items():
+                for model_name, lazy in MODELS.items():
+                    samples.setdefault((frame_name, model_name, scenario), []).append(
+                        _run_us(lazy, raws[frame_name], access, args.events, args.repeats))
+
+    results = []
+    for frame_name, scenarios in FRAMES.items():
+        for model_name, lazy in MODELS.items():
+            result = {"frame": frame_name, "frame_bytes": len(raws[frame_name].encode()),
+                      "model": model_name}
+            for scenario in scenarios:
+                rounds = samples[frame_name, model_name, scenario]
+                median = statistics.median(rounds)
+                result[f"{scenario}_us"] = round(median, 2)
+                result[f"{scenario}_spread_pct"] = round(
+                    (max(rounds) - min(rounds)) / median * 100, 1)
+            if frame_name != "bot":
+                result["bytes_per_event"], result["blocks_per_event"] = _allocations(
+                    lazy, raws[frame_name], args.alloc_events)
+            results.append(result)
+
+    for result in results:
+        eager = next(r for r in results if r["frame"] == result["frame"] and r["model"] == "eager")
+        for scenario in FRAMES[result["frame"]]:
+            result[f"{scenario}_speedup"] = round(
+                eager[f"{scenario}_us"] / result[f"{scenario}_us"], 2)
+    print(json.dumps({"json_backend": codec.backend, "events": args.events,
+                      "rounds": args.rounds, "repeats": args.repeats, "results": results},
+                     indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+Сквозной бенчмарк бота: WebSocket -> роутер -> обработчик -> REST.
+
+Все сценарии работают против локальных заглушек (MattermostStub и RespStub),
+настоящие Mattermost и Redis не нужны. Для каждого сценария выводятся
+events_per_sec, p50_ms и p99_ms в формате JSON.
+
+Сценарии:
+  ws_listener   - разбор кадров mattermost_ws_listener и доставка в обработчик;
+  dispatch      - Dispatcher.dispatch / Router.propagate_event с фильтрами;
+  state         - dispatch с проверкой состояния через RedisStateManager;
+  send_message  - исходящий MMBot.send_message (REST через заглушку);
+  end_to_end    - событие из WebSocket, обработчик отвечает через send_message.
+
+Запуск:
+    make bench
+    python benchmarks/bench_pipeline.py --events 2000 --out bench.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import platform
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+# Заглушки живут в tests/stub и в пакет не входят
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import aiomost
+from aiomost import Dispatcher, MMBot, RedisStateManager, Router
+from aiomost.mattermost_dispatcher.event_pool import DispatchPool
+from aiomost.mattermost_json import codec
+from aiomost.mattermost_models.posts.posts_model import MessageEvent
+from tests.stub.resp import RespStub
+from tests.stub.server import MattermostStub
+from aiomost.mattermost_websockets.mm_websockets import mattermost_ws_listener
+
+SCENARIOS = ("ws_listener", "dispatch", "state", "send_message", "end_to_end")
+
+
+def _summary(latencies: List[float], elapsed: float) -> Dict:
+    ordered = sorted(latencies)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000
+
+    return {
+        "events": len(ordered),
+        "events_per_sec": round(len(ordered) / elapsed, 1),
+        "p50_ms": round(percentile(0.50), 3),
+        "p99_ms": round(percentile(0.99), 3),
+    }
+
+
+async def _closed_loop(events: int, window: int, start: Callable, done: asyncio.Queue) -> Dict:
+    """
+    Держит в работе не больше window событий: start(i) запускает событие i,
+    обработчик кладёт i в done по завершении. Задержка - от запуска до завершения.
+    """
+    started_at: Dict[int, float] = {}
+    latencies = []
+    began = time.perf_counter()
+    next_event = 0
+    while len(latencies) < events:
+        while next_event < events and next_event - len(latencies) < window:
+            started_at[next_event] = time.perf_counter()
+            start(next_event)
+            next_event += 1
+        finished = await done.get()
+        latencies.append(time.perf_counter() - started_at.pop(finished))
+    return _summary(latencies, time.perf_counter() - began)
+
+
+def _make_stub(rest_latency: float = 0.0):
+    stub = MattermostStub(latency=rest_latency, seed=1)
+    user = stub.add_user("alice")
+    channel = stub.add_channel("town-square", members=(user["id"],))
+    return stub, user, channel
+
+
+async def _start_listener(stub: MattermostStub, routers, args, bot=None):
+    pool = DispatchPool(workers=args.dispatch_workers)
+    listener = asyncio.ensure_future(mattermost_ws_listener(
+        routers, stub.ws_url, stub.token, bot=bot, connect=stub.connect, dispatch_pool=pool))
+    while not stub.sockets or not stub.sockets[0].authenticated:
+        await asyncio.sleep(0.001)
+    return listener
+
+
+async def _stop(task: asyncio.Future):
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+
+
+async def bench_ws_listener(args) -> Dict:
+    stub, user, channel = _make_stub()
+    done = asyncio.Queue()
+    router = Router(bot_user_id=stub.bot_user["id"])
+
+    @router.posted()
+    async def on_post(event, **kwargs):
+        done.put_nowait(int(event.data.post.message))
+
+    def emit(i):
+        for _ in range(args.noise):
+            stub.emit("typing", {"parent_id": "", "user_id": user["id"]},
+                      {"channel_id": channel["id"]})
+        stub.emit_post(channel["id"], user["id"], str(i))
+
+    listener = await _start_listener(stub, [router], args)
+    result = await _closed_loop(args.events, args.window, emit, done)
+    await _stop(listener)
+    return result
+
+
+def _posted_events(count: int) -> List[MessageEvent]:
+    stub, user, channel = _make_stub()
+    frames = []
+    socket_frames = []
+
+    class Collector:
+        authenticated = True
+
+        def push(self, event, data, broadcast=None):
+            socket_frames.append({"event": event, "data": data, "broadcast": broadcast, "seq": 0})
+
+    stub.sockets.append(Collector())
+    for i in range(count):
+        stub.emit_post(channel["id"], user["id"], f"/cmd {i}" if i % 2 else str(i))
+    for frame in socket_frames:
+        frames.append(MessageEvent(**codec.loads(codec.dumps(frame))))
+    return frames
+
+
+def _make_routers(done: asyncio.Queue) -> Dispatcher:
+    dispatcher = Dispatcher()
+    commands = Router(name="commands")
+    fallback = Router(name="fallback")
+
+    async def is_command(event):
+        return event.data.post.message.startswith("/")
+
+    async def is_long(event):
+        return len(event.data.post.message) > 100
+
+    @commands.posted(is_command)
+    async def on_command(event, **kwargs):
+        done.put_nowait(event)
+        return True
+
+    @commands.posted(is_long)
+    async def on_long(event, **kwargs):
+        return True
+
+    @fallback.posted()
+    async def on_text(event, **kwargs):
+        done.put_nowait(event)
+        return True
+
+    dispatcher.include_router(commands)
+    dispatcher.include_router(fallback)
+    return dispatcher
+
+
+async def _bench_dispatch(events: List[MessageEvent], dispatcher: Dispatcher,
+                          done: asyncio.Queue) -> Dict:
+    latencies = []
+    began = time.perf_counter()
+    for event in events:
+        started = time.perf_counter()
+        await dispatcher.dispatch("posted", event)
+        latencies.append(time.perf_counter() - started)
+        while not done.empty():
+            done.get_nowait()
+    return _summary(latencies, time.perf_counter() - began)
+
+
+async def bench_dispatch(args) -> Dict:
+    done = asyncio.Queue()
+    return await _bench_dispatch(_posted_events(args.events), _make_routers(done), done)
+
+
+async def bench_state(args) -> Dict:
+    done = asyncio.Queue()
+    events = _posted_events(args.state_events)
+    async with RespStub() as redis_stub:
+        manager = RedisStateManager(host=redis_stub.host, port=redis_stub.port, db=0)
+        dispatcher = _make_routers(done)
+        dispatcher.state_manager = manager
+        for router in dispatcher.routers:
+            router.state_manager = manager
+        result = await _bench_dispatch(events, dispatcher, done)
+        result["redis_commands_per_event"] = round(redis_stub.commands / len(events), 2)
+        result["redis_connections_per_event"] = round(redis_stub.connections / len(events), 2)
+    return result
+
+
+async def bench_send_message(args) -> Dict:
+    stub, user, channel = _make_stub(args.rest_latency)
+    done = asyncio.Queue()
+    async with MMBot(stub.api_url, stub.token, transport=stub.transport) as bot:
+        async def send(i):
+            await bot.send_message(channel["id"], f"message {i}")
+            done.put_nowait(i)
+
+        tasks = []
+        result = await _closed_loop(args.events, args.window,
+                                    lambda i: tasks.append(asyncio.ensure_future(send(i))), done)
+        await asyncio.gather(*tasks)
+    return result
+
+
+async def bench_end_to_end(args) -> Dict:
+    stub, user, channel = _make_stub(args.rest_latency)
+    done = asyncio.Queue()
+    bot = MMBot(stub.api_url, stub.token, transport=stub.transport)
+    router = Router(bot_user_id=stub.bot_user["id"])
+
+    @router.posted()
+    async def on_post(event, **kwargs):
+        await bot.send_message(event.data.post.channel_id, f"echo {event.data.post.message}")
+        done.put_nowait(int(event.data.post.message))
+
+    listener = await _start_listener(stub, [router], args, bot=bot)
+    result = await _closed_loop(
+        args.events, args.window,
+        lambda i: stub.emit_post(channel["id"], user["id"], str(i)), done)
+    await _stop(listener)
+    return result
+
+
+async def run(args) -> Dict:
+    benches = {
+        "ws_listener": bench_ws_listener,
+        "dispatch": bench_dispatch,
+        "state": bench_state,
+        "send_message": bench_send_message,
+        "end_to_end": bench_end_to_end,
+    }
+    results = {}
+    for name in args.scenarios:
+        results[name] = await benches[name](args)
+        print(f"{name}: {results[name]}", file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--state-events", type=int, default=500,
+                        help="Событий в сценарии state (каждое открывает соединения Redis)")
+    parser.add_argument("--window", type=int, default=32,
+                        help="Сколько событий одновременно в работе")
+    parser.add_argument("--dispatch-workers", type=int, default=1,
+                        help="Воркеры DispatchPool слушателя WebSocket")
+    parser.add_argument("--noise", type=int, default=0,
+                        help="Событий typing без обработчиков перед каждым сообщением (ws_listener)")
+    parser.add_argument("--rest-latency", type=float, default=0.002,
+                        help="Задержка ответа REST-заглушки (секунды)")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--out", help="Файл для результатов JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    report = {
+        "aiomost": aiomost.__version__,
+        "python": platform.python_version(),
+        "json_backend": codec.backend,
+        "params": {"events": args.events, "state_events": args.state_events,
+                   "window": args.window, "dispatch_workers": args.dispatch_workers,
+                   "noise": args.noise,
+                   "rest_latency": args.rest_latency},
+        "scenarios": asyncio.run(run(args)),
+    }
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
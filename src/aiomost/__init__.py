@@ -6,13 +6,23 @@ __version__ = "0.1.0"
 
 # Основные компоненты
 from .mattermost_dispatcher.dispatcher import Dispatcher
+from .mattermost_dispatcher.event_pool import DispatchPool, KeyedDispatchPool
+from .mattermost_dispatcher.admission import EventShed, PriorityDispatchPool
 from .mattermost_routers.mm_routers import Router
 from .mattermost_state_storage.redis_state_manager import RedisStateManager
 from .mattermost_actions.mm_actions import MMBot
+from .mattermost_actions.bulk import BulkResult
+from .mattermost_actions.avatar_store import MemoryAvatarHashStore, RedisAvatarHashStore
+from .mattermost_actions.cache import ResponseCache, UserCache
+from .mattermost_actions.metrics import RequestMetrics
+from .mattermost_actions.outbox import Outbox, OutboxFull
+from .mattermost_actions.rate_limiter import RateLimiter
+from .mattermost_actions.retry import RetryPolicy, CircuitBreaker, CircuitOpenError
 
 # Модели
 from .mattermost_models.button_query.button_query_model import MattermostButtonQuery
 from .mattermost_models.posts.posts_model import *
+from .mattermost_models.posts.lazy_posts_model import LazyMessageEvent
 from .mattermost_models.user.user_info.user_info_models import *
 
 # Фильтры
@@ -30,7 +40,8 @@ try:
         MattermostButtonHandler,
         create_mattermost_router,
         setup_mattermost_integration,
-        MattermostApp
+        MattermostApp,
+        mattermost_lifespan
     )
     _HAS_FASTAPI = True
 except ImportError:
@@ -40,12 +51,29 @@ except ImportError:
 __all__ = [
     # Основные компоненты
     "Dispatcher",
+    "DispatchPool",
+    "KeyedDispatchPool",
+    "PriorityDispatchPool",
+    "EventShed",
     "Router", 
     "RedisStateManager",
     "MMBot",
+    "BulkResult",
+    "UserCache",
+    "ResponseCache",
+    "RequestMetrics",
+    "MemoryAvatarHashStore",
+    "RedisAvatarHashStore",
+    "Outbox",
+    "OutboxFull",
+    "RateLimiter",
+    "RetryPolicy",
+    "CircuitBreaker",
+    "CircuitOpenError",
     
     # Модели
     "MattermostButtonQuery",
+    "LazyMessageEvent",
     
     # Состояния
     "State",
@@ -57,5 +85,6 @@ if _HAS_FASTAPI:
         "MattermostButtonHandler",
         "create_mattermost_router", 
         "setup_mattermost_integration",
-        "MattermostApp"
+        "MattermostApp",
+        "mattermost_lifespan"
     ])
@@ -5,12 +5,13 @@ FastAPI интеграция для AioMost.
 
 from .handlers import MattermostButtonHandler, create_mattermost_router
 from .middleware import MattermostMiddleware
-from .utils import setup_mattermost_integration, MattermostApp
+from .utils import setup_mattermost_integration, MattermostApp, mattermost_lifespan
 
 __all__ = [
     'MattermostButtonHandler',
     'create_mattermost_router',
     'MattermostMiddleware',
     'setup_mattermost_integration',
-    'MattermostApp'
+    'MattermostApp',
+    'mattermost_lifespan'
 ]
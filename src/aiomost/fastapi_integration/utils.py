@@ -2,6 +2,7 @@
 Утилиты для FastAPI интеграции.
 """
 
+from contextlib import asynccontextmanager
 from typing import Dict, Any, Optional
 from fastapi import FastAPI
 
@@ -112,3 +113,28 @@ def setup_mattermost_integration(
     app.include_router(mattermost_router)
 
     return dispatcher
+
+
+def mattermost_lifespan(bot):
+    """
+    Создаёт lifespan для FastAPI, который открывает пул соединений бота
+    при старте приложения и закрывает его при остановке.
+
+    Args:
+        bot: Экземпляр MMBot
+
+    Returns:
+        Функция lifespan для передачи в FastAPI
+
+    Example:
+        ```python
+        bot = MMBot("https://mattermost.example.com", "bot-token")
+        app = FastAPI(lifespan=mattermost_lifespan(bot))
+        ```
+    """
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        async with bot:
+            yield
+
+    return lifespan
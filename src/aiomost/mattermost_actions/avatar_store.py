@@ -0,0 +1,43 @@
+from typing import Dict, Optional
+
+import redis.asyncio as redis
+
+
+class MemoryAvatarHashStore:
+    """Хэши загруженных аватаров в памяти процесса (user_id -> sha256)."""
+
+    def __init__(self):
+        self.hashes: Dict[str, str] = {}
+
+    async def get(self, user_id: str) -> Optional[str]:
+        return self.hashes.get(user_id)
+
+    async def set(self, user_id: str, digest: str):
+        self.hashes[user_id] = digest
+
+
+class RedisAvatarHashStore:
+    """
+    Хэши загруженных аватаров в Redis того же сервера, что и RedisStateManager.
+    Переживают перезапуск бота, поэтому ночная синхронизация не загружает
+    неизменившиеся аватары заново.
+    """
+
+    def __init__(self, state_manager, prefix: str = "avatar_hash"):
+        """
+        :param state_manager: RedisStateManager, параметры подключения которого используются.
+        :param prefix: Префикс ключей Redis.
+        """
+        self.redis = redis.Redis(host=state_manager.redis_host,
+                                 port=state_manager.redis_port, db=state_manager.redis_db)
+        self.prefix = prefix
+
+    async def get(self, user_id: str) -> Optional[str]:
+        digest = await self.redis.get(f"{self.prefix}:{user_id}")
+        return digest.decode('utf-8') if digest else None
+
+    async def set(self, user_id: str, digest: str):
+        await self.redis.set(f"{self.prefix}:{user_id}", digest)
+
+    async def close(self):
+        await self.redis.close()
@@ -0,0 +1,94 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+
+class BatchLoader:
+    """
+    Объединяет одиночные запросы в пакетные (в стиле DataLoader).
+
+    Ключи, запрошенные через load() в течение window секунд, уходят одним
+    вызовом batch_fn(keys), который возвращает словарь {ключ: значение}.
+    Каждый вызывающий получает своё значение (None, если ключа нет в ответе).
+    Повторный load() ключа, который уже ждёт ответа, не создаёт новый запрос.
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]],
+        window: float = 0.005,
+        max_batch_size: int = 100,
+    ):
+        """
+        :param batch_fn: Корутина, загружающая значения для списка ключей.
+        :param window: Сколько секунд копить ключи перед отправкой пакета.
+        :param max_batch_size: Максимум ключей в одном пакете.
+        """
+        self.batch_fn = batch_fn
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._queue: Dict[Hashable, asyncio.Future] = {}
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self.loads = 0
+        self.deduplicated = 0  # load() без собственного ключа в пакете
+        self.batches = 0
+
+    async def load(self, key: Hashable) -> Any:
+        self.loads += 1
+        future = self._queue.get(key) or self._in_flight.get(key)
+        if future is not None:
+            self.deduplicated += 1
+            return await asyncio.shield(future)
+
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._queue[key] = future
+        if len(self._queue) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._queue:
+            return
+        batch, self._queue = self._queue, {}
+        self._in_flight.update(batch)
+        self.batches += 1
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: Dict[Hashable, asyncio.Future]):
+        try:
+            results = await self.batch_fn(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+                    future.exception()  # Получат ожидающие через shield
+            return
+        except BaseException:
+            # Отмена (например, aclose() во время запроса): ожидающие load() за
+            # shield иначе зависли бы навсегда
+            for future in batch.values():
+                future.cancel()
+            raise
+        finally:
+            for key in batch:
+                self._in_flight.pop(key, None)
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(results.get(key))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "loads": self.loads,
+            "batches": self.batches,
+            "deduplicated": self.deduplicated,
+            "avg_batch_size": (self.loads - self.deduplicated) / self.batches if self.batches else 0.0,
+        }
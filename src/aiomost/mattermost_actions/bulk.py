@@ -0,0 +1,83 @@
+import asyncio
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Optional, Union
+
+
+class BulkResult:
+    """Результат обработки одного элемента пакетной операции."""
+
+    __slots__ = ("index", "item", "result", "error")
+
+    def __init__(self, index: int, item: Any, result: Any = None, error: Optional[BaseException] = None):
+        self.index = index  # Позиция элемента во входной последовательности
+        self.item = item
+        self.result = result
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        status = "ok" if self.ok else f"error={self.error!r}"
+        return f"BulkResult(index={self.index}, {status})"
+
+
+async def bounded_map(
+    items: Union[Iterable, AsyncIterable],
+    func: Callable[[Any], Awaitable],
+    concurrency: int = 10,
+) -> AsyncIterator[BulkResult]:
+    """
+    Применяет корутину func к каждому элементу items, держа в работе не больше
+    concurrency задач, и отдаёт результаты по мере готовности (не по порядку).
+
+    Вход читается лениво, поэтому память не зависит от длины items.
+    Ошибка одного элемента попадает в BulkResult.error и не прерывает пакет.
+    Если потребитель перестаёт читать результаты, незавершённые задачи отменяются.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency должен быть >= 1")
+
+    if hasattr(items, "__aiter__"):
+        iterator = items.__aiter__()
+
+        async def next_item():
+            return await iterator.__anext__()
+    else:
+        sync_iterator = iter(items)
+
+        async def next_item():
+            try:
+                return next(sync_iterator)
+            except StopIteration:
+                raise StopAsyncIteration
+
+    async def run(index, item):
+        try:
+            return BulkResult(index, item, result=await func(item))
+        except Exception as e:
+            return BulkResult(index, item, error=e)
+
+    pending = set()
+    index = 0
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < concurrency:
+                try:
+                    item = await next_item()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                pending.add(asyncio.ensure_future(run(index, item)))
+                index += 1
+
+            if not pending:
+                return
+
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,238 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import httpx
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Ограниченный по размеру LRU-кэш с необязательным временем жизни записей.
+    Ведёт счётчики попаданий, промахов и вытеснений.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        """
+        :param maxsize: Максимальное число записей.
+        :param ttl: (Опционально) Время жизни записи в секундах.
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize должен быть >= 1")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # Вытеснено из-за переполнения
+        self.expirations = 0  # Удалено по истечении ttl
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._lookup(key) is not _MISSING
+
+    def _lookup(self, key: Hashable) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            return _MISSING
+        return value
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._lookup(key)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Сохраняет значение; ttl переопределяет время жизни по умолчанию."""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Удаляет запись (инвалидация) и возвращает её значение."""
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class UserCache:
+    """
+    Кэш пользователей Mattermost с доступом по id и по username.
+    Записи вытесняются по LRU и устаревают через ttl секунд; события
+    WebSocket user_updated / user_role_updated сбрасывают запись сразу.
+    """
+
+    INVALIDATING_EVENTS = ("user_updated", "user_role_updated")
+
+    def __init__(self, maxsize: int = 10000, ttl: Optional[float] = 300.0):
+        """
+        :param maxsize: Максимальное число пользователей в кэше.
+        :param ttl: Время жизни записи в секундах (None - без ограничения).
+        """
+        self.users = LRUCache(maxsize, ttl)
+        # username в нижнем регистре -> user_id: Mattermost хранит имена в нижнем регистре
+        self.usernames = LRUCache(maxsize, ttl)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, user_id: str) -> Any:
+        user = self.users.get(user_id)
+        if user is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return user
+
+    def get_by_username(self, username: str) -> Any:
+        user_id = self.usernames.get(username.lower())
+        user = self.users.get(user_id) if user_id is not None else None
+        if user is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return user
+
+    def add(self, user: Any):
+        user_id = getattr(user, "id", None)
+        if not user_id:
+            return
+        self.users.set(user_id, user)
+        username = getattr(user, "username", None)
+        if username:
+            self.usernames.set(username.lower(), user_id)
+
+    def invalidate(self, user_id: str):
+        user = self.users.pop(user_id)
+        if user is not None:
+            self.invalidations += 1
+            username = getattr(user, "username", None)
+            if username:
+                self.usernames.pop(username.lower())
+
+    def handle_event(self, event_type: Optional[str], data: Dict[str, Any]):
+        """Сбрасывает записи по событию WebSocket (сырой кадр Mattermost)."""
+        if event_type not in self.INVALIDATING_EVENTS:
+            return
+        payload = data.get("data") or {}
+        user_id = payload.get("user_id") or (payload.get("user") or {}).get("id")
+        if user_id:
+            self.invalidate(user_id)
+
+    def clear(self):
+        self.users.clear()
+        self.usernames.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.users),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.users.evictions,
+            "expirations": self.users.expirations,
+            "invalidations": self.invalidations,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class ResponseCache:
+    """
+    Кэш ответов GET по ETag для условных запросов.
+
+    Ответ 200 с заголовком ETag сохраняется; следующий такой же GET уходит
+    с If-None-Match, и ответ 304 заменяется сохранённым телом (как 200).
+    """
+
+    def __init__(self, maxsize: int = 1024, max_entry_size: int = 1024 * 1024):
+        """
+        :param maxsize: Максимальное число сохранённых ответов.
+        :param max_entry_size: Ответы с телом больше этого (байты) не кэшируются.
+        """
+        self.entries = LRUCache(maxsize)
+        self.max_entry_size = max_entry_size
+        self.requests = 0  # GET-запросов через кэш
+        self.conditional = 0  # Из них ушли с If-None-Match
+        self.not_modified = 0  # Ответов 304, обслуженных из кэша
+
+    def conditional_headers(self, key: Hashable) -> Tuple[Dict[str, str], Optional[tuple]]:
+        """
+        Заголовки условного запроса для key (пустые, если ответа в кэше нет).
+        :return: Заголовки и снимок записи, который нужно передать в process():
+            пока запрос в пути, запись могут вытеснить, а 304 всё равно нужно чем-то обслужить.
+        """
+        self.requests += 1
+        entry = self.entries.get(key)
+        if entry is None:
+            return {}, None
+        self.conditional += 1
+        return {"If-None-Match": entry[0]}, entry
+
+    def process(self, key: Hashable, response: httpx.Response,
+                entry: Optional[tuple] = None) -> httpx.Response:
+        """
+        Сохраняет ответ с ETag или подменяет 304 сохранённым ответом.
+        :param entry: Снимок записи из conditional_headers().
+        """
+        if response.status_code == 304:
+            if entry is None:
+                return response
+            self.not_modified += 1
+            if key not in self.entries:
+                # Запись вытеснили, пока запрос был в пути: ответ по-прежнему актуален
+                self.entries.set(key, entry)
+            etag, headers, content = entry
+            return httpx.Response(200, headers=headers, content=content, request=response.request)
+
+        etag = response.headers.get("ETag")
+        if response.status_code == 200 and etag and len(response.content) <= self.max_entry_size:
+            # Тело хранится уже распакованным, поэтому заголовки кодирования не сохраняем
+            headers = [(name, value) for name, value in response.headers.items()
+                       if name.lower() not in ("content-encoding", "content-length", "transfer-encoding")]
+            self.entries.set(key, (etag, headers, response.content))
+        elif response.status_code == 200:
+            self.entries.pop(key)
+        return response
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self.entries),
+            "requests": self.requests,
+            "conditional": self.conditional,
+            "not_modified": self.not_modified,
+            "hit_ratio": self.conditional / self.requests if self.requests else 0.0,
+            "not_modified_ratio": self.not_modified / self.conditional if self.conditional else 0.0,
+        }
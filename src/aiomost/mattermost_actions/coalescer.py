@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from aiomost.mattermost_actions.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class _Pending:
+    __slots__ = ("payload", "futures", "task")
+
+    def __init__(self):
+        self.payload: Any = None
+        self.futures: List[asyncio.Future] = []
+        self.task: Optional[asyncio.Task] = None
+
+
+class Coalescer:
+    """
+    Схлопывает частые обновления одного объекта (например, правки сообщения).
+
+    Первое обновление ключа отправляется сразу, следующие в течение interval
+    секунд копятся, и отправляется только последнее. Для одного ключа в работе
+    не больше одного запроса, поэтому порядок сохраняется, а последнее
+    обновление доставляется всегда (в том числе при aclose()).
+    """
+
+    def __init__(self, send_func: Callable[[Hashable, Any], Awaitable], interval: float = 0.5,
+                 maxsize: int = 10000):
+        """
+        :param send_func: Корутина send_func(key, payload), отправляющая обновление.
+        :param interval: Минимальный промежуток между отправками для одного ключа (секунды).
+        :param maxsize: Для скольких ключей помнить время последней отправки.
+        """
+        self.send_func = send_func
+        self.interval = interval
+        self._pending: Dict[Hashable, _Pending] = {}
+        self._last_sent = LRUCache(maxsize, ttl=interval)
+        self._closing: Optional[asyncio.Event] = None
+        self.submitted = 0
+        self.sent = 0
+        self.coalesced = 0  # Обновлений, заменённых более поздними до отправки
+
+    def submit(self, key: Hashable, payload: Any) -> asyncio.Future:
+        """
+        Планирует отправку payload для key.
+        :return: Future, который завершается, когда доставлено это или более позднее обновление.
+        """
+        if self._closing is None:
+            self._closing = asyncio.Event()
+        self.submitted += 1
+        future = asyncio.get_event_loop().create_future()
+        state = self._pending.get(key)
+        if state is None:
+            state = self._pending[key] = _Pending()
+        elif state.futures:
+            self.coalesced += 1
+        state.payload = payload
+        state.futures.append(future)
+        if state.task is None:
+            state.task = asyncio.ensure_future(self._drain(key, state))
+        return future
+
+    async def _drain(self, key: Hashable, state: _Pending):
+        futures: List[asyncio.Future] = []
+        try:
+            while state.futures:
+                last_sent = self._last_sent.get(key)
+                if last_sent is not None and not self._closing.is_set():
+                    wait = last_sent + self.interval - time.monotonic()
+                    if wait > 0:
+                        try:
+                            await asyncio.wait_for(self._closing.wait(), wait)
+                        except asyncio.TimeoutError:
+                            pass
+
+                payload, futures = state.payload, state.futures
+                state.payload, state.futures = None, []
+                self._last_sent.set(key, time.monotonic())
+                try:
+                    result = await self.send_func(key, payload)
+                except Exception as e:
+                    logger.error("Не удалось отправить обновление %r: %s", key, e)
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(e)
+                            future.exception()  # Ошибка уже залогирована
+                else:
+                    self.sent += 1
+                    for future in futures:
+                        if not future.done():
+                            future.set_result(result)
+        finally:
+            # Ключ освобождается всегда; при отмене неотправленные обновления отменяются,
+            # а следующий submit() запустит новую отправку
+            del self._pending[key]
+            for future in futures + state.futures:
+                future.cancel()
+
+    async def aclose(self):
+        """Немедленно отправляет все накопленные обновления и дожидается их доставки."""
+        if self._closing is None:
+            return
+        self._closing.set()
+        await asyncio.gather(*(state.task for state in list(self._pending.values())),
+                             return_exceptions=True)
+        self._closing.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "submitted": self.submitted,
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "pending": len(self._pending),
+        }
@@ -0,0 +1,100 @@
+import asyncio
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, Optional, Tuple
+
+
+class KeyedQueue:
+    """
+    Ограниченная очередь с упорядочиванием по ключу.
+
+    Элементы одного ключа выдаются get() строго по одному: следующий - только
+    после task_done(key) для предыдущего. Элементы разных ключей выдаются
+    независимо, поэтому несколько воркеров обрабатывают разные ключи
+    параллельно. Когда в очереди maxsize элементов, put() ждёт места.
+
+    Цикл воркера:
+        key, item = await queue.get()
+        try:
+            ...
+        finally:
+            queue.task_done(key)
+    """
+
+    def __init__(self, maxsize: int = 1000):
+        """:param maxsize: Максимум ожидающих элементов."""
+        self.maxsize = maxsize
+        self._keys: Dict[Hashable, Deque[Any]] = {}
+        self._ready: Optional[asyncio.Queue] = None  # Ключи, готовые к выдаче
+        self._space: Optional[asyncio.Semaphore] = None
+        self.pending = 0
+
+    def _start(self):
+        # Примитивы asyncio создаём внутри работающего цикла событий
+        if self._ready is None:
+            self._ready = asyncio.Queue()
+            self._space = asyncio.Semaphore(self.maxsize)
+
+    @property
+    def full(self) -> bool:
+        return self._space is not None and self._space.locked()
+
+    @property
+    def active_keys(self) -> int:
+        """Сколько ключей ждёт или обрабатывается."""
+        return len(self._keys)
+
+    async def put(self, key: Hashable, item: Any):
+        self._start()
+        await self._space.acquire()
+        items = self._keys.get(key)
+        if items is None:
+            # Ключ не обрабатывается и не ждёт выдачи: делаем его доступным воркерам
+            items = self._keys[key] = deque()
+            self._ready.put_nowait(key)
+        items.append(item)
+        self.pending += 1
+
+    async def get(self) -> Tuple[Hashable, Any]:
+        """Следующий элемент ключа, который сейчас никем не обрабатывается."""
+        self._start()
+        while True:
+            key = await self._ready.get()
+            items = self._keys.get(key)
+            if items:
+                item = items.popleft()
+                self._release()
+                return key, item
+            # Все элементы ключа вытеснены через pop_oldest
+            self._keys.pop(key, None)
+            self._ready.task_done()
+
+    def task_done(self, key: Hashable):
+        """Элемент ключа key обработан: ключ снова доступен для get()."""
+        if self._keys.get(key):
+            self._ready.put_nowait(key)
+        else:
+            self._keys.pop(key, None)
+        self._ready.task_done()
+
+    def pop_oldest(self, order: Callable[[Any], Any]) -> Optional[Any]:
+        """
+        Вытесняет самый старый ожидающий элемент.
+        :param order: order(item) -> значение, по которому сравнивается возраст.
+        :return: Вытесненный элемент или None, если ожидающих нет.
+        """
+        oldest = min((items for items in self._keys.values() if items),
+                     key=lambda items: order(items[0]), default=None)
+        if oldest is None:
+            return None
+        item = oldest.popleft()
+        self._release()
+        return item
+
+    def _release(self):
+        self.pending -= 1
+        self._space.release()
+
+    async def join(self):
+        """Ждёт, пока не будут обработаны все поставленные элементы."""
+        if self._ready is not None:
+            await self._ready.join()
@@ -0,0 +1,151 @@
+import re
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# ID объектов Mattermost: 26 символов [a-z0-9]
+_ID_RE = re.compile(r"^[a-z0-9]{26}$")
+# Сегменты, после которых в пути идёт произвольное значение (имя, email)
+_NAME_KEYS = frozenset(("username", "name", "email"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+@lru_cache(maxsize=4096)
+def template_endpoint(endpoint: str) -> str:
+    """
+    Заменяет идентификаторы в пути на {id} (имена - на {name}), чтобы
+    число различных меток в метриках было ограничено.
+    Например, api/v4/channels/<id>/members/<id> -> api/v4/channels/{id}/members/{id}.
+    """
+    segments = endpoint.strip("/").split("?", 1)[0].split("/")
+    for i, segment in enumerate(segments):
+        if i and segments[i - 1] in _NAME_KEYS:
+            segments[i] = "{name}"
+        elif _ID_RE.match(segment) or segment.isdigit():
+            segments[i] = "{id}"
+    return "/".join(segments)
+
+
+def escape_label(value: Any) -> str:
+    """Значение метки для текстового формата Prometheus: экранирует \\, " и перевод строки."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def status_class(status_code: Optional[int]) -> str:
+    """2xx / 4xx / ...; None (ответа нет, сетевая ошибка) - "error"."""
+    return f"{status_code // 100}xx" if status_code else "error"
+
+
+class _EndpointStats:
+    __slots__ = ("statuses", "buckets", "latency_sum", "count", "bytes_out", "bytes_in", "retries")
+
+    def __init__(self, bucket_count: int):
+        self.statuses: Dict[str, int] = {}
+        self.buckets = [0] * (bucket_count + 1)  # Последняя ячейка - +Inf
+        self.latency_sum = 0.0
+        self.count = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.retries = 0
+
+
+class RequestMetrics:
+    """
+    Метрики REST-клиента по endpoint'ам: число запросов по классам статуса,
+    гистограмма задержек, байты отправлено/получено и число повторов.
+    Метки - метод и шаблон endpoint'а (см. template_endpoint).
+    """
+
+    OTHER = "other"
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS, max_endpoints: int = 200,
+                 namespace: str = "aiomost"):
+        """
+        :param buckets: Границы ячеек гистограммы задержек (секунды).
+        :param max_endpoints: Сколько разных (метод, endpoint) учитывать отдельно;
+                              остальные попадают в endpoint="other".
+        :param namespace: Префикс имён метрик Prometheus.
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.max_endpoints = max_endpoints
+        self.namespace = namespace
+        self.endpoints: Dict[Tuple[str, str], _EndpointStats] = {}
+
+    def _stats(self, method: str, endpoint: str) -> _EndpointStats:
+        key = (method, template_endpoint(endpoint))
+        stats = self.endpoints.get(key)
+        if stats is None:
+            if len(self.endpoints) >= self.max_endpoints:
+                key = (method, self.OTHER)
+                stats = self.endpoints.get(key)
+            if stats is None:
+                stats = self.endpoints[key] = _EndpointStats(len(self.buckets))
+        return stats
+
+    def observe(self, method: str, endpoint: str, status_code: Optional[int], duration: float,
+                bytes_out: int = 0, bytes_in: int = 0):
+        """Учитывает одну попытку запроса (status_code=None - сетевая ошибка)."""
+        stats = self._stats(method, endpoint)
+        cls = status_class(status_code)
+        stats.statuses[cls] = stats.statuses.get(cls, 0) + 1
+        stats.buckets[bisect_left(self.buckets, duration)] += 1
+        stats.latency_sum += duration
+        stats.count += 1
+        stats.bytes_out += bytes_out
+        stats.bytes_in += bytes_in
+
+    def record_retry(self, method: str, endpoint: str):
+        self._stats(method, endpoint).retries += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Сводка по endpoint'ам: {"GET api/v4/users/{id}": {...}}."""
+        return {
+            f"{method} {endpoint}": {
+                "count": stats.count,
+                "statuses": dict(stats.statuses),
+                "avg_latency": stats.latency_sum / stats.count if stats.count else 0.0,
+                "bytes_out": stats.bytes_out,
+                "bytes_in": stats.bytes_in,
+                "retries": stats.retries,
+            }
+            for (method, endpoint), stats in self.endpoints.items()
+        }
+
+    def to_prometheus(self) -> str:
+        """Метрики в текстовом формате Prometheus (для эндпоинта /metrics)."""
+        ns = self.namespace
+        lines: List[str] = [
+            f"# HELP {ns}_http_requests_total Mattermost API requests by status class.",
+            f"# TYPE {ns}_http_requests_total counter",
+        ]
+        items = [(f'method="{escape_label(method)}",endpoint="{escape_label(endpoint)}"', stats)
+                 for (method, endpoint), stats in sorted(self.endpoints.items())]
+        for labels, stats in items:
+            for cls, count in sorted(stats.statuses.items()):
+                lines.append(f'{ns}_http_requests_total{{{labels},status_class="{cls}"}} {count}')
+
+        lines += [
+            f"# HELP {ns}_http_request_duration_seconds Mattermost API request latency.",
+            f"# TYPE {ns}_http_request_duration_seconds histogram",
+        ]
+        for labels, stats in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, stats.buckets):
+                cumulative += count
+                lines.append(f'{ns}_http_request_duration_seconds_bucket{{{labels},le="{bound}"}} '
+                             f'{cumulative}')
+            lines.append(f'{ns}_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} '
+                         f'{stats.count}')
+            lines.append(f'{ns}_http_request_duration_seconds_sum{{{labels}}} {stats.latency_sum}')
+            lines.append(f'{ns}_http_request_duration_seconds_count{{{labels}}} {stats.count}')
+
+        for name, attr, help_text in (
+            ("http_request_bytes_total", "bytes_out", "Bytes sent in request bodies."),
+            ("http_response_bytes_total", "bytes_in", "Bytes received in response bodies."),
+            ("http_retries_total", "retries", "Requests retried by the retry policy."),
+        ):
+            lines += [f"# HELP {ns}_{name} {help_text}", f"# TYPE {ns}_{name} counter"]
+            for labels, stats in items:
+                lines.append(f'{ns}_{name}{{{labels}}} {getattr(stats, attr)}')
+        return "\n".join(lines) + "\n"
@@ -1,51 +1,444 @@
+import asyncio
+import fnmatch
+import hashlib
+import logging
 import mimetypes
-from typing import Dict, List, Optional
-import aiohttp
+import os
+import tempfile
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
 import httpx
 
+from aiomost.mattermost_actions.avatar_store import MemoryAvatarHashStore
+from aiomost.mattermost_actions.batcher import BatchLoader
+from aiomost.mattermost_actions.bulk import BulkResult, bounded_map
+from aiomost.mattermost_actions.cache import LRUCache, ResponseCache, UserCache
+from aiomost.mattermost_actions.coalescer import Coalescer
+from aiomost.mattermost_actions.metrics import RequestMetrics
+from aiomost.mattermost_actions.outbox import Outbox
+from aiomost.mattermost_actions.pagination import paginate
+from aiomost.mattermost_actions.rate_limiter import RateLimiter
+from aiomost.mattermost_actions.retry import CircuitBreaker, RetryPolicy
+from aiomost.mattermost_actions.singleflight import SingleFlight
 from aiomost.mattermost_models.user.user_info.user_info_models import User
 
+try:
+    import h2  # noqa: F401  HTTP/2 для httpx: pip install httpx[http2]
+    _HAS_HTTP2 = True
+except ImportError:
+    _HAS_HTTP2 = False
+
+logger = logging.getLogger(__name__)
+
 
 class Mattermost:
-    def __init__(self, api_url: str, bot_token: str):
+    def __init__(
+        self,
+        api_url: str,
+        bot_token: str,
+        *,
+        timeout: float = 10.0,
+        connect_timeout: float = 5.0,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        verify: bool = True,
+        http2: bool = False,
+        rate_limiter: Optional[RateLimiter] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        dedupe_gets: Union[bool, Iterable[str]] = False,
+        etag_cache: Optional[ResponseCache] = None,
+        metrics: Optional[RequestMetrics] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        """
+        :param api_url: Базовый URL сервера Mattermost.
+        :param bot_token: Токен бота.
+        :param timeout: Таймаут чтения/записи/ожидания соединения из пула (секунды).
+        :param connect_timeout: Таймаут установки TCP/TLS соединения (секунды).
+        :param max_connections: Максимум одновременных соединений в пуле.
+        :param max_keepalive_connections: Сколько простаивающих соединений держать открытыми.
+        :param keepalive_expiry: Через сколько секунд простоя закрывать keep-alive соединение.
+        :param verify: Проверять ли TLS-сертификаты.
+        :param http2: Разрешить HTTP/2 (ALPN). Запросы мультиплексируются поверх
+                      нескольких соединений; если сервер или окружение HTTP/2
+                      не поддерживают, используется HTTP/1.1.
+        :param dedupe_gets: Схлопывать одновременные одинаковые GET-запросы в один:
+                            True - для всех endpoint'ов, список шаблонов fnmatch
+                            (например, "api/v4/users/*") - только для подходящих.
+                            Счётчик схлопнутых запросов - request_dedupe.collapsed.
+        :param etag_cache: (Опционально) ResponseCache: GET-запросы становятся условными
+                           (If-None-Match), и ответ 304 отдаётся из кэша как 200.
+        :param metrics: (Опционально) RequestMetrics: число запросов, задержки, байты
+                        и повторы по шаблонам endpoint'ов (экспорт - to_prometheus()).
+        :param transport: (Опционально) Транспорт httpx вместо сетевого, например
+                          MattermostStub.transport для работы без сервера. Параметры
+                          пула (limits, http2, verify) к нему не применяются.
+        """
         self.api_url = api_url
         self.bot_token = bot_token
         self.headers = {
             "Authorization": f"Bearer {self.bot_token}",
             "Content-Type": "application/json"
         }
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.verify = verify
+        self.http2 = http2
+        if http2 and not _HAS_HTTP2:
+            logger.warning(
+                "HTTP/2 недоступен (нет пакета h2), используется HTTP/1.1. "
+                "Установите: pip install aiomost[http2]")
+            self.http2 = False
+        self.http_version: Optional[str] = None  # Протокол последнего ответа
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.dedupe_gets = dedupe_gets if isinstance(dedupe_gets, bool) else tuple(dedupe_gets)
+        self.request_dedupe = SingleFlight()
+        self.etag_cache = etag_cache
+        self.metrics = metrics
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        Общий пул соединений, который используют все запросы клиента.
+        Создаётся при первом обращении и пересоздаётся после aclose().
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+        return self._client
+
+    def _build_client(self) -> httpx.AsyncClient:
+        # Авторизацию в клиент не кладём: через этот же пул скачиваются
+        # внешние файлы (аватары), и токен не должен туда утекать.
+        return httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=self.limits,
+            verify=self.verify,
+            http2=self.http2,
+            transport=self.transport,
+        )
 
-    async def send_request(self, endpoint: str, method: str = 'POST', json_data: Optional[Dict] = None, files: Optional[Dict] = None):
+    async def aclose(self):
+        """Закрывает пул соединений. Повторный вызов безопасен."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self):
+        self.client  # Открываем пул заранее
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def send_request(self, endpoint: str, method: str = 'POST', json_data: Optional[Dict] = None,
+                           files: Optional[Dict] = None, data: Optional[Dict] = None,
+                           idempotency_key: Optional[str] = None, content=None,
+                           content_headers: Optional[Dict[str, str]] = None,
+                           dedupe: Optional[bool] = None, params: Optional[Dict] = None):
+        """
+        Выполняет запрос к API Mattermost через общий пул соединений.
+        :param idempotency_key: Ключ идемпотентности; разрешает повтор POST-запроса
+                                и передаётся в заголовке Idempotency-Key.
+        :param content: Готовое тело POST-запроса: bytes или асинхронный итератор
+                        чанков. Потоковое тело нельзя отправить повторно, поэтому
+                        такие запросы не повторяются.
+        :param content_headers: Заголовки тела (Content-Type, Content-Length) для content.
+        :param dedupe: Схлопнуть GET с уже выполняющимся таким же запросом и разделить
+                       его ответ. None - по настройке dedupe_gets клиента.
+        :param params: (Опционально) Параметры строки запроса для GET.
+        """
         headers = self.headers.copy()  # Создаем копию заголовков
+        method = method.upper()
 
         if files:  # Если загружаем файлы, убираем Content-Type, т.к. httpx сам добавит нужный
             headers.pop("Content-Type", None)
-
-        async with httpx.AsyncClient() as client:
-            if method.upper() == 'POST':
-                response = await client.post(
-                    f"{self.api_url}/{endpoint}",
-                    headers=headers,
-                    json=json_data if not files else None,
-                    files=files
-                )
-            elif method.upper() == 'PUT':
-                response = await client.put(f"{self.api_url}/{endpoint}", headers=headers, json=json_data)
-            elif method.upper() == 'DELETE':
-                response = await client.delete(f"{self.api_url}/{endpoint}", headers=headers)
+        if content_headers:
+            headers.update(content_headers)
+        if idempotency_key:
+            headers["Idempotency-Key"] = idempotency_key
+
+        streaming = content is not None and not isinstance(content, bytes)
+        if method == 'POST' and content is not None:
+            body = {"content": content}
+        elif method == 'POST':
+            body = {"json": json_data if not files else None, "files": files, "data": data}
+        elif method == 'PUT':
+            body = {"json": json_data}
+        elif method == 'DELETE':
+            body = {}
+        else:
+            method, body = 'GET', {"params": params}
+
+        if method == 'GET':
+            # Заголовки GET-запроса не зависят от вызова, поэтому ключ - endpoint и параметры
+            key = (endpoint, tuple(sorted(params.items()))) if params else endpoint
+            if self._should_dedupe(endpoint, dedupe):
+                response = await self.request_dedupe.do(
+                    key, lambda: self._send_get(key, endpoint, headers, body))
             else:
-                response = await client.get(
-                    f"{self.api_url}/{endpoint}",
-                    headers=headers
-                )
+                response = await self._send_get(key, endpoint, headers, body)
+        else:
+            response = await self._send_with_retries(
+                endpoint, method, headers, body, streaming, idempotency_key)
 
         if response.status_code != 200:
             response.raise_for_status()
         return response
 
+    async def _send_get(self, key, endpoint: str, headers: Dict, body: Dict) -> httpx.Response:
+        cache = self.etag_cache
+        if cache is None:
+            return await self._send_with_retries(endpoint, 'GET', headers, body)
+        conditional, entry = cache.conditional_headers(key)
+        headers = {**headers, **conditional}
+        response = await self._send_with_retries(endpoint, 'GET', headers, body)
+        return cache.process(key, response, entry)
+
+    def _should_dedupe(self, endpoint: str, dedupe: Optional[bool]) -> bool:
+        if dedupe is not None:
+            return dedupe
+        if isinstance(self.dedupe_gets, bool):
+            return self.dedupe_gets
+        return any(fnmatch.fnmatchcase(endpoint, pattern) for pattern in self.dedupe_gets)
+
+    async def _send_with_retries(self, endpoint: str, method: str, headers: Dict, body: Dict,
+                                 streaming: bool = False,
+                                 idempotency_key: Optional[str] = None) -> httpx.Response:
+        """Отправляет запрос, повторяя его по retry_policy и учитывая circuit_breaker."""
+        policy = self.retry_policy
+        breaker = self.circuit_breaker
+        idempotent = (policy is not None and not streaming
+                      and policy.is_idempotent(method, idempotency_key))
+        attempt = 0
+        while True:
+            if breaker is not None:
+                breaker.before_request()
+            try:
+                response = await self._send_once(endpoint, method, headers, body, streaming)
+            except httpx.TransportError as error:
+                if breaker is not None:
+                    breaker.record_failure()
+                if (policy is None or streaming
+                        or not policy.should_retry_error(attempt, idempotent, error)):
+                    raise
+                delay = policy.backoff(attempt)
+            except BaseException:
+                if breaker is not None:
+                    breaker.release()
+                raise
+            else:
+                if breaker is not None:
+                    if response.status_code >= 500:
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+                if policy is None or not policy.should_retry_response(
+                        attempt, idempotent, response.status_code):
+                    break
+                delay = policy.delay_for_response(attempt, response.headers,
+                                                  response.status_code)
+
+            policy.retries += 1
+            if self.metrics is not None:
+                self.metrics.record_retry(method, endpoint)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+        return response
+
+    async def _send_once(self, endpoint: str, method: str, headers: Dict, body: Dict,
+                         streaming: bool = False) -> httpx.Response:
+        """Одна логическая попытка запроса с учётом клиентского лимита (429 ждут в очереди)."""
+        limiter = self.rate_limiter
+        attempt = 0
+        while True:
+            if limiter is not None:
+                await limiter.acquire(endpoint)
+
+            response = await self._request(method, endpoint, headers, body)
+            self.http_version = response.http_version
+
+            if limiter is None:
+                return response
+            limiter.update(response.headers)
+            if (response.status_code != 429 or streaming
+                    or attempt >= limiter.max_429_retries):
+                return response
+            # Сервер отклонил запрос по лимиту, не обработав его: ставим в очередь снова
+            limiter.throttle(response.headers)
+            if self.metrics is not None:
+                self.metrics.record_retry(method, endpoint)
+            attempt += 1
+
+    async def _request(self, method: str, endpoint: str, headers: Dict, body: Dict) -> httpx.Response:
+        metrics = self.metrics
+        if metrics is None:
+            return await self.client.request(
+                method, f"{self.api_url}/{endpoint}", headers=headers, **body)
+
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(
+                method, f"{self.api_url}/{endpoint}", headers=headers, **body)
+        except httpx.TransportError:
+            metrics.observe(method, endpoint, None, time.perf_counter() - started)
+            raise
+        metrics.observe(method, endpoint, response.status_code, time.perf_counter() - started,
+                        int(response.request.headers.get("Content-Length", 0)),
+                        len(response.content))
+        return response
+
+    @asynccontextmanager
+    async def stream_request(self, endpoint: str, method: str = 'GET') -> AsyncIterator[httpx.Response]:
+        """
+        Потоковый запрос к API: тело ответа не читается в память целиком,
+        а отдаётся по частям через response.aiter_bytes(). Ответы 4xx/5xx
+        приводят к httpx.HTTPStatusError. Повторы для потоковых запросов не делаются.
+
+        Пример:
+            async with bot.stream_request(f"api/v4/files/{file_id}") as response:
+                async for chunk in response.aiter_bytes():
+                    ...
+        """
+        headers = {"Authorization": self.headers["Authorization"]}
+        method = method.upper()
+        breaker = self.circuit_breaker
+        if breaker is not None:
+            breaker.before_request()
+        response = None
+        started = time.perf_counter()
+        try:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire(endpoint)
+            started = time.perf_counter()
+            async with self.client.stream(
+                    method, f"{self.api_url}/{endpoint}", headers=headers) as response:
+                # Задержка потокового запроса - до получения заголовков ответа
+                duration = time.perf_counter() - started
+                try:
+                    self.http_version = response.http_version
+                    if self.rate_limiter is not None:
+                        self.rate_limiter.update(response.headers)
+                    if breaker is not None:
+                        if response.status_code >= 500:
+                            breaker.record_failure()
+                        else:
+                            breaker.record_success()
+                    if response.status_code >= 400:
+                        await response.aread()
+                        response.raise_for_status()
+                    yield response
+                finally:
+                    if self.metrics is not None:
+                        self.metrics.observe(method, endpoint, response.status_code, duration,
+                                             bytes_in=response.num_bytes_downloaded)
+        except httpx.TransportError:
+            if breaker is not None:
+                breaker.record_failure()
+            if self.metrics is not None and response is None:
+                self.metrics.observe(method, endpoint, None, time.perf_counter() - started)
+            raise
+        except BaseException:
+            if breaker is not None:
+                breaker.release()
+            raise
+
 
 class MMBot(Mattermost):
-    async def reply_message(self, channel_id: str, message_id: str, text: str, actions: Optional[List[Dict]] = None):
+    def __init__(self, api_url: str, bot_token: str, *, dm_cache_size: int = 1024,
+                 dm_cache_ttl: Optional[float] = None, user_cache: Optional[UserCache] = None,
+                 user_batch_window: Optional[float] = None, user_batch_size: int = 100,
+                 outbox_workers: int = 4, outbox_size: int = 1000, outbox_overflow: str = "block",
+                 edit_coalesce_interval: Optional[float] = None,
+                 avatar_hashes=None,
+                 **kwargs):
+        """
+        :param dm_cache_size: Сколько DM-каналов (user_id -> channel_id) держать в кэше.
+        :param dm_cache_ttl: (Опционально) Время жизни записи кэша DM-каналов, секунды.
+        :param user_cache: (Опционально) UserCache для get_user_info / get_user_by_username.
+                           Чтобы записи сбрасывались по событиям WebSocket, передайте
+                           бота в mattermost_ws_listener(..., bot=bot).
+        :param user_batch_window: (Опционально) Окно в секундах, за которое вызовы
+                                  get_user_info / get_user_by_username собираются в один
+                                  POST api/v4/users/ids (или /users/usernames).
+                                  None - каждый вызов отдельным GET.
+        :param user_batch_size: Максимум пользователей в одном пакетном запросе.
+        :param outbox_workers: Сколько сообщений из очереди enqueue_message
+                               отправляется одновременно.
+        :param outbox_size: Максимум сообщений, ожидающих отправки.
+        :param outbox_overflow: Поведение при переполнении очереди: "block",
+                                "drop_oldest" или "raise" (см. Outbox).
+        :param edit_coalesce_interval: (Опционально) Включает схлопывание правок:
+                                       правка (enqueue_edit / edit_message) одного
+                                       сообщения уходит не чаще
+                                       раза в столько секунд, отправляется последний текст.
+        :param avatar_hashes: (Опционально) Хранилище хэшей аватаров для set_user_avatar /
+                              sync_avatars: MemoryAvatarHashStore (по умолчанию) или
+                              RedisAvatarHashStore.
+        Остальные параметры - см. Mattermost.
+        """
+        super().__init__(api_url, bot_token, **kwargs)
+        self.user_cache = user_cache
+        self.bot_user_id: Optional[str] = None
+        self.dm_channels = LRUCache(dm_cache_size, dm_cache_ttl)
+        self._lookups = SingleFlight()  # Одновременные одинаковые запросы выполняются один раз
+        self.user_id_loader: Optional[BatchLoader] = None
+        self.username_loader: Optional[BatchLoader] = None
+        if user_batch_window is not None:
+            self.user_id_loader = BatchLoader(self._fetch_users_by_ids, user_batch_window, user_batch_size)
+            self.username_loader = BatchLoader(self._fetch_users_by_usernames, user_batch_window,
+                                               user_batch_size)
+        # Если retry_policy у бота нет, очередь повторяет отправку сама
+        # (каждое сообщение идёт с ключом идемпотентности, дубликатов не будет)
+        self.outbox = Outbox(outbox_workers, outbox_size, outbox_overflow,
+                             retry_policy=None if self.retry_policy is not None else RetryPolicy())
+        self.avatar_hashes = avatar_hashes if avatar_hashes is not None else MemoryAvatarHashStore()
+        self.edit_coalescer: Optional[Coalescer] = None
+        if edit_coalesce_interval is not None:
+            self.edit_coalescer = Coalescer(self._put_message, edit_coalesce_interval)
+
+    async def aclose(self):
+        """Доставляет отложенные правки и очередь сообщений, затем закрывает пул соединений."""
+        if self.edit_coalescer is not None:
+            await self.edit_coalescer.aclose()
+        await self.outbox.aclose()
+        await super().aclose()
+
+    async def enqueue_message(self, channel_id: str, text: str, actions: Optional[List[Dict]] = None,
+                              root_id: Optional[str] = None) -> asyncio.Future:
+        """
+        Ставит сообщение в очередь отправки и сразу возвращает управление.
+        Сообщения в один канал уходят в порядке постановки, в разные - параллельно.
+        :param channel_id: ID канала.
+        :param text: Текст сообщения.
+        :param actions: (Опционально) Кнопки (действия) в сообщении.
+        :param root_id: (Опционально) ID сообщения, на которое отправляется ответ в тред.
+        :return: Future с ответом API; ожидать его не обязательно.
+        """
+        idempotency_key = uuid.uuid4().hex  # Один ключ на все повторы сообщения
+
+        def send():
+            if root_id:
+                return self.reply_message(channel_id, root_id, text, actions,
+                                          idempotency_key=idempotency_key)
+            return self.send_message(channel_id, text, actions, idempotency_key=idempotency_key)
+
+        return await self.outbox.put(channel_id, send)
+
+    async def reply_message(self, channel_id: str, message_id: str, text: str, actions: Optional[List[Dict]] = None,
+                            idempotency_key: Optional[str] = None):
         message = {
             "channel_id": channel_id,
             "message": text,
@@ -56,8 +449,11 @@ class MMBot(Mattermost):
         # Добавляем кнопки только если они переданы
         if actions:
             message["props"]["attachments"] = [{"actions": actions}]
+        if idempotency_key:
+            message["pending_post_id"] = idempotency_key
 
-        response = await self.send_request('api/v4/posts', 'POST', json_data=message)
+        response = await self.send_request('api/v4/posts', 'POST', json_data=message,
+                                           idempotency_key=idempotency_key)
 
         if response.status_code == 201:
             pass
@@ -65,78 +461,108 @@ class MMBot(Mattermost):
         else:
             print(f"❌ Ошибка {response.status_code}: {response.text}")
 
-    async def send_message_with_files(self, channel_id: str, text: str, file_ids: List[str]):
-        file_ids_uploaded = []
+    async def send_message_with_files(self, channel_id: str, text: str, file_ids: List[str],
+                                      concurrency: int = 4, chunk_size: int = 64 * 1024):
+        """
+        Пересылает файлы Mattermost (по их ID) в канал и отправляет сообщение с ними.
+        Каждый файл скачивается потоком и по частям сразу передаётся в загрузку,
+        поэтому в памяти одновременно находится не больше chunk_size * concurrency байт.
+        :param channel_id: ID канала.
+        :param text: Текст сообщения.
+        :param file_ids: ID исходных файлов.
+        :param concurrency: Сколько файлов пересылается одновременно.
+        :param chunk_size: Размер чанка при передаче (байты).
+        """
+        uploaded: Dict[int, str] = {}
+
+        async def forward(item):
+            index, file_id = item
+            return index, await self._forward_file(file_id, channel_id, chunk_size)
 
-        async with httpx.AsyncClient() as client:
-            for file_id in file_ids:
-                # Загружаем файл с сервера Mattermost
-                file_response = await client.get(
-                    f"{self.api_url}/api/v4/files/{file_id}",
-                    headers={"Authorization": f"Bearer {self.bot_token}"}
-                )
+        async for res in bounded_map(enumerate(file_ids), forward, concurrency):
+            if not res.ok:
+                raise res.error
+            index, new_file_id = res.result
+            if new_file_id:
+                uploaded[index] = new_file_id
 
-                if file_response.status_code != 200:
-                    print(f"❌ Ошибка при загрузке файла с ID {file_id}")
-                    continue
+        # Сохраняем исходный порядок файлов
+        file_ids_uploaded = [uploaded[index] for index in sorted(uploaded)]
 
-                file_content = file_response.content
+        # Если файлы были успешно загружены, отправляем сообщение
+        if file_ids_uploaded:
+            post_data = {
+                "channel_id": channel_id,
+                "message": text,
+                "file_ids": file_ids_uploaded
+            }
+
+            try:
+                await self.send_request('api/v4/posts', 'POST', json_data=post_data)
+                # print("✅ Сообщение с файлами успешно отправлено")
+            except httpx.HTTPStatusError as e:
+                print(
+                    f"❌ Ошибка при отправке сообщения: {e.response.status_code}")
+
+        else:
+            print("❌ Не удалось загрузить файлы, сообщение не отправлено")
+
+    async def _forward_file(self, file_id: str, channel_id: str, chunk_size: int) -> Optional[str]:
+        """
+        Скачивает файл потоком и на лету загружает его в канал multipart-запросом.
+        Возвращает ID нового файла или None при ошибке HTTP или сети.
+        """
+        try:
+            async with self.stream_request(f"api/v4/files/{file_id}") as file_response:
                 content_type = file_response.headers.get(
                     "Content-Type", "application/octet-stream")
                 extension = mimetypes.guess_extension(content_type) or ""
 
-                # Загружаем файл в Mattermost
-                files = {
-                    "files": (f"downloaded_file{extension}", file_content, content_type),
-                }
-                data = {"channel_id": channel_id}
-
-                upload_response = await client.post(
-                    f"{self.api_url}/api/v4/files",
-                    headers={"Authorization": f"Bearer {self.bot_token}"},
-                    files=files,
-                    data=data  # В `httpx` канал передается через `data`, а не в `files`
-                )
-
-                if upload_response.status_code != 201:
+                boundary = uuid.uuid4().hex
+                preamble = (
+                    f"--{boundary}\r\n"
+                    f'Content-Disposition: form-data; name="channel_id"\r\n\r\n'
+                    f"{channel_id}\r\n"
+                    f"--{boundary}\r\n"
+                    f'Content-Disposition: form-data; name="files"; '
+                    f'filename="downloaded_file{extension}"\r\n'
+                    f"Content-Type: {content_type}\r\n\r\n"
+                ).encode()
+                epilogue = f"\r\n--{boundary}--\r\n".encode()
+
+                async def body():
+                    yield preamble
+                    async for chunk in file_response.aiter_bytes(chunk_size):
+                        yield chunk
+                    yield epilogue
+
+                content_headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+                length = file_response.headers.get("Content-Length")
+                if length and "Content-Encoding" not in file_response.headers:
+                    content_headers["Content-Length"] = str(
+                        len(preamble) + int(length) + len(epilogue))
+
+                try:
+                    upload_response = await self.send_request(
+                        "api/v4/files", 'POST', content=body(), content_headers=content_headers)
+                except (httpx.HTTPStatusError, httpx.TransportError):
                     print(
                         f"❌ Ошибка при загрузке файла с ID {file_id} в Mattermost")
-                    continue
-
-                upload_json = upload_response.json()
-                new_file_id = upload_json["file_infos"][0]["id"]
-                file_ids_uploaded.append(new_file_id)
-
-            # Если файлы были успешно загружены, отправляем сообщение
-            if file_ids_uploaded:
-                post_data = {
-                    "channel_id": channel_id,
-                    "message": text,
-                    "file_ids": file_ids_uploaded
-                }
-
-                post_response = await client.post(
-                    f"{self.api_url}/api/v4/posts",
-                    headers={
-                        "Authorization": f"Bearer {self.bot_token}",
-                        "Content-Type": "application/json"
-                    },
-                    json=post_data
-                )
-
-                if post_response.status_code == 201:
-                    pass
-                    # print("✅ Сообщение с файлами успешно отправлено")
-                else:
-                    print(
-                        f"❌ Ошибка при отправке сообщения: {post_response.status_code}")
+                    return None
+        except (httpx.HTTPStatusError, httpx.TransportError):
+            print(f"❌ Ошибка при загрузке файла с ID {file_id}")
+            return None
 
-            else:
-                print("❌ Не удалось загрузить файлы, сообщение не отправлено")
+        upload_json = upload_response.json()
+        return upload_json["file_infos"][0]["id"]
 
-    async def send_message(self, channel_id: str, text: str, actions: Optional[List[Dict]] = None):
+    async def send_message(self, channel_id: str, text: str, actions: Optional[List[Dict]] = None,
+                           idempotency_key: Optional[str] = None):
         """
         Отправляет сообщение в Mattermost с возможностью добавления кнопок.
+        :param idempotency_key: (Опционально) Ключ идемпотентности. Передаётся как
+                                pending_post_id, по которому Mattermost отбрасывает
+                                дубликаты, и разрешает повтор запроса (RetryPolicy).
         """
         message = {
             "channel_id": channel_id,
@@ -148,9 +574,13 @@ class MMBot(Mattermost):
         if actions:
             message["props"]["attachments"] = [{"actions": actions}]
 
+        if idempotency_key:
+            message["pending_post_id"] = idempotency_key
+
         # print("📩 Отправка сообщения:", message)  # Логируем перед отправкой
 
-        response = await self.send_request('api/v4/posts', 'POST', json_data=message)
+        response = await self.send_request('api/v4/posts', 'POST', json_data=message,
+                                           idempotency_key=idempotency_key)
 
         if response.status_code == 201:
             pass
@@ -160,6 +590,31 @@ class MMBot(Mattermost):
 
         return response.json()  # Возвращаем ответ API (может быть полезно)
 
+    async def send_messages_many(
+        self,
+        messages: Union[Iterable[Tuple], AsyncIterable[Tuple]],
+        concurrency: int = 10,
+    ) -> AsyncIterator[BulkResult]:
+        """
+        Отправляет много сообщений параллельно (не больше concurrency одновременно)
+        через общий пул соединений и отдаёт результаты по мере готовности.
+        :param messages: Итератор или асинхронный итератор кортежей
+                         (channel_id, text) или (channel_id, text, actions).
+        :param concurrency: Сколько сообщений отправляется одновременно.
+        :return: Асинхронный итератор BulkResult: item - исходный кортеж,
+                 result - ответ API, error - исключение, если отправка не удалась.
+
+        Пример:
+            async for res in bot.send_messages_many((ch, "Релиз!") for ch in channels):
+                if not res.ok:
+                    print(res.item[0], res.error)
+        """
+        async def send(item):
+            return await self.send_message(*item)
+
+        async for result in bounded_map(messages, send, concurrency):
+            yield result
+
     async def update_notification_settings(self, user_id: str):
         """
         Обновляет настройки уведомлений пользователя.
@@ -182,7 +637,28 @@ class MMBot(Mattermost):
     async def edit_message(self, message_id: str, text: str, actions: Optional[List[Dict]] = None):
         """
         Редактирует сообщение в Mattermost.
+        При заданном edit_coalesce_interval правка проходит через схлопывание
+        (см. enqueue_edit), и метод возвращается после её доставки.
         """
+        if self.edit_coalescer is not None:
+            await self.edit_coalescer.submit(message_id, (text, actions))
+            return
+        await self._put_message(message_id, (text, actions))
+
+    def enqueue_edit(self, message_id: str, text: str,
+                     actions: Optional[List[Dict]] = None) -> asyncio.Future:
+        """
+        Планирует правку сообщения и сразу возвращает управление.
+        При заданном edit_coalesce_interval частые правки одного сообщения
+        схлопываются: уходит не больше одной правки за интервал, с последним текстом.
+        :return: Future, который завершается после доставки этой (или более поздней) правки.
+        """
+        if self.edit_coalescer is not None:
+            return self.edit_coalescer.submit(message_id, (text, actions))
+        return asyncio.ensure_future(self._put_message(message_id, (text, actions)))
+
+    async def _put_message(self, message_id: str, edit: Tuple[str, Optional[List[Dict]]]):
+        text, actions = edit
         message = {
             "id": message_id,
             "message": text,
@@ -201,100 +677,299 @@ class MMBot(Mattermost):
         else:
             print(f"❌ Ошибка {response.status_code}: {response.text}")
 
-    async def get_files_by_ids(self, file_ids: List[str]):
+    async def get_files_by_ids(self, file_ids: List[str], concurrency: int = 4):
         """ Получает файлы из Mattermost по их ID и возвращает список их данных. """
-        files_data = []
-
-        async with httpx.AsyncClient() as client:
-            for file_id in file_ids:
-                file_response = await client.get(
-                    f"{self.api_url}/api/v4/files/{file_id}",
-                    headers={"Authorization": f"Bearer {self.bot_token}"}
-                )
-
-                if file_response.status_code != 200:
-                    print(f"❌ Ошибка при загрузке файла с ID {file_id}")
-                    continue
-
-                file_content = file_response.content
-                content_type = file_response.headers.get(
-                    "Content-Type", "application/octet-stream")
-                extension = mimetypes.guess_extension(content_type) or ".bin"
-                filename = f"{file_id}{extension}"
+        files_data = [file_data async for file_data in self.iter_files_by_ids(file_ids, concurrency=concurrency)]
+        order = {file_id: index for index, file_id in enumerate(file_ids)}
+        files_data.sort(key=lambda file_data: order[file_data["file_id"]])
+        return files_data  # Список загруженных файлов
 
-                files_data.append({
-                    "filename": filename,
-                    "content": file_content,
-                    "content_type": content_type
-                })
+    async def iter_files_by_ids(self, file_ids: Iterable[str], dest_dir: Optional[str] = None,
+                                concurrency: int = 4, chunk_size: int = 64 * 1024):
+        """
+        Скачивает файлы Mattermost параллельно и отдаёт их по мере готовности.
+        :param file_ids: ID файлов.
+        :param dest_dir: (Опционально) Каталог: файлы пишутся на диск по частям,
+                         и вместо "content" в результате будет "path".
+        :param concurrency: Сколько файлов скачивается одновременно.
+        :param chunk_size: Размер чанка при скачивании (байты).
+        :return: Асинхронный итератор словарей file_id, filename, content_type,
+                 size и content (bytes) или path.
+        """
+        async def download(file_id):
+            try:
+                return await self._download_file(file_id, dest_dir, chunk_size)
+            except httpx.HTTPStatusError:
+                print(f"❌ Ошибка при загрузке файла с ID {file_id}")
+                return None
+
+        async for res in bounded_map(file_ids, download, concurrency):
+            if not res.ok:
+                raise res.error
+            if res.result is not None:
+                yield res.result
+
+    async def _download_file(self, file_id: str, dest_dir: Optional[str], chunk_size: int) -> Dict:
+        async with self.stream_request(f"api/v4/files/{file_id}") as file_response:
+            content_type = file_response.headers.get(
+                "Content-Type", "application/octet-stream")
+            extension = mimetypes.guess_extension(content_type) or ".bin"
+            filename = f"{file_id}{extension}"
+            file_data = {
+                "file_id": file_id,
+                "filename": filename,
+                "content_type": content_type,
+            }
 
-        return files_data  # Список загруженных файлов
+            if dest_dir is None:
+                file_data["content"] = await file_response.aread()
+                file_data["size"] = len(file_data["content"])
+                return file_data
+
+            path = os.path.join(dest_dir, filename)
+            size = 0
+            with open(path, "wb") as file:
+                async for chunk in file_response.aiter_bytes(chunk_size):
+                    file.write(chunk)
+                    size += len(chunk)
+            file_data["path"] = path
+            file_data["size"] = size
+            return file_data
 
     async def get_user_info(self, user_id: str) -> Optional[User]:
         """
         Получает информацию о пользователе по user_id и возвращает объект User.
+        При заданном user_cache сначала проверяется кэш.
+        При заданном user_batch_window запрос объединяется с соседними в один пакет.
         """
+        if self.user_cache is not None:
+            user = self.user_cache.get(user_id)
+            if user is not None:
+                return user
+
+        if self.user_id_loader is not None:
+            return self._user_from_batch(await self.user_id_loader.load(user_id))
+
         endpoint = f"api/v4/users/{user_id}"
         response = await self.send_request(endpoint, 'GET')
 
         if response.status_code == 200:
-            return User(**response.json())  # Конвертируем JSON в объект User
+            user = User(**response.json())  # Конвертируем JSON в объект User
+            if self.user_cache is not None:
+                self.user_cache.add(user)
+            return user
         else:
             print(f"❌ Ошибка {response.status_code}: {response.text}")
             return None  # Возвращаем None при ошибке
 
-    async def set_user_avatar(self, user_id: str, avatar_url: str):
+    def _user_from_batch(self, data: Optional[Dict]) -> Optional[User]:
+        # Каждый вызывающий получает собственный объект User
+        if data is None:
+            return None
+        user = User(**data)
+        if self.user_cache is not None:
+            self.user_cache.add(user)
+        return user
+
+    async def _fetch_users_by_ids(self, user_ids: List[str]) -> Dict[str, Dict]:
+        response = await self.send_request('api/v4/users/ids', 'POST', json_data=user_ids)
+        return {user["id"]: user for user in response.json()}
+
+    async def _fetch_users_by_usernames(self, usernames: List[str]) -> Dict[str, Dict]:
+        response = await self.send_request('api/v4/users/usernames', 'POST', json_data=usernames)
+        return {user["username"].lower(): user for user in response.json()}
+
+    async def iter_channel_posts(self, channel_id: str, since: Optional[int] = None,
+                                 per_page: int = 200, prefetch: int = 1) -> AsyncIterator[Dict]:
+        """
+        Перебирает сообщения канала.
+        :param channel_id: ID канала.
+        :param since: (Опционально) Время в миллисекундах: вернуть только сообщения,
+                      созданные или изменённые позже него (одним запросом, от старых к новым).
+                      Без since сообщения идут страницами от новых к старым.
+        :param per_page: Размер страницы (не больше 200).
+        :param prefetch: Сколько страниц загружать заранее.
+        :return: Асинхронный итератор словарей сообщений.
+
+        Пример:
+            async for post in bot.iter_channel_posts(channel_id):
+                if post["create_at"] < cutoff:
+                    break  # Остальные страницы не запрашиваются
+        """
+        endpoint = f"api/v4/channels/{channel_id}/posts"
+        if since is not None:
+            response = await self.send_request(endpoint, 'GET', params={"since": since})
+            posts = response.json().get("posts") or {}
+            for post in sorted(posts.values(), key=lambda post: post.get("create_at", 0)):
+                yield post
+            return
+
+        async def fetch(page):
+            response = await self.send_request(
+                endpoint, 'GET', params={"page": page, "per_page": per_page})
+            post_list = response.json()
+            posts = post_list.get("posts") or {}
+            return [posts[post_id] for post_id in post_list.get("order") or [] if post_id in posts]
+
+        async for post in paginate(fetch, per_page, prefetch):
+            yield post
+
+    async def iter_channel_members(self, channel_id: str, per_page: int = 200,
+                                   prefetch: int = 1) -> AsyncIterator[Dict]:
+        """
+        Перебирает участников канала (словари ChannelMember: user_id, roles, ...).
+        :param channel_id: ID канала.
+        :param per_page: Размер страницы (не больше 200).
+        :param prefetch: Сколько страниц загружать заранее.
+        """
+        endpoint = f"api/v4/channels/{channel_id}/members"
+
+        async def fetch(page):
+            response = await self.send_request(
+                endpoint, 'GET', params={"page": page, "per_page": per_page})
+            return response.json()
+
+        async for member in paginate(fetch, per_page, prefetch):
+            yield member
+
+    async def iter_team_users(self, team_id: str, per_page: int = 200,
+                              prefetch: int = 1) -> AsyncIterator[User]:
+        """
+        Перебирает пользователей команды.
+        :param team_id: ID команды.
+        :param per_page: Размер страницы (не больше 200).
+        :param prefetch: Сколько страниц загружать заранее.
+        """
+        async for user in self.iter_users(per_page, prefetch, in_team=team_id):
+            yield user
+
+    async def iter_users(self, per_page: int = 200, prefetch: int = 1,
+                         **filters) -> AsyncIterator[User]:
+        """
+        Перебирает пользователей сервера. Полученные объекты попадают в user_cache.
+        :param per_page: Размер страницы (не больше 200).
+        :param prefetch: Сколько страниц загружать заранее.
+        :param filters: Дополнительные фильтры GET api/v4/users (in_team, in_channel, active, ...).
+        """
+        async def fetch(page):
+            response = await self.send_request(
+                'api/v4/users', 'GET', params={**filters, "page": page, "per_page": per_page})
+            return response.json()
+
+        async for data in paginate(fetch, per_page, prefetch):
+            user = User(**data)
+            if self.user_cache is not None:
+                self.user_cache.add(user)
+            yield user
+
+    async def set_user_avatar(self, user_id: str, avatar_url: str, force: bool = False):
         """
         Загружает аватар по ссылке и устанавливает его в качестве аватара пользователя в Mattermost.
+        Изображение скачивается потоком через общий пул соединений (см. параметр verify)
+        во временный файл; если его sha256 совпадает с хэшем последней загрузки
+        в avatar_hashes, повторная загрузка в Mattermost не выполняется.
         :param user_id: ID пользователя в Mattermost
         :param avatar_url: Ссылка на изображение Bitrix24
+        :param force: Загрузить аватар, даже если он не изменился.
         """
-        async with aiohttp.ClientSession() as session:
-            async with session.get(avatar_url, ssl=False) as response:
-                if response.status != 200:
-                    print(f"❌ Ошибка загрузки аватара: {response.status}")
-                    return False
+        try:
+            status = await self._sync_avatar(user_id, avatar_url, force)
+        except httpx.HTTPStatusError as e:
+            print(f"❌ Ошибка загрузки аватара: {e.response.status_code}")
+            return False
 
-                image_bytes = await response.read()
-                content_type = response.headers.get(
-                    "Content-Type", "application/octet-stream")
-                extension = mimetypes.guess_extension(content_type) or ".jpg"
+        if status == "updated":
+            print("✅ Аватар успешно обновлен в Mattermost!")
+        return True
 
-                files = {
-                    "image": (f"avatar{extension}", image_bytes, content_type),
-                }
+    async def sync_avatars(
+        self,
+        avatars: Union[Iterable[Tuple[str, str]], AsyncIterable[Tuple[str, str]]],
+        concurrency: int = 8,
+        force: bool = False,
+    ) -> AsyncIterator[BulkResult]:
+        """
+        Массово обновляет аватары (не больше concurrency одновременно).
+        :param avatars: Итератор или асинхронный итератор пар (user_id, avatar_url).
+        :param concurrency: Сколько аватаров обрабатывается одновременно.
+        :param force: Загружать аватары, даже если они не изменились.
+        :return: Асинхронный итератор BulkResult: result - "updated" или "unchanged",
+                 error - исключение, если скачать или загрузить аватар не удалось.
+
+        Пример:
+            async for r in bot.sync_avatars((u.id, u.photo_url) for u in directory):
+                if not r.ok:
+                    print(r.item, r.error)
+        """
+        async def sync(item):
+            user_id, avatar_url = item
+            return await self._sync_avatar(user_id, avatar_url, force)
+
+        async for result in bounded_map(avatars, sync, concurrency):
+            yield result
+
+    async def _sync_avatar(self, user_id: str, avatar_url: str, force: bool = False,
+                           chunk_size: int = 64 * 1024) -> str:
+        with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as image:
+            digest = hashlib.sha256()
+            async with self.client.stream("GET", avatar_url, follow_redirects=True) as response:
+                if response.status_code != 200:
+                    response.raise_for_status()  # 3xx после редиректов - тоже ошибка
+                content_type = response.headers.get("Content-Type", "application/octet-stream")
+                async for chunk in response.aiter_bytes(chunk_size):
+                    digest.update(chunk)
+                    image.write(chunk)
+
+            # Хэш учитывает и тип: смена формата при тех же байтах - тоже изменение
+            digest.update(content_type.encode())
+            avatar_hash = digest.hexdigest()
+            if not force and await self.avatar_hashes.get(user_id) == avatar_hash:
+                return "unchanged"
+
+            image.seek(0)
+            extension = mimetypes.guess_extension(content_type.split(";")[0].strip()) or ".jpg"
+            files = {
+                "image": (f"avatar{extension}", image, content_type),
+            }
+            await self.send_request(f"api/v4/users/{user_id}/image", "POST", files=files)
 
-                upload_response = await self.send_request(
-                    f"api/v4/users/{user_id}/image", "POST", files=files
-                )
-
-                if upload_response.status_code == 200:
-                    print("✅ Аватар успешно обновлен в Mattermost!")
-                    return True
-                else:
-                    print(
-                        f"❌ Ошибка при обновлении аватара: {upload_response.text}")
-                    return False
+        await self.avatar_hashes.set(user_id, avatar_hash)
+        return "updated"
 
     async def get_bot_user_id(self) -> Optional[str]:
         """
         Получает ID бота по его токену.
+        ID запрашивается один раз и дальше берётся из self.bot_user_id.
         """
+        if self.bot_user_id:
+            return self.bot_user_id
+        return await self._lookups.do("users/me", self._fetch_bot_user_id)
+
+    async def _fetch_bot_user_id(self) -> Optional[str]:
         response = await self.send_request('api/v4/users/me', 'GET')
 
         if response.status_code == 200:
-            return response.json().get("id")
+            self.bot_user_id = response.json().get("id")
+            return self.bot_user_id
         else:
             print(f"❌ Ошибка {response.status_code}: {response.text}")
             return None
 
-    async def send_direct_message(self, user_id: str, text: str, actions: Optional[List[Dict]] = None):
+    async def get_direct_channel_id(self, user_id: str) -> Optional[str]:
         """
-        Отправляет личное сообщение пользователю в Mattermost.
-        :param user_id: ID пользователя, которому отправляется сообщение.
-        :param text: Текст сообщения.
-        :param actions: (Опционально) Кнопки (действия) в сообщении.
+        Возвращает ID личного канала бота с пользователем, создавая канал при необходимости.
+        Результат кэшируется (см. dm_cache_size / dm_cache_ttl), одновременные
+        запросы для одного пользователя создают канал один раз.
+        :param user_id: ID пользователя.
+        :return: ID канала или None при ошибке.
         """
+        channel_id = self.dm_channels.get(user_id)
+        if channel_id:
+            return channel_id
+        return await self._lookups.do(
+            ("channels/direct", user_id), lambda: self._create_direct_channel(user_id))
+
+    async def _create_direct_channel(self, user_id: str) -> Optional[str]:
         # Получаем ID бота
         bot_user_id = await self.get_bot_user_id()
         if not bot_user_id:
@@ -306,12 +981,30 @@ class MMBot(Mattermost):
             'api/v4/channels/direct', 'POST', json_data=[bot_user_id, user_id]
         )
 
-        if response.status_code != 201:
+        if response.status_code not in (200, 201):
             print(
                 f"❌ Ошибка при создании DM-канала: {response.status_code} {response.text}")
             return None
 
         channel_id = response.json().get("id")
+        self.dm_channels.set(user_id, channel_id)
+        return channel_id
+
+    async def send_direct_message(self, user_id: str, text: str, actions: Optional[List[Dict]] = None,
+                                  idempotency_key: Optional[str] = None):
+        """
+        Отправляет личное сообщение пользователю в Mattermost.
+        ID бота и DM-канала берутся из кэша; если закэшированный канал больше
+        не существует, он создаётся заново.
+        :param user_id: ID пользователя, которому отправляется сообщение.
+        :param text: Текст сообщения.
+        :param actions: (Опционально) Кнопки (действия) в сообщении.
+        :param idempotency_key: (Опционально) Ключ идемпотентности (см. send_message).
+        """
+        cached = user_id in self.dm_channels
+        channel_id = await self.get_direct_channel_id(user_id)
+        if not channel_id:
+            return None
 
         # Формируем сообщение
         message = {
@@ -322,9 +1015,24 @@ class MMBot(Mattermost):
 
         if actions:
             message["props"]["attachments"] = [{"actions": actions}]
+        if idempotency_key:
+            message["pending_post_id"] = idempotency_key
 
         # Отправляем сообщение
-        response = await self.send_request('api/v4/posts', 'POST', json_data=message)
+        try:
+            response = await self.send_request('api/v4/posts', 'POST', json_data=message,
+                                               idempotency_key=idempotency_key)
+        except httpx.HTTPStatusError as e:
+            if not cached or e.response.status_code not in (403, 404):
+                raise
+            # Канал из кэша удалён или недоступен: сбрасываем запись и создаём заново
+            self.dm_channels.pop(user_id)
+            channel_id = await self.get_direct_channel_id(user_id)
+            if not channel_id:
+                return None
+            message["channel_id"] = channel_id
+            response = await self.send_request('api/v4/posts', 'POST', json_data=message,
+                                               idempotency_key=idempotency_key)
 
         if response.status_code == 201:
             print("✅ Личное сообщение отправлено успешно!")
@@ -333,6 +1041,25 @@ class MMBot(Mattermost):
 
         return response.json()  # Возвращаем JSON-ответ от API
 
+    async def send_direct_messages(
+        self,
+        messages: Union[Iterable[Tuple], AsyncIterable[Tuple]],
+        concurrency: int = 10,
+    ) -> AsyncIterator[BulkResult]:
+        """
+        Отправляет много личных сообщений параллельно; недостающие DM-каналы
+        создаются одновременно (не больше concurrency запросов за раз).
+        :param messages: Итератор или асинхронный итератор кортежей
+                         (user_id, text) или (user_id, text, actions).
+        :param concurrency: Сколько сообщений обрабатывается одновременно.
+        :return: Асинхронный итератор BulkResult (см. send_messages_many).
+        """
+        async def send(item):
+            return await self.send_direct_message(*item)
+
+        async for result in bounded_map(messages, send, concurrency):
+            yield result
+
     async def delete_message(self, message_id: str) -> Optional[str]:
         """
         Удаляет сообщение по его ID.
@@ -404,11 +1131,23 @@ class MMBot(Mattermost):
         :param username: Имя пользователя в Mattermost.
         :return: Объект User или None, если пользователь не найден.
         """
+        if self.user_cache is not None:
+            user = self.user_cache.get_by_username(username)
+            if user is not None:
+                return user
+
+        if self.username_loader is not None:
+            # Mattermost хранит username в нижнем регистре
+            return self._user_from_batch(await self.username_loader.load(username.lower()))
+
         endpoint = f"api/v4/users/username/{username}"
         response = await self.send_request(endpoint, 'GET')
 
         if response.status_code == 200:
-            return User(**response.json())  # Конвертируем JSON в объект User
+            user = User(**response.json())  # Конвертируем JSON в объект User
+            if self.user_cache is not None:
+                self.user_cache.add(user)
+            return user
         else:
             print(f"❌ Ошибка {response.status_code}: {response.text}")
             return None
@@ -0,0 +1,164 @@
+import asyncio
+import itertools
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+import httpx
+
+from aiomost.mattermost_actions.keyed_queue import KeyedQueue
+from aiomost.mattermost_actions.retry import RetryPolicy
+
+OVERFLOW_POLICIES = ("block", "drop_oldest", "raise")
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxFull(Exception):
+    """Очередь исходящих переполнена (overflow="raise") или задание вытеснено (drop_oldest)."""
+
+
+class _Job:
+    __slots__ = ("seq", "key", "func", "future")
+
+    def __init__(self, seq: int, key: Hashable, func: Callable[[], Awaitable], future: asyncio.Future):
+        self.seq = seq
+        self.key = key
+        self.func = func
+        self.future = future
+
+
+class Outbox:
+    """
+    Очередь исходящих запросов с пулом отправителей.
+
+    Задания с одним ключом (например, channel_id) выполняются строго по очереди,
+    с разными ключами - параллельно (не больше workers одновременно).
+    Очередь ограничена maxsize заданиями; при переполнении действует overflow:
+    "block" - put() ждёт места, "drop_oldest" - самое старое невыполненное
+    задание отбрасывается с OutboxFull, "raise" - put() бросает OutboxFull.
+    """
+
+    def __init__(self, workers: int = 4, maxsize: int = 1000, overflow: str = "block",
+                 retry_policy: Optional[RetryPolicy] = None):
+        """
+        :param workers: Сколько заданий выполняется одновременно.
+        :param maxsize: Максимум ожидающих заданий.
+        :param overflow: Поведение при переполнении: "block", "drop_oldest" или "raise".
+        :param retry_policy: (Опционально) Повторы заданий при сетевых ошибках и
+                             ответах из retry_statuses. Задания должны быть идемпотентны.
+        """
+        if workers < 1 or maxsize < 1:
+            raise ValueError("workers и maxsize должны быть >= 1")
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow должен быть одним из {OVERFLOW_POLICIES}")
+        self.workers = workers
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.retry_policy = retry_policy
+        self._jobs = KeyedQueue(maxsize)
+        self._worker_tasks = []
+        self._seq = itertools.count()
+        self.active = 0
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retries = 0
+
+    @property
+    def pending(self) -> int:
+        return self._jobs.pending
+
+    def _start(self):
+        if not self._worker_tasks:
+            self._worker_tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def put(self, key: Hashable, func: Callable[[], Awaitable]) -> asyncio.Future:
+        """
+        Ставит задание func() в очередь ключа key.
+        :return: Future с результатом func() (или её исключением).
+        """
+        self._start()
+        if self._jobs.full:
+            if self.overflow == "raise":
+                raise OutboxFull(f"В очереди уже {self.pending} заданий")
+            if self.overflow == "drop_oldest":
+                self._drop_oldest()
+
+        job = _Job(next(self._seq), key, func, asyncio.get_event_loop().create_future())
+        await self._jobs.put(key, job)
+        return job.future
+
+    def _drop_oldest(self):
+        job = self._jobs.pop_oldest(lambda job: job.seq)
+        if job is None:
+            return
+        self.dropped += 1
+        job.future.set_exception(OutboxFull("Задание вытеснено из переполненной очереди"))
+        job.future.exception()  # Вытеснение уже залогировано ниже, future можно не ждать
+        logger.warning("Очередь исходящих переполнена, отброшено задание для %r", job.key)
+
+    async def _worker(self):
+        while True:
+            key, job = await self._jobs.get()
+            self.active += 1
+            try:
+                await self._run(job)
+            finally:
+                self.active -= 1
+                self._jobs.task_done(key)
+
+    async def _run(self, job: _Job):
+        policy = self.retry_policy
+        attempt = 0
+        while True:
+            try:
+                result = await job.func()
+            except Exception as error:
+                delay = self._retry_delay(attempt, error) if policy is not None else None
+                if delay is None:
+                    self.failed += 1
+                    if not job.future.done():
+                        job.future.set_exception(error)
+                    return
+                policy.retries += 1
+                self.retries += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+            else:
+                self.sent += 1
+                if not job.future.done():
+                    job.future.set_result(result)
+                return
+
+    def _retry_delay(self, attempt: int, error: Exception) -> Optional[float]:
+        policy = self.retry_policy
+        if isinstance(error, httpx.HTTPStatusError):
+            response = error.response
+            if policy.should_retry_response(attempt, True, response.status_code):
+                return policy.delay_for_response(attempt, response.headers,
+                                                 response.status_code)
+        elif policy.should_retry_error(attempt, True, error):
+            return policy.backoff(attempt)
+        return None
+
+    async def join(self):
+        """Ждёт, пока не будут выполнены все поставленные задания."""
+        await self._jobs.join()
+
+    async def aclose(self):
+        """Дожидается отправки очереди и останавливает воркеров."""
+        await self.join()
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self.pending,
+            "active": self.active,
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "retries": self.retries,
+        }
@@ -0,0 +1,48 @@
+import asyncio
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, List
+
+
+async def paginate(
+    fetch_page: Callable[[int], Awaitable[List[Any]]],
+    per_page: int,
+    prefetch: int = 1,
+) -> AsyncIterator[Any]:
+    """
+    Перебирает элементы постраничного API Mattermost (page=0, 1, ...).
+
+    Пока вызывающий обрабатывает текущую страницу, следующие prefetch страниц
+    уже запрашиваются; больше prefetch страниц вперёд не загружается.
+    Страница короче per_page считается последней. Если вызывающий прекращает
+    перебор, незавершённые запросы отменяются и дальнейшие страницы не запрашиваются.
+    :param fetch_page: Корутина, возвращающая список элементов страницы по её номеру.
+    :param per_page: Размер страницы, переданный в fetch_page.
+    :param prefetch: Сколько страниц загружать заранее (0 - без упреждения).
+    """
+    if prefetch < 0:
+        raise ValueError("prefetch должен быть >= 0")
+
+    pages = deque()
+    next_page = 0
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pages) <= prefetch:
+                pages.append(asyncio.ensure_future(fetch_page(next_page)))
+                next_page += 1
+            if not pages:
+                return
+
+            items = await pages.popleft()
+            if len(items) < per_page:
+                # Последняя страница: заранее запрошенные дальше неё не нужны
+                exhausted = True
+                while pages:
+                    pages.pop().cancel()
+            for item in items:
+                yield item
+    finally:
+        for task in pages:
+            if task.done() and not task.cancelled():
+                task.exception()  # Ошибка ненужной страницы не должна попасть в лог asyncio
+            task.cancel()
@@ -0,0 +1,209 @@
+import asyncio
+import time
+from typing import Dict, Mapping, Optional
+
+
+def parse_retry_after(headers: Mapping[str, str], rate_limited: bool = True) -> Optional[float]:
+    """
+    Возвращает паузу (в секундах) из заголовков Retry-After / X-RateLimit-Reset.
+    Mattermost отдаёт в X-RateLimit-Reset количество секунд до сброса лимита.
+    :param rate_limited: Ответ 429. X-RateLimit-Reset приходит в каждом ответе,
+        поэтому для остальных ответов учитывается только Retry-After.
+    """
+    headers_to_check = ("Retry-After", "X-RateLimit-Reset") if rate_limited else ("Retry-After",)
+    for header in headers_to_check:
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            continue
+    return None
+
+
+def endpoint_family(endpoint: str) -> str:
+    """
+    Семейство эндпоинта для раздельных лимитов:
+    'api/v4/posts/abc' -> 'posts', 'api/v4/users/me' -> 'users'.
+    """
+    parts = endpoint.strip("/").split("/")
+    if len(parts) > 2 and parts[0] == "api":
+        return parts[2]
+    return parts[0]
+
+
+class TokenBucket:
+    """
+    Корзина токенов: rate токенов в секунду, не больше burst накопленных.
+    """
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.capacity = float(burst or max(1, int(rate)))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        """FIFO-очередь ожидающих; создаётся внутри работающего event loop."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Через сколько секунд можно будет взять токен (0 - прямо сейчас)."""
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def block_for(self, seconds: float):
+        """Запрещает выдачу токенов на заданное время (ответ 429)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    def sync(self, limit: int, remaining: int, reset: Optional[float]):
+        """Подстраивает корзину под фактическое состояние лимита на сервере."""
+        self._refill(time.monotonic())
+        self.capacity = float(max(1, limit))
+        self.tokens = min(self.tokens, float(remaining))
+        if reset and limit > remaining:
+            # За reset секунд сервер восполняет корзину от remaining до limit
+            self.rate = (limit - remaining) / reset
+
+
+class RateLimiter:
+    """
+    Клиентский ограничитель запросов к Mattermost.
+
+    Глобальная корзина соответствует лимиту сервера на токен бота; при
+    per_endpoint=True (или заданных endpoint_rates) дополнительно действует
+    корзина на семейство эндпоинтов (posts, users, channels, ...).
+    Запросы сверх лимита не отклоняются, а ждут своей очереди (FIFO).
+    Ответы с заголовками X-RateLimit-* подстраивают глобальную корзину,
+    ответ 429 приостанавливает выдачу токенов и запрос повторяется.
+    """
+
+    def __init__(
+        self,
+        rate: float = 10.0,
+        burst: Optional[int] = None,
+        per_endpoint: bool = False,
+        endpoint_rates: Optional[Dict[str, float]] = None,
+        adaptive: bool = True,
+        max_429_retries: int = 5,
+    ):
+        """
+        :param rate: Запросов в секунду (глобально).
+        :param burst: Размер корзины; по умолчанию равен rate.
+        :param per_endpoint: Включить корзины на семейства эндпоинтов с тем же rate.
+        :param endpoint_rates: Явные лимиты семейств, например {"posts": 5}.
+        :param adaptive: Подстраиваться под заголовки X-RateLimit-*.
+        :param max_429_retries: Сколько раз повторять запрос после ответа 429.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.per_endpoint = per_endpoint
+        self.endpoint_rates = endpoint_rates or {}
+        self.adaptive = adaptive
+        self.max_429_retries = max_429_retries
+
+        self.bucket = TokenBucket(rate, burst)
+        self.family_buckets: Dict[str, TokenBucket] = {}
+
+        self.queue_depth = 0  # Запросов, ожидающих токен прямо сейчас
+        self.total_acquired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+        self.throttled = 0  # Получено ответов 429
+
+    def _family_bucket(self, endpoint: str) -> Optional[TokenBucket]:
+        family = endpoint_family(endpoint)
+        if family not in self.endpoint_rates and not self.per_endpoint:
+            return None
+        bucket = self.family_buckets.get(family)
+        if bucket is None:
+            rate = self.endpoint_rates.get(family, self.rate)
+            bucket = self.family_buckets[family] = TokenBucket(rate, self.burst)
+        return bucket
+
+    @staticmethod
+    async def _take(bucket: TokenBucket):
+        async with bucket.lock:
+            while True:
+                delay = bucket.delay()
+                if delay <= 0:
+                    bucket.consume()
+                    return
+                await asyncio.sleep(delay)
+
+    async def acquire(self, endpoint: str) -> float:
+        """Ждёт разрешения на запрос к endpoint. Возвращает время ожидания."""
+        started = time.monotonic()
+        self.queue_depth += 1
+        try:
+            family_bucket = self._family_bucket(endpoint)
+            if family_bucket is not None:
+                await self._take(family_bucket)
+            await self._take(self.bucket)
+        finally:
+            self.queue_depth -= 1
+
+        waited = time.monotonic() - started
+        self.total_acquired += 1
+        self.total_wait += waited
+        self.last_wait = waited
+        self.max_wait = max(self.max_wait, waited)
+        return waited
+
+    def update(self, headers: Mapping[str, str]):
+        """Учитывает заголовки X-RateLimit-Limit/Remaining/Reset ответа."""
+        if not self.adaptive:
+            return
+        limit = headers.get("X-RateLimit-Limit")
+        remaining = headers.get("X-RateLimit-Remaining")
+        if limit is None or remaining is None:
+            return
+        try:
+            limit_value, remaining_value = int(limit), int(remaining)
+        except ValueError:
+            return
+        reset = headers.get("X-RateLimit-Reset")
+        try:
+            reset_value = float(reset) if reset is not None else None
+        except ValueError:
+            reset_value = None
+        self.bucket.sync(limit_value, remaining_value, reset_value)
+
+    def throttle(self, headers: Mapping[str, str]):
+        """Обрабатывает ответ 429: останавливает выдачу токенов до сброса лимита."""
+        self.throttled += 1
+        delay = parse_retry_after(headers)
+        self.bucket.block_for(delay if delay is not None else 1 / self.bucket.rate)
+
+    def stats(self) -> Dict[str, float]:
+        """Текущая очередь и статистика ожидания."""
+        return {
+            "queue_depth": self.queue_depth,
+            "acquired": self.total_acquired,
+            "throttled": self.throttled,
+            "total_wait": self.total_wait,
+            "max_wait": self.max_wait,
+            "last_wait": self.last_wait,
+            "avg_wait": self.total_wait / self.total_acquired if self.total_acquired else 0.0,
+            "rate": self.bucket.rate,
+        }
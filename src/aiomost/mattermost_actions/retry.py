@@ -0,0 +1,143 @@
+import random
+import time
+from typing import Iterable, Mapping, Optional
+
+import httpx
+
+from aiomost.mattermost_actions.rate_limiter import parse_retry_after
+
+
+class CircuitOpenError(Exception):
+    """Запрос не отправлен: сервер Mattermost считается недоступным."""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"Circuit breaker открыт, повтор через {retry_in:.1f} с")
+        self.retry_in = retry_in
+
+
+# Ошибки, при которых запрос гарантированно не дошёл до сервера
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class RetryPolicy:
+    """
+    Политика повторов для send_request.
+
+    GET/PUT/DELETE повторяются по умолчанию, POST - только с ключом
+    идемпотентности (или если соединение так и не было установлено).
+    Пауза - экспоненциальная с полным джиттером; Retry-After сервера
+    имеет приоритет.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 10.0,
+        jitter: bool = True,
+        retry_methods: Iterable[str] = ("GET", "PUT", "DELETE"),
+        retry_statuses: Iterable[int] = (429, 502, 503, 504),
+        respect_retry_after: bool = True,
+    ):
+        """
+        :param max_attempts: Всего попыток, включая первую.
+        :param backoff_base: Базовая пауза перед первым повтором (секунды).
+        :param backoff_max: Потолок паузы (секунды).
+        :param jitter: Случайная пауза в [0, backoff] вместо фиксированной.
+        :param retry_methods: Методы, которые безопасно повторять.
+        :param retry_statuses: Коды ответа, после которых делается повтор.
+        :param respect_retry_after: Учитывать заголовок Retry-After.
+        """
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.retry_methods = {method.upper() for method in retry_methods}
+        self.retry_statuses = set(retry_statuses)
+        self.respect_retry_after = respect_retry_after
+        self.retries = 0  # Сделано повторов за всё время
+
+    def is_idempotent(self, method: str, idempotency_key: Optional[str] = None) -> bool:
+        return method in self.retry_methods or idempotency_key is not None
+
+    def backoff(self, attempt: int) -> float:
+        """Пауза перед повтором номер attempt (начиная с 0)."""
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(0, delay) if self.jitter else delay
+
+    def delay_for_response(self, attempt: int, headers: Mapping[str, str],
+                           status_code: int = 429) -> float:
+        """
+        Пауза перед повтором после ответа status_code. X-RateLimit-Reset
+        учитывается только для 429: для 5xx без Retry-After - экспоненциальная пауза.
+        """
+        if self.respect_retry_after:
+            retry_after = parse_retry_after(headers, rate_limited=status_code == 429)
+            if retry_after is not None:
+                return min(self.backoff_max, retry_after)
+        return self.backoff(attempt)
+
+    def should_retry_response(self, attempt: int, idempotent: bool, status_code: int) -> bool:
+        return (idempotent and attempt + 1 < self.max_attempts
+                and status_code in self.retry_statuses)
+
+    def should_retry_error(self, attempt: int, idempotent: bool, error: Exception) -> bool:
+        if attempt + 1 >= self.max_attempts:
+            return False
+        if isinstance(error, _NOT_SENT_ERRORS):
+            return True
+        return idempotent and isinstance(error, httpx.TransportError)
+
+
+class CircuitBreaker:
+    """
+    Размыкатель цепи: после failure_threshold подряд идущих сбоев (сетевые
+    ошибки и ответы 5xx) запросы на recovery_timeout секунд отклоняются
+    сразу с CircuitOpenError, затем пропускается пробный запрос.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        """
+        :param failure_threshold: Сколько сбоев подряд размыкают цепь.
+        :param recovery_timeout: Сколько секунд цепь разомкнута до пробного запроса.
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0  # Запросов отклонено без обращения к серверу
+        self._probe_in_flight = False
+
+    def before_request(self):
+        """Проверяет, можно ли отправлять запрос; иначе бросает CircuitOpenError."""
+        if self.state == self.CLOSED:
+            return
+        elapsed = time.monotonic() - self.opened_at
+        if self.state == self.OPEN and elapsed >= self.recovery_timeout:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return
+        self.rejected += 1
+        raise CircuitOpenError(max(0.0, self.recovery_timeout - elapsed))
+
+    def release(self):
+        """Запрос прерван без результата (например, отменён): пробу можно повторить."""
+        self._probe_in_flight = False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
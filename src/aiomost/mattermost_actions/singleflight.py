@@ -0,0 +1,31 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    Схлопывает одновременные вызовы с одинаковым ключом: работа выполняется
+    один раз, результат (или исключение) получают все ожидающие.
+    Работа идёт в отдельной задаче, поэтому отмена одного ожидающего
+    не прерывает её для остальных.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.collapsed = 0  # Вызовов, получивших чужой результат без своего запроса
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        self.calls += 1
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            self.collapsed += 1
+        return await asyncio.shield(task)
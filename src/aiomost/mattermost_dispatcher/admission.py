@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import random
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from aiomost.mattermost_actions.metrics import escape_label
+from aiomost.mattermost_dispatcher.event_pool import DispatchPool, _Item
+
+logger = logging.getLogger(__name__)
+
+# Полосы приоритета: чем меньше номер, тем раньше обрабатывается событие
+HIGH, NORMAL, LOW = 0, 1, 2
+LANES = ("high", "normal", "low")
+
+SHED_POLICIES = ("drop_oldest", "drop_lowest", "sample")
+
+
+class EventShed(Exception):
+    """Событие отброшено контролем нагрузки и не было обработано."""
+
+
+def default_priority(update_type: str, event) -> int:
+    """
+    Нажатия кнопок и личные сообщения (каналы D и G) - HIGH, сообщения в
+    каналах и user_added - NORMAL, остальное (typing, status_change, ...) - LOW.
+    """
+    if update_type == "button_query":
+        return HIGH
+    if update_type == "posted":
+        channel_type = getattr(getattr(event, "data", None), "channel_type", None)
+        return HIGH if channel_type in ("D", "G") else NORMAL
+    if update_type == "user_added":
+        return NORMAL
+    return LOW
+
+
+class PriorityDispatchPool(DispatchPool):
+    """
+    Пул обработки событий с контролем нагрузки.
+
+    События раскладываются по полосам приоритета (см. default_priority), воркеры
+    всегда берут событие из самой приоритетной непустой полосы. put() никогда не
+    ждёт: при переполнении (maxsize всего или limits[update_type] по типу)
+    событие отбрасывается по политике policy:
+
+    - "drop_oldest" - вытесняется самое старое событие не приоритетнее нового
+      (при лимите типа - только того же типа);
+    - "drop_lowest" - вытесняется самое новое событие из самой низкой полосы, если
+      она ниже полосы нового события, иначе отбрасывается новое событие; при
+      лимите типа - самое новое событие того же типа из самой низкой полосы не
+      выше полосы нового события;
+    - "sample" - когда очередь заполнена больше чем на sample_watermark, из полос
+      ниже HIGH принимается лишь доля sample_rate событий; при полной очереди -
+      как "drop_lowest".
+
+    Более приоритетное событие никогда не вытесняется ради менее приоритетного:
+    личное сообщение и сообщение в канале - оба posted, но лимит типа posted
+    вытесняет сообщения в каналах, а не личные.
+
+    Future отброшенного события завершается исключением EventShed; число
+    отброшенных событий по типам - в stats()["shed_by_type"].
+    """
+
+    def __init__(self, workers: int = 1, maxsize: int = 1000, policy: str = "drop_lowest",
+                 limits: Optional[Dict[str, int]] = None,
+                 priority_func: Callable[[str, Any], int] = default_priority,
+                 sample_rate: float = 0.1, sample_watermark: float = 0.8,
+                 seed: Optional[int] = None):
+        """
+        :param workers: Число одновременно обрабатываемых событий.
+        :param maxsize: Максимум ожидающих событий всех типов.
+        :param policy: Политика отбрасывания: "drop_oldest", "drop_lowest" или "sample".
+        :param limits: Максимум ожидающих событий по типам, например {"typing": 10}.
+        :param priority_func: priority_func(update_type, event) -> HIGH / NORMAL / LOW.
+        :param sample_rate: Доля принимаемых событий ниже HIGH под нагрузкой (policy="sample").
+        :param sample_watermark: Заполненность очереди, с которой начинается выборка.
+        :param seed: Зерно генератора случайных чисел для policy="sample".
+        """
+        if policy not in SHED_POLICIES:
+            raise ValueError(f"policy должен быть одним из {SHED_POLICIES}")
+        super().__init__(workers=workers, maxsize=maxsize)
+        self.policy = policy
+        self.limits = dict(limits or {})
+        self.priority_func = priority_func
+        self.sample_rate = sample_rate
+        self.sample_watermark = sample_watermark
+        self._random = random.Random(seed)
+        self._lanes: List[Deque[_Item]] = [deque() for _ in LANES]
+        self._type_counts: Dict[str, int] = {}
+        self._items: Optional[asyncio.Semaphore] = None
+        self._idle: Optional[asyncio.Event] = None
+        self.pending = 0
+        self.shed = 0
+        self.shed_by_type: Dict[str, int] = {}
+
+    def _start(self):
+        if self._items is None:
+            self._items = asyncio.Semaphore(0)  # Число событий, доступных воркерам
+            self._idle = asyncio.Event()
+            self._idle.set()
+        if not self._worker_tasks:
+            self._worker_tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    @property
+    def depth(self) -> int:
+        return self.pending
+
+    async def _enqueue(self, item: _Item):
+        update_type = item[1]
+        lane = min(max(self.priority_func(update_type, item[2]), HIGH), LOW)
+        limit = self.limits.get(update_type)
+        type_full = limit is not None and self._type_counts.get(update_type, 0) >= limit
+        full = self.pending >= self.maxsize
+
+        if (self.policy == "sample" and lane > HIGH and not (type_full or full)
+                and self.pending >= self.sample_watermark * self.maxsize
+                and self._random.random() >= self.sample_rate):
+            self._shed(item)
+            return
+
+        victim = None
+        if type_full or full:
+            victim = self._choose_victim(update_type, lane, type_full)
+            if victim is None:
+                self._shed(item)
+                return
+            self._remove(victim)
+            self._shed(victim)
+
+        self._lanes[lane].append(item)
+        self._type_counts[update_type] = self._type_counts.get(update_type, 0) + 1
+        self.pending += 1
+        if victim is None:
+            self._idle.clear()
+            self._items.release()
+
+    def _choose_victim(self, update_type: str, lane: int, type_full: bool) -> Optional[_Item]:
+        # Более приоритетные события не вытесняются ради менее приоритетного
+        lanes = self._lanes[lane:]
+        if type_full:
+            lanes = [[queued for queued in queue if queued[1] == update_type] for queue in lanes]
+        if self.policy == "drop_oldest":
+            return min((queue[0] for queue in lanes if queue),
+                       key=lambda queued: queued[0], default=None)
+        lowest = next((queue for queue in reversed(lanes) if queue), None)
+        if lowest is None or (not type_full and lowest is lanes[0]):
+            return None
+        return lowest[-1]
+
+    def _remove(self, item: _Item):
+        for queue in self._lanes:
+            for i, queued in enumerate(queue):
+                if queued is item:
+                    del queue[i]
+                    self._type_counts[item[1]] -= 1
+                    self.pending -= 1
+                    return
+
+    def _shed(self, item: _Item):
+        update_type, future = item[1], item[4]
+        self.shed += 1
+        self.shed_by_type[update_type] = self.shed_by_type.get(update_type, 0) + 1
+        if not future.done():
+            future.set_exception(EventShed(f"Событие '{update_type}' отброшено под нагрузкой"))
+            future.exception()  # Отброшенные события учитываются в stats(), future можно не ждать
+        logger.debug("Событие '%s' отброшено (policy=%s)", update_type, self.policy)
+
+    async def _worker(self):
+        while True:
+            await self._items.acquire()
+            queue = next(queue for queue in self._lanes if queue)
+            item = queue.popleft()
+            self._type_counts[item[1]] -= 1
+            self.pending -= 1
+            try:
+                await self._execute(item)
+            finally:
+                if not self.pending and not self.active:
+                    self._idle.set()
+
+    async def join(self):
+        if self._idle is not None:
+            await self._idle.wait()
+
+    async def aclose(self, timeout: Optional[float] = None):
+        if self._idle is not None:
+            try:
+                await asyncio.wait_for(self.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Не дождались обработки %d событий при остановке", self.depth)
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        for queue in self._lanes:
+            queue.clear()
+        self._type_counts.clear()
+        self.pending = 0
+        self._items = self._idle = None
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats["lanes"] = {name: len(queue) for name, queue in zip(LANES, self._lanes)}
+        stats["shed"] = self.shed
+        stats["shed_by_type"] = dict(self.shed_by_type)
+        return stats
+
+    def to_prometheus(self, namespace: str = "aiomost") -> str:
+        ns = namespace
+        lines = [
+            f"# HELP {ns}_dispatch_lane_depth Events waiting per priority lane.",
+            f"# TYPE {ns}_dispatch_lane_depth gauge",
+        ]
+        lines += [f'{ns}_dispatch_lane_depth{{lane="{name}"}} {len(queue)}'
+                  for name, queue in zip(LANES, self._lanes)]
+        lines += [
+            f"# HELP {ns}_dispatch_events_shed_total Events dropped by load shedding.",
+            f"# TYPE {ns}_dispatch_events_shed_total counter",
+        ]
+        lines += [f'{ns}_dispatch_events_shed_total{{event_type="{escape_label(event_type)}"}} '
+                  f'{count}' for event_type, count in sorted(self.shed_by_type.items())]
+        return super().to_prometheus(namespace) + "\n".join(lines) + "\n"
@@ -1,7 +1,17 @@
+import functools
+
+
 class Dispatcher:
-    def __init__(self, state_manager=None):
+    def __init__(self, state_manager=None, scheduler=None):
+        """
+        :param state_manager: (Опционально) RedisStateManager для роутеров.
+        :param scheduler: (Опционально) DispatchPool/KeyedDispatchPool, через который
+                          выполняется dispatch. KeyedDispatchPool обрабатывает события
+                          одного пользователя по очереди, разных - параллельно.
+        """
         self.routers = []
         self.state_manager = state_manager
+        self.scheduler = scheduler
 
     def include_router(self, router):
         """
@@ -19,6 +29,12 @@ class Dispatcher:
         Распространяет событие по всем роутерам,
         передавая state_manager, если он задан.
         """
+        if self.scheduler is not None:
+            return await self.scheduler.submit(
+                update_type, event, functools.partial(self._dispatch, **kwargs))
+        return await self._dispatch(update_type, event, **kwargs)
+
+    async def _dispatch(self, update_type: str, event, **kwargs):
         if self.state_manager:
             kwargs.setdefault("state_manager", self.state_manager)
         for router in self.routers:
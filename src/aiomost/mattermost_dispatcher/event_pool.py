@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from aiomost.mattermost_actions.keyed_queue import KeyedQueue
+
+logger = logging.getLogger(__name__)
+
+# dispatch(update_type, event) - обычно рассылка события по роутерам
+DispatchFunc = Callable[[str, Any], Awaitable[Any]]
+# (время получения, update_type, event, dispatch, future результата)
+_Item = Tuple[float, str, Any, DispatchFunc, asyncio.Future]
+
+
+def _field(obj, name: str):
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def default_event_key(update_type: str, event) -> Optional[Hashable]:
+    """
+    Ключ упорядочивания события: user_id автора, иначе channel_id.
+    Понимает MessageEvent, MattermostButtonQuery, UserAddedEvent, MattermostUpdate
+    и «сырые» словари вебхуков. None - событие ни с чем не упорядочивается.
+    """
+    data = _field(event, "data")
+    post = _field(data, "post")
+    inner = _field(data, "data")  # MattermostUpdate хранит кадр целиком
+    sources = [source for source in (post, event, data, inner,
+                                     _field(event, "broadcast"), _field(data, "broadcast"))
+               if source is not None and not isinstance(source, str)]
+    for name in ("user_id", "channel_id"):
+        for source in sources:
+            value = _field(source, name)
+            if value:
+                return value
+    return None
+
+
+class DispatchPool:
+    """
+    Ограниченная очередь входящих событий и пул обработчиков.
+
+    Слушатель WebSocket только кладёт разобранные события в очередь и сразу
+    читает следующий кадр; медленный хендлер не мешает отвечать на ping.
+    Когда очередь заполнена, put() ждёт места - чтение сокета приостанавливается
+    (backpressure), события не теряются.
+    """
+
+    def __init__(self, workers: int = 1, maxsize: int = 1000):
+        """
+        :param workers: Число одновременно обрабатываемых событий. При workers=1
+                        события обрабатываются строго в порядке получения.
+        :param maxsize: Ёмкость очереди.
+        """
+        if workers < 1 or maxsize < 1:
+            raise ValueError("workers и maxsize должны быть >= 1")
+        self.workers = workers
+        self.maxsize = maxsize
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self.received = 0
+        self.dispatched = 0
+        self.failed = 0
+        self.active = 0
+        self.max_depth = 0
+        self.lag_sum = 0.0
+        self.lag_max = 0.0
+
+    def _start(self):
+        # Примитивы asyncio создаём внутри работающего цикла событий
+        if self._queue is None:
+            self._queue = asyncio.Queue(self.maxsize)
+        if not self._worker_tasks:
+            self._worker_tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    @property
+    def depth(self) -> int:
+        """Сколько событий ждёт в очереди."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def put(self, update_type: str, event, dispatch: DispatchFunc) -> asyncio.Future:
+        """
+        Ставит событие в очередь; ждёт, если очередь заполнена.
+        :param dispatch: Корутина-функция dispatch(update_type, event), которую выполнит воркер.
+        :return: Future с результатом dispatch. Ждать его не обязательно: ошибки
+                 хендлеров логируются пулом.
+        """
+        self._start()
+        future = asyncio.get_event_loop().create_future()
+        await self._enqueue((time.monotonic(), update_type, event, dispatch, future))
+        self.received += 1
+        depth = self.depth
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return future
+
+    async def submit(self, update_type: str, event, dispatch: DispatchFunc):
+        """Ставит событие в очередь и ждёт результата dispatch."""
+        return await (await self.put(update_type, event, dispatch))
+
+    async def _enqueue(self, item: _Item):
+        await self._queue.put(item)
+
+    async def _worker(self):
+        while True:
+            item = await self._queue.get()
+            try:
+                await self._execute(item)
+            finally:
+                self._queue.task_done()
+
+    async def _execute(self, item: _Item):
+        received_at, update_type, event, dispatch, future = item
+        lag = time.monotonic() - received_at
+        self.lag_sum += lag
+        if lag > self.lag_max:
+            self.lag_max = lag
+        self.active += 1
+        try:
+            result = await dispatch(update_type, event)
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"❌ Ошибка обработки события '{update_type}': {e}")
+            if not future.done():
+                future.set_exception(e)
+                future.exception()  # Ошибка уже залогирована, future можно не ждать
+        else:
+            self.dispatched += 1
+            if not future.done():
+                future.set_result(result)
+        finally:
+            self.active -= 1
+
+    async def join(self):
+        """Ждёт, пока не будут обработаны все события из очереди."""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def aclose(self, timeout: Optional[float] = None):
+        """
+        Дожидается обработки очереди и останавливает воркеров.
+        :param timeout: Сколько ждать обработки (None - без ограничения); оставшиеся
+                        события отбрасываются.
+        """
+        if self._queue is not None:
+            try:
+                await asyncio.wait_for(self.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Не дождались обработки %d событий при остановке", self.depth)
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._queue = None
+
+    def stats(self) -> Dict[str, Any]:
+        started = self.dispatched + self.failed + self.active
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "active": self.active,
+            "received": self.received,
+            "dispatched": self.dispatched,
+            "failed": self.failed,
+            "lag_avg": self.lag_sum / started if started else 0.0,
+            "lag_max": self.lag_max,
+        }
+
+    def to_prometheus(self, namespace: str = "aiomost") -> str:
+        """Глубина очереди и задержка от получения до обработки в формате Prometheus."""
+        ns = namespace
+        started = self.dispatched + self.failed + self.active
+        lines = []
+        for name, kind, help_text, value in (
+            ("dispatch_queue_depth", "gauge", "Events waiting for a dispatch worker.", self.depth),
+            ("dispatch_active", "gauge", "Events being handled right now.", self.active),
+            ("dispatch_events_received_total", "counter", "Events received from the websocket.",
+             self.received),
+            ("dispatch_events_failed_total", "counter", "Events whose handlers raised.", self.failed),
+            ("dispatch_lag_max_seconds", "gauge", "Max lag from receive to dispatch.", self.lag_max),
+        ):
+            lines += [f"# HELP {ns}_{name} {help_text}", f"# TYPE {ns}_{name} {kind}",
+                      f"{ns}_{name} {value}"]
+        lines += [
+            f"# HELP {ns}_dispatch_lag_seconds Lag from receive to dispatch.",
+            f"# TYPE {ns}_dispatch_lag_seconds summary",
+            f"{ns}_dispatch_lag_seconds_sum {self.lag_sum}",
+            f"{ns}_dispatch_lag_seconds_count {started}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+class KeyedDispatchPool(DispatchPool):
+    """
+    Пул с упорядочиванием по ключу (по умолчанию - пользователь, см. default_event_key).
+
+    События с одним ключом обрабатываются строго по очереди, по одному, - два
+    быстрых сообщения пользователя не гоняются за get_state/set_state его FSM.
+    События с разными ключами обрабатываются параллельно, но одновременно
+    активно не больше max_active_keys ключей.
+
+    Хендлер не должен синхронно ждать dispatch события со своим же ключом через
+    этот пул - такое ожидание никогда не завершится.
+    """
+
+    def __init__(self, key_func: Callable[[str, Any], Optional[Hashable]] = default_event_key,
+                 max_active_keys: int = 16, maxsize: int = 1000):
+        """
+        :param key_func: key_func(update_type, event) -> ключ; None - событие
+                         обрабатывается без упорядочивания.
+        :param max_active_keys: Сколько ключей (событий) обрабатывается одновременно.
+        :param maxsize: Максимум ожидающих событий; при заполнении put() ждёт места.
+        """
+        super().__init__(workers=max_active_keys, maxsize=maxsize)
+        self.key_func = key_func
+
+    def _start(self):
+        if self._queue is None:
+            self._queue = KeyedQueue(self.maxsize)
+        if not self._worker_tasks:
+            self._worker_tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    @property
+    def depth(self) -> int:
+        return self._queue.pending if self._queue is not None else 0
+
+    @property
+    def active_keys(self) -> int:
+        """Сколько ключей ждёт или обрабатывается."""
+        return self._queue.active_keys if self._queue is not None else 0
+
+    async def _enqueue(self, item: _Item):
+        key = self.key_func(item[1], item[2])
+        if key is None:
+            key = object()  # Уникальный ключ: событие ни с чем не упорядочивается
+        await self._queue.put(key, item)
+
+    async def _worker(self):
+        while True:
+            key, item = await self._queue.get()
+            try:
+                await self._execute(item)
+            finally:
+                self._queue.task_done(key)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats["active_keys"] = self.active_keys
+        return stats
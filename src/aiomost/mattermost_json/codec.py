@@ -0,0 +1,115 @@
+"""
+Единый JSON-кодек библиотеки.
+
+Использует orjson или msgspec, если они установлены, иначе стандартный json.
+Бэкенд можно выбрать явно через переменную окружения AIOMOST_JSON
+(orjson / msgspec / json) или функцию set_backend(); неизвестное значение
+AIOMOST_JSON логируется, и используется json.
+
+Все бэкенды пишут компактный JSON без экранирования не-ASCII символов (в том
+числе json - с ensure_ascii=False, в отличие от json.dumps по умолчанию).
+В остальном вывод не идентичен:
+- orjson и msgspec сериализуют datetime, date и UUID, json бросает TypeError;
+- NaN и Infinity orjson пишет как null, json - как невалидные NaN/Infinity;
+- форматирование чисел может отличаться (1e16 и 1e+16).
+Это касается и значений, которые сохраняет RedisStateManager: читаются они
+любым бэкендом, но байты в Redis зависят от выбранного.
+
+Вызывайте функции через модуль (codec.loads), чтобы смена бэкенда
+действовала везде.
+"""
+
+import json
+import logging
+import os
+from typing import Any, Callable, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("orjson", "msgspec", "json")
+
+# Исключения, которые бросает loads() на некорректном JSON
+# (orjson.JSONDecodeError - подкласс json.JSONDecodeError)
+DECODE_ERRORS = (json.JSONDecodeError,) if msgspec is None else (json.JSONDecodeError, msgspec.DecodeError)
+
+
+def _json_loads(data: Union[str, bytes]) -> Any:
+    return json.loads(data)
+
+
+def _json_dumps(obj: Any, default: Optional[Callable] = None) -> str:
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':'))
+
+
+def _orjson_dumps(obj: Any, default: Optional[Callable] = None) -> str:
+    return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+def _msgspec_loads(data: Union[str, bytes]) -> Any:
+    return _msgspec_decoder.decode(data)
+
+
+def _msgspec_dumps(obj: Any, default: Optional[Callable] = None) -> str:
+    if default is None:
+        return _msgspec_encoder.encode(obj).decode()
+    return msgspec.json.encode(obj, enc_hook=default).decode()
+
+
+if msgspec is not None:
+    _msgspec_decoder = msgspec.json.Decoder()
+    _msgspec_encoder = msgspec.json.Encoder()
+
+backend = "json"
+loads: Callable[[Union[str, bytes]], Any] = _json_loads
+dumps: Callable[..., str] = _json_dumps
+
+
+def available_backends():
+    """Бэкенды, доступные в текущем окружении, в порядке предпочтения."""
+    installed = {"orjson": orjson, "msgspec": msgspec, "json": json}
+    return [name for name in BACKENDS if installed[name] is not None]
+
+
+def set_backend(name: Optional[str] = None) -> str:
+    """
+    Переключает кодек.
+    :param name: orjson, msgspec или json; None - самый быстрый из установленных.
+    :return: Имя выбранного бэкенда.
+    """
+    global backend, loads, dumps
+    if name is None:
+        name = available_backends()[0]
+    if name not in available_backends():
+        raise ValueError(f"JSON-бэкенд {name!r} недоступен, доступны: {available_backends()}")
+
+    if name == "orjson":
+        loads, dumps = orjson.loads, _orjson_dumps
+    elif name == "msgspec":
+        loads, dumps = _msgspec_loads, _msgspec_dumps
+    else:
+        loads, dumps = _json_loads, _json_dumps
+    backend = name
+    return name
+
+
+def _backend_from_env() -> str:
+    name = os.environ.get("AIOMOST_JSON") or None
+    try:
+        return set_backend(name)
+    except ValueError as e:
+        # Ошибка в окружении не должна делать пакет неимпортируемым
+        logger.warning("%s; AIOMOST_JSON игнорируется, используется json", e)
+        return set_backend("json")
+
+
+_backend_from_env()
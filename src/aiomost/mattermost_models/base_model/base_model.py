@@ -1,4 +1,4 @@
-import json
+from aiomost.mattermost_json import codec
 
 
 class BaseModel:
@@ -17,4 +17,4 @@ class BaseModel:
 
     def to_json(self):
         """Конвертирует объект обратно в JSON."""
-        return json.dumps(self, default=lambda o: o.__dict__, ensure_ascii=False, separators=(',', ':'))
+        return codec.dumps(self, default=lambda o: o.__dict__)
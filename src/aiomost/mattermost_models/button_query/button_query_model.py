@@ -1,4 +1,4 @@
-import json
+from aiomost.mattermost_json import codec
 
 
 class DotDict(dict):
@@ -36,7 +36,7 @@ class MattermostButtonQuery:
 
     def to_json(self):
         """Компактное преобразование в JSON с сохранением всех данных"""
-        return json.dumps({
+        return codec.dumps({
             "event_type": self.event_type,
             "action": self.action,
             "post_id": self.post_id,
@@ -46,4 +46,4 @@ class MattermostButtonQuery:
             "team_id": self.team_id,
             "team_domain": self.team_domain,
             "data_source": self.data_source
-        }, ensure_ascii=False, separators=(',', ':'))
+        })
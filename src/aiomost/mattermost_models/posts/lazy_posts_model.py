@@ -0,0 +1,143 @@
+"""
+Ленивые модели события posted.
+
+Модель использует словарь кадра как свой __dict__ (без копирования), а тяжёлые
+поля - вложенные JSON-строки post и mentions, PostProps, PostMetadata -
+строятся при первом обращении и заменяют в словаре исходное значение.
+Интерфейс атрибутов тот же, что у MessageEvent / MessageData / Post, и классы
+являются их наследниками:
+
+    event = LazyMessageEvent(**frame)
+    event.data.post.message          # Разбирается только post, без metadata и mentions
+    event.data.post.props.get("from_bot")
+
+Словарь data, переданный в модель, переходит в её владение: поля разбираются на месте.
+"""
+
+from typing import Any, Callable, Dict, Tuple
+
+from aiomost.mattermost_json import codec
+from aiomost.mattermost_models.posts.posts_model import (MessageBroadcast, MessageData,
+                                                         MessageEvent, Post, PostMetadata,
+                                                         PostProps)
+
+
+class _Lazy:
+    """
+    Поле, которое преобразуется decode при обращении. decode возвращает уже
+    преобразованное значение как есть, поэтому результат просто заменяет исходное.
+    """
+
+    __slots__ = ("name", "decode")
+
+    def __init__(self, name: str, decode: Callable[[Any], Any]):
+        self.name = name
+        self.decode = decode
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        fields = obj.__dict__
+        value = fields.get(self.name)
+        decoded = self.decode(value)
+        if decoded is not value:
+            fields[self.name] = decoded
+        return decoded
+
+    def __set__(self, obj, value):
+        obj.__dict__[self.name] = value
+
+
+class _LazyModel:
+    # Значения простых полей, которых может не быть в кадре
+    _defaults: Dict[str, Any] = {}
+    # Имена полей _Lazy класса (заполняется в __init_subclass__)
+    _lazy_fields: Tuple[str, ...] = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._lazy_fields = tuple(name for name in dir(cls) if isinstance(
+            getattr(cls, name, None), _Lazy))
+
+    def __getattr__(self, name: str):
+        # Вызывается только для атрибутов, которых нет в кадре
+        try:
+            return self._defaults[name]
+        except KeyError:
+            raise AttributeError(
+                f"{type(self).__name__!r} object has no attribute {name!r}") from None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Все поля модели (неразобранные поля при этом разбираются)."""
+        fields = dict(self._defaults)
+        fields.update(self.__dict__)
+        for name in self._lazy_fields:
+            fields[name] = getattr(self, name)
+        return fields
+
+    def to_json(self):
+        return codec.dumps(self, default=_serializable)
+
+
+def _serializable(obj):
+    return obj.to_dict() if isinstance(obj, _LazyModel) else obj.__dict__
+
+
+def _list(value):
+    return value if isinstance(value, list) else value or []
+
+
+def _props(value):
+    return PostProps(**value) if isinstance(value, dict) else value
+
+
+def _metadata(value):
+    return PostMetadata(**value) if isinstance(value, dict) else value
+
+
+def _post(value):
+    return LazyPost(codec.loads(value)) if isinstance(value, str) else value
+
+
+def _mentions(value):
+    return codec.loads(value) if isinstance(value, str) else _list(value)
+
+
+def _message_data(value):
+    return LazyMessageData(value) if isinstance(value, dict) else value
+
+
+def _broadcast(value):
+    return MessageBroadcast(**value) if isinstance(value, dict) else value
+
+
+class LazyPost(_LazyModel, Post):
+    _defaults = {"hashtags": "", "pending_post_id": "", "remote_id": "", "reply_count": 0,
+                 "last_reply_at": 0}
+    props = _Lazy("props", _props)
+    metadata = _Lazy("metadata", _metadata)
+    file_ids = _Lazy("file_ids", _list)
+    participants = _Lazy("participants", _list)
+
+    def __init__(self, raw: Dict[str, Any]):
+        """:param raw: Словарь сообщения (разобранная строка post события posted)."""
+        self.__dict__ = raw
+
+
+class LazyMessageData(_LazyModel, MessageData):
+    _defaults = {"image": None, "otherFile": None}
+    post = _Lazy("post", _post)
+    mentions = _Lazy("mentions", _mentions)
+
+    def __init__(self, raw: Dict[str, Any]):
+        """:param raw: Поле data события posted (post и mentions - JSON-строки)."""
+        self.__dict__ = raw
+
+
+class LazyMessageEvent(_LazyModel, MessageEvent):
+    data = _Lazy("data", _message_data)
+    broadcast = _Lazy("broadcast", _broadcast)
+
+    def __init__(self, **frame):
+        """:param frame: Кадр posted: event, data, broadcast, seq."""
+        self.__dict__ = frame
@@ -1,4 +1,4 @@
-import json
+from aiomost.mattermost_json import codec
 from aiomost.mattermost_models.base_model.base_model import BaseModel
 
 
@@ -67,7 +67,7 @@ class Post(BaseModel):
 
     @classmethod
     def parse_post(cls, post_data):
-        return cls(**(json.loads(post_data) if isinstance(post_data, str) else post_data))
+        return cls(**(codec.loads(post_data) if isinstance(post_data, str) else post_data))
 
 
 class MessageData(BaseModel):
@@ -83,12 +83,12 @@ class MessageData(BaseModel):
         self.otherFile = otherFile
 
         if isinstance(mentions, str):
-            self.mentions = json.loads(mentions)
+            self.mentions = codec.loads(mentions)
         else:
             self.mentions = mentions or []
 
         if isinstance(post, str):
-            self.post = Post(**json.loads(post))
+            self.post = Post(**codec.loads(post))
         else:
             self.post = post
 
@@ -99,9 +99,9 @@ class MessageData(BaseModel):
     def parse_post_data(cls, data):
         try:
             if isinstance(data.get("post"), str):
-                data["post"] = json.loads(data["post"])
+                data["post"] = codec.loads(data["post"])
             return cls(**data)
-        except (json.JSONDecodeError, TypeError, KeyError) as e:
+        except (*codec.DECODE_ERRORS, TypeError, KeyError) as e:
             import logging
             logging.error(
                 f"Ошибка при парсинге MessageData: {e}, данные: {data}")
@@ -149,9 +149,9 @@ class MessageEvent(BaseModel):
     def parse_message_event(cls, values):
         try:
             if isinstance(values.get("data"), str):
-                values["data"] = json.loads(values["data"])
+                values["data"] = codec.loads(values["data"])
             return cls(**values)
-        except (json.JSONDecodeError, TypeError, KeyError) as e:
+        except (*codec.DECODE_ERRORS, TypeError, KeyError) as e:
             import logging
             logging.error(
                 f"Ошибка при парсинге MessageEvent: {e}, данные: {values}")
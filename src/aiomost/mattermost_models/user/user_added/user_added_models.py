@@ -1,4 +1,4 @@
-import json
+from aiomost.mattermost_json import codec
 from aiomost.mattermost_models.base_model.base_model import BaseModel
 
 
@@ -27,4 +27,4 @@ class UserAddedEvent(BaseModel):
         self.seq = seq
 
     def to_json(self):
-        return json.dumps(self, default=lambda o: o.__dict__, ensure_ascii=False, separators=(',', ':'))
+        return codec.dumps(self, default=lambda o: o.__dict__)
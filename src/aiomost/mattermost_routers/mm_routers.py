@@ -1,6 +1,6 @@
 import inspect
 import json
-from typing import Any, Callable, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Set, Union
 
 from aiomost.mattermost_state_storage.matter_states import State
 from aiomost.mattermost_state_storage.redis_state_manager import RedisStateManager
@@ -38,6 +38,8 @@ class Router:
         """
         self.name = name or hex(id(self))
         self.sub_routers: List["Router"] = []
+        # Растёт при регистрации обработчика и подключении дочернего роутера
+        self.handlers_version = 0
         self.bot_user_id = bot_user_id or "sxh6197ftffy5bcr54afro6bwr"
         self.state_manager = state_manager
 
@@ -56,6 +58,12 @@ class Router:
             "button_query": self.button_query,
         }
 
+    def include_router(self, router: "Router") -> "Router":
+        """Добавляет дочерний роутер; события, не обработанные этим роутером, передаются ему."""
+        self.sub_routers.append(router)
+        self.handlers_version += 1
+        return router
+
     async def propagate_event(self, update_type: str, event, **kwargs: Any) -> Any:
         """
         Распространяет событие, передавая state_manager в обработчики.
@@ -82,6 +90,21 @@ class Router:
                 return response
         return None
 
+    def subscribed_event_types(self) -> Set[str]:
+        """Типы событий, на которые в роутере (и дочерних роутерах) есть обработчики."""
+        types = {name for name, observer in self.observers.items() if observer.handlers}
+        for router in self.sub_routers:
+            types |= router.subscribed_event_types()
+        return types
+
+    def subscriptions_version(self) -> int:
+        """
+        Сумма handlers_version роутера и дочерних роутеров: меняется, когда
+        subscribed_event_types() может вернуть другой результат.
+        """
+        return self.handlers_version + sum(
+            router.subscriptions_version() for router in self.sub_routers)
+
 
 class EventObserver:
     """
@@ -102,6 +125,7 @@ class EventObserver:
             'filters': filters,
             'required_state': required_state,
         })
+        self.router.handlers_version += 1
 
     def __call__(
         self, *filters: Callable, button_data: Optional[Union[str, Callable[[str], bool]]] = None, required_state: Optional[State] = None
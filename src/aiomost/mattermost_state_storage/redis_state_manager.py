@@ -2,7 +2,7 @@
 # Модуль для управления состоянием пользователей в Redis (без зависимости от config.py).
 
 import redis.asyncio as redis
-import json
+from aiomost.mattermost_json import codec
 from functools import wraps
 from .matter_states import State  # Оставляем импорт State для type hinting
 from urllib.parse import urlparse
@@ -105,7 +105,7 @@ class RedisStateManager:
         else:
             # Для других типов событий (например, сообщение)
             data = event.data
-            post_data = json.loads(data["data"]["post"])
+            post_data = codec.loads(data["data"]["post"])
             return post_data.get("user_id")
 
     async def update_data(self, user_id: str, **data):
@@ -119,7 +119,7 @@ class RedisStateManager:
             # Получаем старые данные, если они есть
             existing_data = await r.get(key)
             if existing_data:
-                existing_data = json.loads(existing_data)  # Декодируем JSON
+                existing_data = codec.loads(existing_data)  # Декодируем JSON
             else:
                 existing_data = {}  # Если данных нет, создаём пустой словарь
 
@@ -127,7 +127,7 @@ class RedisStateManager:
             existing_data.update(data)
 
             # Записываем обратно в Redis
-            await r.set(key, json.dumps(existing_data))
+            await r.set(key, codec.dumps(existing_data))
 
         finally:
             await r.close()  # Закрываем соединение с Redis
@@ -141,7 +141,7 @@ class RedisStateManager:
             key = f"data:{user_id}"
             data = await r.get(key)
             if data:
-                return json.loads(data)
+                return codec.loads(data)
             return {}
         finally:
             await r.close()
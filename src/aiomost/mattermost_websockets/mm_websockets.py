@@ -1,17 +1,65 @@
 import asyncio
-import json
 import logging
+import re
 import ssl
 import websockets
+from typing import Dict, Optional, Set, Tuple
 
+from aiomost.mattermost_actions.bulk import bounded_map
+from aiomost.mattermost_dispatcher.event_pool import DispatchPool
+from aiomost.mattermost_json import codec
+from aiomost.mattermost_models.posts.lazy_posts_model import LazyMessageEvent, LazyPost
 from aiomost.mattermost_models.posts.posts_model import MessageEvent
 from aiomost.mattermost_models.user.user_added.user_added_models import UserAddedEvent
+from aiomost.mattermost_websockets.session import SessionState
 
 
 logging.getLogger('websockets').setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 
+# Символы, с которых может начинаться JSON-документ
+_JSON_START = frozenset('{["-0123456789tfn \t\r\n')
+
+# Кадр Mattermost начинается с {"event":"<тип>" и заканчивается "seq":<n>}
+_EVENT_PEEK = re.compile(r'\{\s*"event"\s*:\s*"([^"\\]*)"')
+_SEQ_PEEK = re.compile(r'"seq"\s*:\s*(\d+)\s*\}\s*$')
+
+
+def _peek_event(message) -> Tuple[Optional[str], Optional[int]]:
+    """Тип события и seq кадра без разбора JSON целиком (None - определить не удалось)."""
+    if not isinstance(message, str):
+        return None, None
+    match = _EVENT_PEEK.match(message)
+    if match is None:
+        return None, None
+    seq = _SEQ_PEEK.search(message, max(0, len(message) - 40))
+    return match.group(1), int(seq.group(1)) if seq else None
+
+
+# Подписки пересчитываются при изменении версий роутеров, а на случай изменений в
+# обход register() и include_router() - ещё и раз в столько кадров
+_RESUBSCRIBE_FRAMES = 1000
+
+
+def _subscriptions_version(routers) -> int:
+    return sum(router.subscriptions_version() for router in routers
+               if hasattr(router, "subscriptions_version"))
+
+
+def _subscribed_types(routers, user_cache) -> Optional[Set[str]]:
+    """Типы событий, которые нужно разбирать; None - подписки неизвестны, разбираем всё."""
+    types = {"hello"}
+    for router in routers:
+        subscribed = getattr(router, "subscribed_event_types", None)
+        if subscribed is None:
+            return None
+        types |= subscribed()
+    if user_cache is not None:
+        types |= set(user_cache.INVALIDATING_EVENTS)
+    return types
+
+
 class MattermostUpdate:
     def __init__(self, event_type: str, data: dict):
         self.event_type = event_type
@@ -22,141 +70,325 @@ class MattermostUpdate:
 
     def to_json(self):
         cleaned_data = self._clean_json(self.data)
-        return json.dumps({
+        return codec.dumps({
             "event_type": self.event_type,
             "data": cleaned_data
-        }, ensure_ascii=False, separators=(',', ':'))
+        })
 
     def _clean_json(self, data):
         if isinstance(data, dict):
             return {key: self._clean_json(value) for key, value in data.items()}
         elif isinstance(data, str):
+            # Обычный текст не может быть JSON: не тратим время на исключение
+            if data[:1] not in _JSON_START:
+                return data
             try:
-                return json.loads(data)
-            except json.JSONDecodeError:
+                return codec.loads(data)
+            except codec.DECODE_ERRORS:
                 return data
         elif isinstance(data, list):
             return [self._clean_json(item) for item in data]
         return data
 
 
-async def mattermost_ws_listener(routers, ws_url: str, token: str):
+async def mattermost_ws_listener(routers, ws_url: str, token: str, bot=None, connect=None,
+                                 dispatch_pool: Optional[DispatchPool] = None,
+                                 session: Optional[SessionState] = None,
+                                 lazy_models: bool = False):
+    """
+    Слушает WebSocket Mattermost и передаёт события в роутеры.
+    :param bot: (Опционально) MMBot, пул соединений которого будет закрыт
+                при остановке слушателя. Если у бота есть user_cache, события
+                user_updated / user_role_updated сбрасывают его записи.
+    :param connect: (Опционально) Фабрика соединений connect(ws_url, ssl=...) с
+                    интерфейсом websockets.connect, например MattermostStub.connect.
+    :param dispatch_pool: (Опционально) DispatchPool, в котором выполняются хендлеры.
+                          По умолчанию - один воркер (порядок событий сохраняется),
+                          а чтение сокета не ждёт окончания обработки.
+                          KeyedDispatchPool обрабатывает события одного пользователя
+                          по очереди, разных - параллельно.
+    Кадры событий, на которые ни в одном роутере нет обработчиков (typing,
+    status_change, ...), не разбираются: тип события определяется по началу кадра.
+
+    :param session: (Опционально) SessionState - позиция в потоке событий. После
+                    разрыва слушатель возобновляет сессию по connection_id и seq;
+                    если сервер её не возобновил, пропущенные сообщения догружаются
+                    через REST (нужен bot).
+    :param lazy_models: Строить для posted LazyMessageEvent: вложенные JSON-строки и
+                        объекты разбираются при первом обращении. Интерфейс атрибутов
+                        тот же, что у MessageEvent.
+    """
+    pool = dispatch_pool or DispatchPool()
+    session = session or SessionState()
+    try:
+        await _listen(routers, ws_url, token, bot, connect or websockets.connect, pool, session,
+                      lazy_models)
+    finally:
+        if dispatch_pool is None:
+            await pool.aclose()
+        if bot is not None:
+            await bot.aclose()
+
+
+def _is_ignored_post(post_id: str, from_bot, post_type) -> bool:
+    """Сообщения от ботов и системные сообщения в роутеры не передаются."""
+    if from_bot == "true":
+        logger.debug(f"🤖 Игнорируем сообщение от бота: {post_id}")
+        return True
+    if post_type:
+        logger.debug(f"📋 Игнорируем системное сообщение типа '{post_type}': {post_id}")
+        return True
+    return False
+
+
+def _parse_event(event_type: str, data: dict, lazy: bool = False):
+    """Модель события или None, если событие не нужно передавать в роутеры."""
+    if event_type == "user_added":
+        # Универсальный парсер
+        return UserAddedEvent(**data)
+
+    if event_type == "posted":
+        if lazy:
+            # Фильтры читают разобранный словарь сообщения: PostProps и модели
+            # строятся только для сообщений, которые дойдут до роутеров
+            post = data["data"]["post"]
+            if isinstance(post, str):
+                post = codec.loads(post)
+            props = post.get("props")
+            from_bot = props.get("from_bot") if isinstance(props, dict) else None
+            if _is_ignored_post(post.get("id"), from_bot, post.get("type")):
+                return None
+            data["data"]["post"] = LazyPost(post)
+            return LazyMessageEvent(**data)
+
+        event = MessageEvent(**data)
+        post = event.data.post
+        from_bot = post.props.get("from_bot") if getattr(post, "props", None) else None
+        if _is_ignored_post(post.id, from_bot, getattr(post, "type", None)):
+            return None
+        return event
+
+    return MattermostUpdate(event_type, data)
+
+
+class _CatchUp:
+    """
+    Догрузка пропущенных сообщений через REST в фоновой задаче: чтение сокета
+    не ждёт пагинации. Позиции каналов снимаются в момент запроса, до того как
+    следующие живые сообщения их сдвинут. Запрос во время идущей догрузки не
+    запускает вторую задачу, а добавляет к ней ещё один проход.
+    """
+
+    def __init__(self, bot, session: SessionState, handle_frame):
+        self.bot = bot
+        self.session = session
+        self.handle_frame = handle_frame
+        self.task: Optional[asyncio.Task] = None
+        self._pending: Dict[str, int] = {}  # channel_id -> since
+
+    def request(self):
+        if self.bot is None:
+            logger.warning("⚠️ События могли быть потеряны: для догрузки через REST передайте bot")
+            return
+        self._merge(self.session.catch_up_targets())
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._run())
+
+    def _merge(self, targets: Dict[str, int]):
+        for channel_id, since in targets.items():
+            current = self._pending.get(channel_id)
+            self._pending[channel_id] = since if current is None else min(current, since)
+
+    async def _run(self):
+        session = self.session
+        attempt = 0
+        while self._pending:
+            targets, self._pending = self._pending, {}
+            logger.info(f"🔄 Догружаем пропущенные сообщения через REST ({len(targets)} каналов)")
+            failed = await self._pass(targets)
+            if not failed:
+                continue
+            if self._pending:
+                attempt = 0  # Новый запрос во время прохода: повторяем вместе с ним
+            elif attempt >= session.catch_up_retries:
+                return  # Каналы остаются в session.failed_channels до следующего запроса
+            else:
+                await asyncio.sleep(session.catch_up_backoff * 2 ** attempt)
+                attempt += 1
+            self._merge(failed)
+
+    async def _pass(self, targets: Dict[str, int]) -> Dict[str, int]:
+        """Догружает каналы targets; возвращает каналы, догрузка которых не удалась."""
+        session = self.session
+        failed = {}
+        async for res in bounded_map(targets.items(), self._channel, session.catch_up_concurrency):
+            channel_id, since = res.item
+            if res.ok:
+                session.failed_channels.pop(channel_id, None)
+                continue
+            session.catch_up_errors += 1
+            session.failed_channels[channel_id] = failed[channel_id] = since
+            logger.error(f"❌ Ошибка догрузки сообщений канала {channel_id}: {res.error}")
+        return failed
+
+    async def _channel(self, target: Tuple[str, int]):
+        channel_id, since = target
+        session = self.session
+        if channel_id not in session.channels:
+            return
+        # since - 1: сообщения, созданные в ту же миллисекунду, отсеиваются по id
+        async for post in self.bot.iter_channel_posts(channel_id, since=since - 1):
+            if (post.get("create_at", 0) < since or post.get("delete_at")
+                    or post.get("id") in session.seen_posts):
+                continue
+            session.caught_up += 1
+            await self.handle_frame(session.catch_up_frame(channel_id, post))
+
+    async def aclose(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+
+async def _listen(routers, ws_url: str, token: str, bot, connect, pool: DispatchPool,
+                  session: SessionState, lazy_models: bool):
+    user_cache = getattr(bot, "user_cache", None)
+
+    async def propagate(event_type: str, event):
+        for router in routers:
+            await router.propagate_event(event_type, event)
+
+    async def handle_frame(data: dict):
+        event_type = data.get("event")
+        if user_cache is not None:
+            user_cache.handle_event(event_type, data)
+
+        try:
+            event = _parse_event(event_type, data, lazy_models)
+        except Exception as e:
+            logger.error(
+                f"❌ Ошибка обработки события '{event_type}': {e}")
+            logger.debug(f"Данные события: {data}")
+            return
+
+        if event is None:
+            return
+        if event_type == "posted" and not session.track_post(data["data"], event.data.post):
+            logger.debug(f"🔁 Сообщение уже доставлено: {event.data.post.id}")
+            return
+        # Хендлеры выполняются воркерами пула, сокет читается дальше
+        await pool.put(event_type, event, propagate)
+
+    catch_up = _CatchUp(bot, session, handle_frame)
+
     ssl_context = ssl.create_default_context()
     ssl_context.check_hostname = False
     ssl_context.verify_mode = ssl.CERT_NONE
 
     reconnect_delay = 1
+    subscribed: Optional[Set[str]] = None
+    subscriptions_version = -1
+    frames_since_subscribe = 0
 
-    while True:
-        try:
-            async with websockets.connect(ws_url, ssl=ssl_context) as ws:
-                auth_data = {
-                    "seq": 1,
-                    "action": "authentication_challenge",
-                    "data": {"token": token}
-                }
-                await ws.send(json.dumps(auth_data))
-                logger.info("✅ Подключение к WebSocket установлено!")
-
-                reconnect_delay = 1  # Сброс задержки при успешном подключении
-
-                while True:
-                    try:
-                        message = await ws.recv()
-                        data = json.loads(message)
-                        print(data)
-
-                        event_type = data.get("event")
-                        if event_type == "user_added":
-                            try:
-                                # Универсальный парсер
-                                event = UserAddedEvent(**data)
-                                for router in routers:
-                                    await router.propagate_event(event_type, event)
-                            except Exception as e:
-                                logger.error(
-                                    f"❌ Ошибка обработки события 'user_added': {e}")
-                                logger.debug(f"Данные события: {data}")
-
-                        elif event_type == "posted":
-                            try:
-                                event = MessageEvent(**data)
-
-                                # Игнорируем сообщения от ботов
-                                if (hasattr(event.data.post, 'props') and
-                                    event.data.post.props and
-                                        event.data.post.props.get("from_bot") == "true"):
-                                    logger.debug(
-                                        f"🤖 Игнорируем сообщение от бота: {event.data.post.id}")
-                                    continue
+    try:
+        while True:
+            try:
+                async with connect(session.resume_url(ws_url), ssl=ssl_context) as ws:
+                    auth_data = {
+                        "seq": 1,
+                        "action": "authentication_challenge",
+                        "data": {"token": token}
+                    }
+                    await ws.send(codec.dumps(auth_data))
+                    logger.info("✅ Подключение к WebSocket установлено!")
 
-                                # Игнорируем системные сообщения
-                                if hasattr(event.data.post, 'type') and event.data.post.type:
-                                    logger.debug(
-                                        f"📋 Игнорируем системное сообщение типа '{event.data.post.type}': {event.data.post.id}")
+                    reconnect_delay = 1  # Сброс задержки при успешном подключении
+
+                    while True:
+                        try:
+                            message = await ws.recv()
+
+                            frames_since_subscribe += 1
+                            version = _subscriptions_version(routers)
+                            if (version != subscriptions_version
+                                    or frames_since_subscribe >= _RESUBSCRIBE_FRAMES):
+                                subscriptions_version = version
+                                frames_since_subscribe = 0
+                                subscribed = _subscribed_types(routers, user_cache)
+                            if subscribed is not None:
+                                event_type, seq = _peek_event(message)
+                                if event_type is not None and event_type not in subscribed:
+                                    # Обработчиков нет: модель не строим, учитываем только seq
+                                    session.skipped += 1
+                                    if seq is None:
+                                        seq = codec.loads(message).get("seq")
+                                    if session.observe_seq(seq):
+                                        logger.warning("⚠️ Пропуск в последовательности событий WebSocket")
+                                        catch_up.request()
                                     continue
 
-                                for router in routers:
-                                    await router.propagate_event(event_type, event)
-                            except Exception as e:
-                                logger.error(
-                                    f"❌ Ошибка обработки события 'posted': {e}")
-                                logger.debug(f"Данные события: {data}")
-
-                        else:
-                            try:
-                                update = MattermostUpdate(event_type, data)
-                                for router in routers:
-                                    await router.propagate_event(event_type, update)
-                            except Exception as e:
-                                logger.error(
-                                    f"❌ Ошибка обработки события '{event_type}': {e}")
-                                logger.debug(f"Данные события: {data}")
-
-                    except json.JSONDecodeError as e:
-                        logger.error(f"❌ Ошибка парсинга JSON сообщения: {e}")
-                        logger.debug(f"Проблемное сообщение: {message}")
-                    except websockets.ConnectionClosed:
-                        # Переподключение будет обработано во внешнем блоке
-                        raise
-                    except Exception as e:
-                        logger.error(
-                            f"❌ Неожиданная ошибка при обработке сообщения: {e}")
-                        logger.debug(
-                            f"Сообщение: {message if 'message' in locals() else 'Не удалось получить'}")
-                        # Продолжаем работу, не прерывая соединение
-        except websockets.ConnectionClosed as e:
-            logger.warning(f"⚠️ WebSocket соединение закрыто")
-            logger.debug(f"Детали закрытия соединения: {e}")
-            logger.info(f"🔄 Переподключение через {reconnect_delay} секунд...")
-        except websockets.InvalidURI as e:
-            logger.error(f"❌ Неверный URI WebSocket: {e}")
-            logger.error(f"Проверьте URL: {ws_url}")
-            logger.info(f"🔄 Переподключение через {reconnect_delay} секунд...")
-        except websockets.InvalidHandshake as e:
-            logger.error(f"❌ Ошибка рукопожатия WebSocket: {e}")
-            logger.error(
-                "Возможно, проблема с токеном авторизации или сервером")
-            logger.info(f"🔄 Переподключение через {reconnect_delay} секунд...")
-        except ssl.SSLError as e:
-            logger.error(f"❌ Ошибка SSL: {e}")
-            logger.error("Проблема с SSL-сертификатом или шифрованием")
-            logger.info(f"🔄 Переподключение через {reconnect_delay} секунд...")
-        except ConnectionRefusedError as e:
-            logger.error(f"❌ Соединение отклонено: {e}")
-            logger.error(
-                f"Сервер {ws_url} недоступен или отклоняет подключения")
-            logger.info(f"🔄 Переподключение через {reconnect_delay} секунд...")
-        except asyncio.TimeoutError as e:
-            logger.error(f"❌ Таймаут соединения: {e}")
-            logger.error("Сервер не отвечает в течение допустимого времени")
-            logger.info(f"🔄 Переподключение через {reconnect_delay} секунд...")
-        except Exception as e:
-            logger.error(
-                f"❌ Неожиданная ошибка WebSocket: {type(e).__name__}: {e}")
-            logger.debug(f"Полная информация об ошибке:", exc_info=True)
-            logger.info(f"🔄 Переподключение через {reconnect_delay} секунд...")
+                            data = codec.loads(message)
+                            logger.debug("Кадр WebSocket: %s", data)
+
+                            if data.get("event") == "hello":
+                                resumed = session.on_hello((data.get("data") or {}).get("connection_id"))
+                                session.observe_seq(data.get("seq"))
+                                if not resumed:
+                                    logger.warning("⚠️ Сессия WebSocket не возобновлена сервером")
+                                    catch_up.request()
+                            elif session.observe_seq(data.get("seq")):
+                                logger.warning("⚠️ Пропуск в последовательности событий WebSocket")
+                                catch_up.request()
+
+                            await handle_frame(data)
+
+                        except codec.DECODE_ERRORS as e:
+                            logger.error(f"❌ Ошибка парсинга JSON сообщения: {e}")
+                            logger.debug(f"Проблемное сообщение: {message}")
+                        except websockets.ConnectionClosed:
+                            # Переподключение будет обработано во внешнем блоке
+                            raise
+                        except Exception as e:
+                            logger.error(
+                                f"❌ Неожиданная ошибка при обработке сообщения: {e}")
+                            logger.debug(
+                                f"Сообщение: {message if 'message' in locals() else 'Не удалось получить'}")
+                            # Продолжаем работу, не прерывая соединение
+            except websockets.ConnectionClosed as e:
+                logger.warning(f"⚠️ WebSocket соединение закрыто")
+                logger.debug(f"Детали закрытия соединения: {e}")
+                logger.info(f"🔄 Переподключение через {reconnect_delay} секунд...")
+            except websockets.InvalidURI as e:
+                logger.error(f"❌ Неверный URI WebSocket: {e}")
+                logger.error(f"Проверьте URL: {ws_url}")
+                logger.info(f"🔄 Переподключение через {reconnect_delay} секунд...")
+            except websockets.InvalidHandshake as e:
+                logger.error(f"❌ Ошибка рукопожатия WebSocket: {e}")
+                logger.error(
+                    "Возможно, проблема с токеном авторизации или сервером")
+                logger.info(f"🔄 Переподключение через {reconnect_delay} секунд...")
+            except ssl.SSLError as e:
+                logger.error(f"❌ Ошибка SSL: {e}")
+                logger.error("Проблема с SSL-сертификатом или шифрованием")
+                logger.info(f"🔄 Переподключение через {reconnect_delay} секунд...")
+            except ConnectionRefusedError as e:
+                logger.error(f"❌ Соединение отклонено: {e}")
+                logger.error(
+                    f"Сервер {ws_url} недоступен или отклоняет подключения")
+                logger.info(f"🔄 Переподключение через {reconnect_delay} секунд...")
+            except asyncio.TimeoutError as e:
+                logger.error(f"❌ Таймаут соединения: {e}")
+                logger.error("Сервер не отвечает в течение допустимого времени")
+                logger.info(f"🔄 Переподключение через {reconnect_delay} секунд...")
+            except Exception as e:
+                logger.error(
+                    f"❌ Неожиданная ошибка WebSocket: {type(e).__name__}: {e}")
+                logger.debug(f"Полная информация об ошибке:", exc_info=True)
+                logger.info(f"🔄 Переподключение через {reconnect_delay} секунд...")
 
-        await asyncio.sleep(reconnect_delay)
-        # Экспоненциальная задержка
-        reconnect_delay = min(reconnect_delay * 2, 60)
+            await asyncio.sleep(reconnect_delay)
+            # Экспоненциальная задержка
+            reconnect_delay = min(reconnect_delay * 2, 60)
+    finally:
+        await catch_up.aclose()
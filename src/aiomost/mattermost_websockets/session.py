@@ -0,0 +1,143 @@
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from urllib.parse import urlencode
+
+from aiomost.mattermost_actions.cache import LRUCache
+from aiomost.mattermost_json import codec
+
+# Поля данных posted, описывающие канал (без самого сообщения)
+_CHANNEL_FIELDS = ("channel_display_name", "channel_name", "channel_type", "team_id")
+
+
+class SessionState:
+    """
+    Позиция слушателя в потоке событий WebSocket.
+
+    Хранит connection_id из события hello и следующий ожидаемый seq, чтобы при
+    переподключении возобновить сессию (Mattermost досылает пропущенные события).
+    Если сервер сессию не возобновил, по запомненным каналам и времени последнего
+    сообщения слушатель догружает пропущенные сообщения через REST в фоновой
+    задаче; уже доставленные сообщения отсеиваются по id. Каналы, догрузка
+    которых не удалась, повторяются с задержкой и в следующем проходе.
+    """
+
+    def __init__(self, max_channels: int = 1000, max_post_ids: int = 10000,
+                 catch_up_channels: int = 100, catch_up_concurrency: int = 4,
+                 catch_up_retries: int = 3, catch_up_backoff: float = 1.0):
+        """
+        :param max_channels: Сколько последних активных каналов помнить.
+        :param max_post_ids: Сколько id доставленных сообщений помнить для отсева повторов.
+        :param catch_up_channels: Сколько каналов (самых активных) догружать за один проход.
+        :param catch_up_concurrency: Сколько каналов догружать одновременно.
+        :param catch_up_retries: Сколько раз повторять догрузку каналов с ошибкой.
+        :param catch_up_backoff: Задержка перед первым повтором (секунды), далее удваивается.
+        """
+        self.connection_id: Optional[str] = None
+        self.next_seq: Optional[int] = None
+        self.max_channels = max_channels
+        # channel_id -> {"meta": поля канала, "last_create_at": время последнего сообщения}
+        self.channels: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.seen_posts = LRUCache(max_post_ids)
+        self.catch_up_channels = catch_up_channels
+        self.catch_up_concurrency = catch_up_concurrency
+        self.catch_up_retries = catch_up_retries
+        self.catch_up_backoff = catch_up_backoff
+        # Каналы, догрузка которых не удалась: channel_id -> since, с которого догружать
+        self.failed_channels: Dict[str, int] = {}
+        self.resumed = 0
+        self.gaps = 0
+        self.caught_up = 0
+        self.catch_up_errors = 0
+        self.skipped = 0  # События без обработчиков, пропущенные без разбора
+
+    def resume_url(self, ws_url: str) -> str:
+        """URL подключения; после первого hello - с параметрами возобновления сессии."""
+        if self.connection_id is None or self.next_seq is None:
+            return ws_url
+        query = urlencode({"connection_id": self.connection_id, "sequence_number": self.next_seq})
+        return f"{ws_url}{'&' if '?' in ws_url else '?'}{query}"
+
+    def on_hello(self, connection_id: Optional[str]) -> bool:
+        """
+        Учитывает событие hello.
+        :return: False, если прежнюю сессию возобновить не удалось и события могли быть потеряны.
+        """
+        previous, self.connection_id = self.connection_id, connection_id
+        if previous is None:
+            return True
+        if previous == connection_id:
+            self.resumed += 1
+            return True
+        self.next_seq = None  # Новая сессия: seq начинается заново
+        return False
+
+    def observe_seq(self, seq: Optional[int]) -> bool:
+        """
+        Учитывает seq очередного события.
+        :return: True, если между событиями пропуск (часть событий потеряна).
+        """
+        if seq is None:
+            return False
+        gap = self.next_seq is not None and seq > self.next_seq
+        if gap:
+            self.gaps += 1
+        if self.next_seq is None or seq >= self.next_seq:
+            self.next_seq = seq + 1
+        return gap
+
+    def track_post(self, data: Dict, post) -> bool:
+        """
+        Запоминает доставленное сообщение и его канал.
+        :param data: Поле data события posted.
+        :param post: Разобранное сообщение (Post).
+        :return: False, если сообщение уже было доставлено.
+        """
+        if post.id in self.seen_posts:
+            return False
+        self.seen_posts.set(post.id, True)
+        channel = self.channels.get(post.channel_id)
+        if channel is None:
+            channel = self.channels[post.channel_id] = {
+                "meta": {field: data.get(field, "") for field in _CHANNEL_FIELDS},
+                "last_create_at": 0,
+            }
+            if len(self.channels) > self.max_channels:
+                self.channels.popitem(last=False)
+        else:
+            self.channels.move_to_end(post.channel_id)
+        channel["last_create_at"] = max(channel["last_create_at"], post.create_at or 0)
+        return True
+
+    def catch_up_targets(self) -> Dict[str, int]:
+        """
+        Снимок позиций для догрузки: channel_id -> время последнего доставленного
+        сообщения. Сначала каналы, догрузка которых не удалась, затем самые активные;
+        всего не больше catch_up_channels.
+        """
+        targets = {channel_id: since for channel_id, since in self.failed_channels.items()
+                   if channel_id in self.channels}
+        for channel_id in reversed(self.channels):
+            if len(targets) >= self.catch_up_channels:
+                break
+            targets.setdefault(channel_id, self.channels[channel_id]["last_create_at"])
+        return dict(list(targets.items())[:self.catch_up_channels])
+
+    def catch_up_frame(self, channel_id: str, post: Dict) -> Dict:
+        """Кадр posted для сообщения, полученного через REST, - как его прислал бы сервер."""
+        data = dict(self.channels[channel_id]["meta"])
+        data.update(post=codec.dumps(post), sender_name="", set_online=False)
+        return {"event": "posted", "data": data, "broadcast": {"channel_id": channel_id},
+                "seq": None}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "connection_id": self.connection_id,
+            "next_seq": self.next_seq,
+            "resumed": self.resumed,
+            "gaps": self.gaps,
+            "caught_up": self.caught_up,
+            "catch_up_errors": self.catch_up_errors,
+            "failed_channels": len(self.failed_channels),
+            "skipped": self.skipped,
+            "channels": len(self.channels),
+        }
@@ -0,0 +1,123 @@
+"""
+Минимальный сервер Redis (протоколы RESP2/RESP3) в памяти процесса.
+
+Поддерживает команды, которыми пользуются RedisStateManager и
+RedisAvatarHashStore (GET, SET, SETEX, DEL, EXISTS, PING); остальные служебные
+команды клиента (CLIENT, SELECT, ...) подтверждаются ответом OK.
+
+    async with RespStub() as server:
+        manager = RedisStateManager(host=server.host, port=server.port, db=0)
+"""
+
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class RespStub:
+    """Заглушка Redis для тестов и бенчмарков."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        """
+        :param host: Адрес, на котором слушает сервер.
+        :param port: Порт (0 - выбрать свободный).
+        """
+        self.host = host
+        self.port = port
+        self.data: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+        self.commands = 0
+        self.connections = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        connection = {"protocol": 2}
+        try:
+            while True:
+                command = await self._read_command(reader)
+                if command is None:
+                    break
+                self.commands += 1
+                writer.write(self._execute(command, connection))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_command(reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()  # Inline-команда (например, из redis-cli)
+        args = []
+        for _ in range(int(line[1:])):
+            length = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    def _get(self, key: bytes) -> Optional[bytes]:
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    def _execute(self, command: List[bytes], connection: Dict) -> bytes:
+        name = command[0].upper()
+        args = command[1:]
+        if name == b"GET":
+            value = self._get(args[0])
+            if value is None:
+                return b"_\r\n" if connection["protocol"] == 3 else b"$-1\r\n"
+            return _bulk(value)
+        if name == b"SET":
+            expires_at = None
+            options = [arg.upper() for arg in args[2:]]
+            if b"EX" in options:
+                expires_at = time.monotonic() + int(args[2 + options.index(b"EX") + 1])
+            self.data[args[0]] = (args[1], expires_at)
+            return b"+OK\r\n"
+        if name == b"SETEX":
+            self.data[args[0]] = (args[2], time.monotonic() + int(args[1]))
+            return b"+OK\r\n"
+        if name == b"DEL":
+            return b":%d\r\n" % sum(self.data.pop(key, None) is not None for key in args)
+        if name == b"EXISTS":
+            return b":%d\r\n" % sum(self._get(key) is not None for key in args)
+        if name == b"PING":
+            return b"+PONG\r\n"
+        if name == b"HELLO":
+            # В RESP3 иначе кодируются только null и ответ HELLO
+            protocol = connection["protocol"] = int(args[0]) if args else 2
+            fields = [_bulk(b"server"), _bulk(b"redis"), _bulk(b"version"), _bulk(b"7.2.0"),
+                      _bulk(b"proto"), b":%d\r\n" % protocol]
+            header = b"%%%d\r\n" % (len(fields) // 2) if protocol == 3 else b"*%d\r\n" % len(fields)
+            return header + b"".join(fields)
+        return b"+OK\r\n"
+
+
+def _bulk(value: bytes) -> bytes:
+    return b"$%d\r\n%s\r\n" % (len(value), value)
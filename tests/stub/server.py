@@ -0,0 +1,495 @@
+"""
+Заглушка сервера Mattermost, работающая в том же процессе.
+
+Реализует REST-эндпоинты, которыми пользуется MMBot (posts, files, users,
+channels/direct, ephemeral), и поток событий WebSocket. Позволяет
+тестировать и нагружать ботов без настоящего Mattermost:
+
+    stub = MattermostStub(latency=0.005, error_rate=0.01)
+    bot = MMBot(stub.api_url, stub.token, transport=stub.transport)
+    listener = mattermost_ws_listener(routers, stub.ws_url, stub.token,
+                                      bot=bot, connect=stub.connect)
+    stub.emit_post(channel_id, user_id, "привет")  # Сообщение от пользователя
+
+Разорванную сессию WebSocket можно возобновить, передав в URL connection_id и
+sequence_number (как в Mattermost); allow_resume=False имитирует сервер, который
+сессию уже забыл.
+"""
+
+import asyncio
+import random
+import re
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+import websockets
+
+from aiomost.mattermost_actions.metrics import template_endpoint
+from aiomost.mattermost_json import codec
+
+
+def new_id() -> str:
+    """ID в формате Mattermost (26 символов [a-z0-9])."""
+    return uuid.uuid4().hex[:26]
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+_CLOSE = object()
+
+
+class StubWebSocket:
+    """Соединение WebSocket заглушки: интерфейс send()/recv(), как у websockets."""
+
+    def __init__(self, stub: "MattermostStub", connection_id: Optional[str] = None, seq: int = 0,
+                 replay: Tuple[str, ...] = ()):
+        """
+        :param connection_id: ID возобновляемой сессии (по умолчанию - новая сессия).
+        :param seq: Следующий seq (при возобновлении - продолжение нумерации).
+        :param replay: Пропущенные клиентом кадры, отправляемые после авторизации.
+        """
+        self.stub = stub
+        self.connection_id = connection_id or new_id()
+        self.authenticated = False
+        self.closed = False
+        self.seq = seq
+        self.history: deque = deque(maxlen=stub.resume_buffer)  # (seq, кадр)
+        self._replay = replay
+        self._frames: asyncio.Queue = asyncio.Queue()
+
+    async def send(self, message: str):
+        request = codec.loads(message)
+        if request.get("action") == "authentication_challenge":
+            token = (request.get("data") or {}).get("token")
+            if token != self.stub.token:
+                self.close()
+                return
+            self.authenticated = True
+            self._frames.put_nowait(codec.dumps({"status": "OK", "seq_reply": request.get("seq")}))
+            for frame in self._replay:
+                self._frames.put_nowait(frame)
+            self.push("hello", {"connection_id": self.connection_id,
+                                "server_version": self.stub.server_version})
+
+    async def recv(self) -> str:
+        frame = await self._frames.get()
+        if frame is _CLOSE:
+            raise websockets.ConnectionClosed(None, None)
+        return frame
+
+    def push(self, event: str, data: Dict, broadcast: Optional[Dict] = None):
+        """Отправляет клиенту событие с очередным seq."""
+        frame = codec.dumps({"event": event, "data": data, "broadcast": broadcast or {},
+                             "seq": self.seq})
+        self.history.append((self.seq, frame))
+        self.seq += 1
+        if not self.closed:
+            self._frames.put_nowait(frame)
+
+    def close(self):
+        self.closed = True
+        self._frames.put_nowait(_CLOSE)
+
+
+class MattermostStub:
+    """
+    Заглушка сервера Mattermost с настраиваемой задержкой и внедрением ошибок.
+
+    Состояние (пользователи, каналы, сообщения, файлы) хранится в памяти.
+    Сообщения, созданные через REST, рассылаются подключённым WebSocket-клиентам
+    событием posted, как это делает настоящий сервер.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        token: str = "stub-token",
+        seed: Optional[int] = None,
+        server_version: str = "9.11.0",
+        resume_buffer: int = 128,
+    ):
+        """
+        :param latency: Задержка каждого ответа REST (секунды).
+        :param jitter: Случайная добавка к задержке в [0, jitter] секунд.
+        :param error_rate: Доля запросов, на которые отвечается error_status.
+        :param error_status: Код ответа для внедрённых ошибок.
+        :param token: Токен бота, который принимает заглушка.
+        :param seed: Зерно генератора случайных чисел (для воспроизводимости).
+        :param server_version: Версия сервера в событии hello.
+        :param resume_buffer: Сколько последних событий разорванной сессии хранится для
+                              возобновления по connection_id и sequence_number.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.token = token
+        self.server_version = server_version
+        self.api_url = "http://mattermost.stub"
+        self.ws_url = "ws://mattermost.stub/api/v4/websocket"
+        self.random = random.Random(seed)
+        self.refuse_connections = False
+        self.allow_resume = True
+        self.resume_buffer = resume_buffer
+
+        self.team_id = new_id()
+        self.users: Dict[str, Dict] = {}
+        self.channels: Dict[str, Dict] = {}
+        self.members: Dict[str, Dict[str, Dict]] = {}  # channel_id -> user_id -> member
+        self.posts: Dict[str, Dict] = {}
+        self.ephemeral_posts: List[Dict] = []
+        self.files: Dict[str, Tuple[Dict, bytes]] = {}
+        self.avatars: Dict[str, bytes] = {}
+        self.sockets: List[StubWebSocket] = []
+        self.dead_sockets: Dict[str, StubWebSocket] = {}  # connection_id -> разорванная сессия
+        self.resumed_sessions = 0
+
+        self.requests: Counter = Counter()  # (method, шаблон endpoint) -> число запросов
+        self.injected_errors = 0
+        self._fail_next: List[int] = []
+
+        self.bot_user = self.add_user("stub-bot", is_bot=True)
+        self.transport = httpx.MockTransport(self.handle)
+        self._routes: List[Tuple[str, re.Pattern, Callable]] = [
+            ("GET", re.compile(r"users/me"), self._get_me),
+            ("POST", re.compile(r"users/ids"), self._get_users_by_ids),
+            ("POST", re.compile(r"users/usernames"), self._get_users_by_usernames),
+            ("GET", re.compile(r"users/username/(?P<username>[^/]+)"), self._get_user_by_username),
+            ("GET", re.compile(r"users"), self._list_users),
+            ("GET", re.compile(r"users/(?P<user_id>\w+)"), self._get_user),
+            ("PUT", re.compile(r"users/(?P<user_id>\w+)/patch"), self._patch_user),
+            ("POST", re.compile(r"users/(?P<user_id>\w+)/image"), self._set_user_image),
+            ("POST", re.compile(r"posts"), self._create_post),
+            ("POST", re.compile(r"posts/ephemeral"), self._create_ephemeral_post),
+            ("PUT", re.compile(r"posts/(?P<post_id>\w+)"), self._update_post),
+            ("DELETE", re.compile(r"posts/(?P<post_id>\w+)"), self._delete_post),
+            ("GET", re.compile(r"channels/(?P<channel_id>\w+)/posts"), self._get_channel_posts),
+            ("POST", re.compile(r"channels/direct"), self._create_direct_channel),
+            ("GET", re.compile(r"channels/(?P<channel_id>\w+)/members"), self._get_channel_members),
+            ("GET", re.compile(r"channels/(?P<channel_id>\w+)/members/(?P<user_id>\w+)"),
+             self._get_channel_member),
+            ("POST", re.compile(r"files"), self._upload_file),
+            ("GET", re.compile(r"files/(?P<file_id>\w+)"), self._get_file),
+        ]
+
+    # Наполнение и управление
+
+    def add_user(self, username: str, is_bot: bool = False, **fields) -> Dict:
+        user = {"id": new_id(), "username": username, "create_at": _now_ms(), "update_at": _now_ms(),
+                "delete_at": 0, "email": f"{username}@stub.local", "first_name": "", "last_name": "",
+                "nickname": "", "roles": "system_user", "locale": "ru", "is_bot": is_bot,
+                "team_id": self.team_id, **fields}
+        self.users[user["id"]] = user
+        return user
+
+    def add_channel(self, name: str, channel_type: str = "O", members: Tuple[str, ...] = (),
+                    admins: Tuple[str, ...] = ()) -> Dict:
+        channel = {"id": new_id(), "name": name, "display_name": name, "type": channel_type,
+                   "team_id": self.team_id, "create_at": _now_ms()}
+        self.channels[channel["id"]] = channel
+        self.members[channel["id"]] = {}
+        for user_id in (*members, *admins):
+            self.add_member(channel["id"], user_id, admin=user_id in admins)
+        return channel
+
+    def add_member(self, channel_id: str, user_id: str, admin: bool = False):
+        roles = "channel_user channel_admin" if admin else "channel_user"
+        self.members[channel_id][user_id] = {"channel_id": channel_id, "user_id": user_id,
+                                             "roles": roles}
+
+    def add_file(self, content: bytes, name: str = "file.bin",
+                 mime_type: str = "application/octet-stream") -> str:
+        file_id = new_id()
+        self.files[file_id] = ({"id": file_id, "name": name, "mime_type": mime_type,
+                                "size": len(content)}, content)
+        return file_id
+
+    def fail_next(self, count: int = 1, status: Optional[int] = None):
+        """Следующие count запросов REST получат ответ status (по умолчанию error_status)."""
+        self._fail_next.extend([status or self.error_status] * count)
+
+    def emit(self, event: str, data: Dict, broadcast: Optional[Dict] = None):
+        """
+        Рассылает событие всем подключённым WebSocket-клиентам. Разорванные сессии
+        тоже получают его в историю - для возобновления.
+        """
+        for socket in (*self.sockets, *self.dead_sockets.values()):
+            if socket.authenticated:
+                socket.push(event, data, broadcast)
+
+    def emit_post(self, channel_id: str, user_id: str, message: str, **fields) -> Dict:
+        """Создаёт сообщение от имени пользователя (как будто он написал его в клиенте)."""
+        return self._store_post({"channel_id": channel_id, "message": message, **fields}, user_id)
+
+    def drop_connections(self):
+        """Разрывает все WebSocket-соединения (клиент получит ConnectionClosed)."""
+        for socket in self.sockets:
+            socket.close()
+            if socket.authenticated:
+                self.dead_sockets[socket.connection_id] = socket
+        self.sockets = []
+
+    @asynccontextmanager
+    async def connect(self, url: str, **kwargs):
+        """Фабрика соединений для mattermost_ws_listener(..., connect=stub.connect)."""
+        if self.refuse_connections:
+            raise ConnectionRefusedError("Заглушка отклоняет подключения")
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        socket = self._resume(httpx.URL(url).params) or StubWebSocket(self)
+        self.sockets.append(socket)
+        try:
+            yield socket
+        finally:
+            if socket in self.sockets:
+                self.sockets.remove(socket)
+
+    def _resume(self, params) -> Optional[StubWebSocket]:
+        """Возобновляет сессию, если её connection_id известен и пропущенные события в буфере."""
+        dead = self.dead_sockets.pop(params.get("connection_id", ""), None)
+        if dead is None or not self.allow_resume or "sequence_number" not in params:
+            return None
+        next_seq = int(params["sequence_number"])
+        if dead.history and dead.history[0][0] > next_seq:
+            return None  # Часть пропущенных событий уже вытеснена из буфера
+        self.resumed_sessions += 1
+        replay = tuple(frame for seq, frame in dead.history if seq >= next_seq)
+        return StubWebSocket(self, dead.connection_id, dead.seq, replay)
+
+    # REST
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path.strip("/")
+        if path.startswith("api/v4/"):
+            path = path[len("api/v4/"):]
+        self.requests[(request.method, template_endpoint(path))] += 1
+
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if request.headers.get("Authorization") != f"Bearer {self.token}":
+            return self._error(401, "api.context.session_expired.app_error")
+        if self._fail_next:
+            status = self._fail_next.pop(0)
+            self.injected_errors += 1
+            return self._error(status, "stub.injected_error")
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.injected_errors += 1
+            return self._error(self.error_status, "stub.injected_error")
+
+        for method, pattern, handler in self._routes:
+            if method != request.method:
+                continue
+            match = pattern.fullmatch(path)
+            if match:
+                return await handler(request, **match.groupdict())
+        return self._error(404, "api.context.404.app_error")
+
+    def _error(self, status: int, error_id: str) -> httpx.Response:
+        return httpx.Response(status, json={"id": error_id, "status_code": status, "message": error_id})
+
+    def _not_found(self, what: str) -> httpx.Response:
+        return self._error(404, f"app.{what}.get.app_error")
+
+    async def _get_me(self, request):
+        return httpx.Response(200, json=self.bot_user)
+
+    async def _get_user(self, request, user_id):
+        user = self.users.get(user_id)
+        if user is None:
+            return self._not_found("user")
+        return httpx.Response(200, json=user, headers={"ETag": f'"{user["update_at"]}"'})
+
+    async def _get_user_by_username(self, request, username):
+        for user in self.users.values():
+            if user["username"] == username:
+                return httpx.Response(200, json=user)
+        return self._not_found("user")
+
+    async def _get_users_by_ids(self, request):
+        ids = codec.loads(request.content)
+        return httpx.Response(200, json=[self.users[i] for i in ids if i in self.users])
+
+    async def _get_users_by_usernames(self, request):
+        names = set(codec.loads(request.content))
+        return httpx.Response(200, json=[u for u in self.users.values() if u["username"] in names])
+
+    async def _list_users(self, request):
+        params = request.url.params
+        users = list(self.users.values())
+        if params.get("in_team"):
+            users = [u for u in users if u.get("team_id") == params["in_team"]]
+        if params.get("in_channel"):
+            members = self.members.get(params["in_channel"], {})
+            users = [u for u in users if u["id"] in members]
+        return httpx.Response(200, json=self._page(users, params))
+
+    async def _patch_user(self, request, user_id):
+        user = self.users.get(user_id)
+        if user is None:
+            return self._not_found("user")
+        user.update(codec.loads(request.content))
+        user["id"] = user_id
+        user["update_at"] = _now_ms()
+        return httpx.Response(200, json=user)
+
+    async def _set_user_image(self, request, user_id):
+        if user_id not in self.users:
+            return self._not_found("user")
+        parts = _parse_multipart(request)
+        self.avatars[user_id] = parts["image"][1]
+        return httpx.Response(200, json={"status": "OK"})
+
+    async def _create_post(self, request):
+        data = codec.loads(request.content)
+        if data.get("channel_id") not in self.channels:
+            return self._error(403, "api.context.permissions.app_error")
+        pending_post_id = data.get("pending_post_id")
+        if pending_post_id:
+            # Как и Mattermost, не создаём дубликат повторно отправленного сообщения
+            for post in self.posts.values():
+                if post["pending_post_id"] == pending_post_id:
+                    return httpx.Response(201, json=post)
+        post = self._store_post(data, self.bot_user["id"], from_bot=True)
+        return httpx.Response(201, json=post)
+
+    def _store_post(self, data: Dict, user_id: str, from_bot: bool = False) -> Dict:
+        props = dict(data.get("props") or {})
+        if from_bot:
+            props["from_bot"] = "true"
+        now = _now_ms()
+        post = {"id": new_id(), "create_at": now, "update_at": now, "edit_at": 0, "delete_at": 0,
+                "is_pinned": False, "user_id": user_id, "channel_id": data["channel_id"],
+                "root_id": data.get("root_id", ""), "original_id": "", "message": data.get("message", ""),
+                "type": data.get("type", ""), "props": props, "hashtags": "",
+                "file_ids": data.get("file_ids") or [], "pending_post_id": data.get("pending_post_id", ""),
+                "reply_count": 0, "metadata": {}}
+        self.posts[post["id"]] = post
+        channel = self.channels[post["channel_id"]]
+        sender = self.users.get(user_id, {})
+        self.emit("posted", {
+            "channel_display_name": channel["display_name"], "channel_name": channel["name"],
+            "channel_type": channel["type"], "post": codec.dumps(post),
+            "sender_name": f"@{sender.get('username', '')}", "set_online": True,
+            "team_id": channel["team_id"],
+        }, {"channel_id": channel["id"]})
+        return post
+
+    async def _create_ephemeral_post(self, request):
+        data = codec.loads(request.content)
+        post = {"id": new_id(), "user_id": data["user_id"], **data["post"]}
+        self.ephemeral_posts.append(post)
+        return httpx.Response(201, json=post)
+
+    async def _update_post(self, request, post_id):
+        post = self.posts.get(post_id)
+        if post is None:
+            return self._not_found("post")
+        data = codec.loads(request.content)
+        post.update({"message": data.get("message", post["message"]), "props": data.get("props", {}),
+                     "edit_at": _now_ms(), "update_at": _now_ms()})
+        return httpx.Response(200, json=post)
+
+    async def _delete_post(self, request, post_id):
+        if self.posts.pop(post_id, None) is None:
+            return self._not_found("post")
+        return httpx.Response(200, json={"status": "OK"})
+
+    async def _get_channel_posts(self, request, channel_id):
+        if channel_id not in self.channels:
+            return self._not_found("channel")
+        params = request.url.params
+        posts = sorted((p for p in self.posts.values() if p["channel_id"] == channel_id),
+                       key=lambda p: p["create_at"], reverse=True)
+        if "since" in params:
+            since = int(params["since"])
+            posts = [p for p in posts if p["update_at"] > since]
+        else:
+            posts = self._page(posts, params)
+        return httpx.Response(200, json={"order": [p["id"] for p in posts],
+                                         "posts": {p["id"]: p for p in posts}})
+
+    async def _create_direct_channel(self, request):
+        user_ids = sorted(codec.loads(request.content))
+        name = "__".join(user_ids)
+        for channel in self.channels.values():
+            if channel["name"] == name:
+                return httpx.Response(201, json=channel)
+        channel = self.add_channel(name, "D", members=tuple(user_ids))
+        return httpx.Response(201, json=channel)
+
+    async def _get_channel_members(self, request, channel_id):
+        members = self.members.get(channel_id)
+        if members is None:
+            return self._not_found("channel")
+        return httpx.Response(200, json=self._page(list(members.values()), request.url.params))
+
+    async def _get_channel_member(self, request, channel_id, user_id):
+        member = self.members.get(channel_id, {}).get(user_id)
+        if member is None:
+            return self._not_found("channel_member")
+        return httpx.Response(200, json=member)
+
+    async def _upload_file(self, request):
+        content = await request.aread()
+        parts = _parse_multipart(request, content)
+        infos = []
+        for name, (filename, data, mime_type) in parts.items():
+            if name == "files":
+                file_id = self.add_file(data, filename, mime_type)
+                infos.append(self.files[file_id][0])
+        return httpx.Response(201, json={"file_infos": infos, "client_ids": []})
+
+    async def _get_file(self, request, file_id):
+        entry = self.files.get(file_id)
+        if entry is None:
+            return self._not_found("file")
+        info, content = entry
+        return httpx.Response(200, content=content, headers={"Content-Type": info["mime_type"]})
+
+    @staticmethod
+    def _page(items: List[Any], params) -> List[Any]:
+        page = int(params.get("page", 0))
+        per_page = int(params.get("per_page", 60))
+        return items[page * per_page:(page + 1) * per_page]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": sum(self.requests.values()),
+            "by_endpoint": {f"{method} {endpoint}": count
+                            for (method, endpoint), count in self.requests.most_common()},
+            "injected_errors": self.injected_errors,
+            "posts": len(self.posts),
+            "websockets": len(self.sockets),
+            "resumed_sessions": self.resumed_sessions,
+        }
+
+
+def _parse_multipart(request: httpx.Request, content: Optional[bytes] = None) -> Dict[str, Tuple]:
+    """Разбирает multipart/form-data: {имя поля: (имя файла, данные, тип)}."""
+    content = request.content if content is None else content
+    boundary = request.headers["Content-Type"].split("boundary=", 1)[1].strip('"').encode()
+    parts = {}
+    for part in content.split(b"--" + boundary)[1:-1]:
+        # Часть обрамлена CRLF; данные внутри могут сами оканчиваться на CRLF
+        part = part[2:] if part.startswith(b"\r\n") else part
+        part = part[:-2] if part.endswith(b"\r\n") else part
+        head, _, data = part.partition(b"\r\n\r\n")
+        headers = head.decode("utf-8", "replace")
+        name = re.search(r'name="([^"]*)"', headers)
+        filename = re.search(r'filename="([^"]*)"', headers)
+        mime_type = re.search(r"Content-Type: *([^\r\n]+)", headers, re.IGNORECASE)
+        if name:
+            parts[name.group(1)] = (filename.group(1) if filename else None, data,
+                                    mime_type.group(1) if mime_type else "application/octet-stream")
+    return parts
@@ -0,0 +1,670 @@
+"""Tests for the Mattermost REST client"""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from aiomost import MMBot
+
+
+def make_bot(handler, **kwargs):
+    bot = MMBot("http://mm.test", "token", **kwargs)
+    bot._build_client = lambda: httpx.AsyncClient(
+        transport=httpx.MockTransport(handler))
+    return bot
+
+
+async def test_requests_share_one_pool():
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        if request.url.path == "/api/v4/users/me":
+            return httpx.Response(200, json={"id": "bot"})
+        return httpx.Response(201, json={"id": "post"})
+
+    bot = make_bot(handler)
+    async with bot:
+        client = bot.client
+        assert await bot.get_bot_user_id() == "bot"
+        await bot.send_message("chan", "hi")
+        assert bot.client is client
+
+    assert bot._client is None
+    assert seen[0].headers["Authorization"] == "Bearer token"
+    assert json.loads(seen[1].content)["channel_id"] == "chan"
+
+
+async def test_client_reopens_after_aclose():
+    bot = make_bot(lambda request: httpx.Response(200, json={"id": "bot"}))
+    first = bot.client
+    await bot.aclose()
+    assert first.is_closed
+    assert await bot.get_bot_user_id() == "bot"
+    assert bot.client is not first
+    await bot.aclose()
+
+
+async def test_send_message_with_files_uses_pool():
+    def handler(request):
+        path = request.url.path
+        if path.startswith("/api/v4/files/"):
+            return httpx.Response(
+                200, content=b"data", headers={"Content-Type": "text/plain"})
+        if path == "/api/v4/files":
+            assert b'name="channel_id"' in request.content
+            return httpx.Response(201, json={"file_infos": [{"id": "new"}]})
+        assert json.loads(request.content)["file_ids"] == ["new", "new"]
+        return httpx.Response(201, json={"id": "post"})
+
+    async with make_bot(handler) as bot:
+        await bot.send_message_with_files("chan", "files", ["a", "b"])
+        files = await bot.get_files_by_ids(["a"])
+
+    assert files[0]["content"] == b"data"
+    assert files[0]["filename"] == "a.txt"
+
+
+async def test_send_message_with_files_skips_failed_files():
+    posts = []
+
+    def handler(request):
+        path = request.url.path
+        if path == "/api/v4/files/broken":
+            raise httpx.ConnectError("connection reset", request=request)
+        if path == "/api/v4/files/missing":
+            return httpx.Response(404)
+        if path.startswith("/api/v4/files/"):
+            return httpx.Response(200, content=b"data", headers={"Content-Type": "text/plain"})
+        if path == "/api/v4/files":
+            return httpx.Response(201, json={"file_infos": [{"id": "new"}]})
+        posts.append(json.loads(request.content))
+        return httpx.Response(201, json={"id": "post"})
+
+    async with make_bot(handler) as bot:
+        await bot.send_message_with_files("chan", "files", ["broken", "a", "missing"])
+    assert [post["file_ids"] for post in posts] == [["new"]]
+
+
+async def test_http2_falls_back_without_h2(monkeypatch):
+    from aiomost.mattermost_actions import mm_actions
+
+    monkeypatch.setattr(mm_actions, "_HAS_HTTP2", False)
+    bot = make_bot(lambda request: httpx.Response(200, json={"id": "bot"}),
+                   http2=True)
+    assert bot.http2 is False
+    await bot.get_bot_user_id()
+    assert bot.http_version == "HTTP/1.1"
+    await bot.aclose()
+
+
+async def test_rate_limiter_retries_429_instead_of_failing():
+    from aiomost import RateLimiter
+
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            return httpx.Response(429, headers={"Retry-After": "0.05"})
+        return httpx.Response(201, json={"id": "post"},
+                              headers={"X-RateLimit-Limit": "100",
+                                       "X-RateLimit-Remaining": "99",
+                                       "X-RateLimit-Reset": "1"})
+
+    limiter = RateLimiter(rate=100)
+    async with make_bot(handler, rate_limiter=limiter) as bot:
+        assert (await bot.send_message("chan", "hi"))["id"] == "post"
+
+    stats = limiter.stats()
+    assert len(calls) == 2
+    assert stats["throttled"] == 1
+    assert stats["acquired"] == 2
+    assert stats["last_wait"] >= 0.04
+    assert limiter.bucket.capacity == 100
+
+
+async def test_rate_limiter_queues_bursts():
+    from aiomost import RateLimiter
+
+    limiter = RateLimiter(rate=50, burst=1, endpoint_rates={"posts": 50})
+    tasks = [asyncio.ensure_future(limiter.acquire("api/v4/posts"))
+             for _ in range(5)]
+    await asyncio.sleep(0.01)
+    assert limiter.queue_depth == 4
+    await asyncio.gather(*tasks)
+    assert limiter.queue_depth == 0
+    assert limiter.stats()["max_wait"] >= 0.06
+    assert set(limiter.family_buckets) == {"posts"}
+
+
+async def test_retry_policy_is_idempotency_aware():
+    from aiomost import RetryPolicy
+
+    calls = []
+
+    def handler(request):
+        seen = (request.method, request.content) in calls
+        calls.append((request.method, request.content))
+        if not seen:
+            return httpx.Response(503, headers={"Retry-After": "0"})
+        return httpx.Response(201 if request.method == "POST" else 200,
+                              json={"id": "x"})
+
+    policy = RetryPolicy(max_attempts=2, backoff_base=0.01)
+    async with make_bot(handler, retry_policy=policy) as bot:
+        assert await bot.get_bot_user_id() == "x"
+        with pytest.raises(httpx.HTTPStatusError):
+            await bot.send_message("chan", "no key")
+        await bot.send_message("chan", "with key", idempotency_key="key-1")
+
+    assert [method for method, _ in calls] == ["GET", "GET", "POST", "POST", "POST"]
+    assert json.loads(calls[-1][1])["pending_post_id"] == "key-1"
+    assert policy.retries == 2
+
+
+def test_rate_limit_reset_only_delays_429(monkeypatch):
+    from aiomost import RetryPolicy
+
+    monkeypatch.setattr("random.uniform", lambda low, high: high)
+    policy = RetryPolicy(backoff_base=0.5)
+    headers = {"X-RateLimit-Reset": "0"}
+    assert policy.delay_for_response(0, headers, 429) == 0
+    # X-RateLimit-Reset есть в каждом ответе: 5xx повторяется с экспоненциальной паузой
+    assert policy.delay_for_response(0, headers, 503) == 0.5
+    assert policy.delay_for_response(2, headers, 502) == 2.0
+    assert policy.delay_for_response(2, {"Retry-After": "1", **headers}, 503) == 1.0
+
+
+async def test_circuit_breaker_fails_fast():
+    from aiomost import CircuitBreaker, CircuitOpenError
+
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        raise httpx.ConnectError("down", request=request)
+
+    breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=60)
+    async with make_bot(handler, circuit_breaker=breaker) as bot:
+        for _ in range(2):
+            with pytest.raises(httpx.ConnectError):
+                await bot.get_bot_user_id()
+        with pytest.raises(CircuitOpenError):
+            await bot.get_bot_user_id()
+
+    assert len(calls) == 2
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.rejected == 1
+
+
+async def test_send_messages_many_streams_results():
+    in_flight = []
+    peak = []
+
+    async def handler(request):
+        body = json.loads(request.content)
+        in_flight.append(body)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.remove(body)
+        if body["channel_id"] == "bad":
+            return httpx.Response(403, json={"id": "forbidden"})
+        return httpx.Response(201, json={"channel_id": body["channel_id"]})
+
+    async def messages():
+        for i in range(20):
+            yield ("bad" if i == 3 else f"chan{i}", "hello")
+
+    async with make_bot(handler) as bot:
+        results = [r async for r in bot.send_messages_many(messages(), concurrency=4)]
+
+    assert len(results) == 20
+    assert max(peak) == 4
+    failed = [r for r in results if not r.ok]
+    assert [r.index for r in failed] == [3]
+    assert isinstance(failed[0].error, httpx.HTTPStatusError)
+    assert {r.result["channel_id"] for r in results if r.ok} == {
+        f"chan{i}" for i in range(20) if i != 3}
+
+
+async def test_iter_files_by_ids_streams_to_disk(tmp_path):
+    def handler(request):
+        file_id = request.url.path.rsplit("/", 1)[-1]
+        if file_id == "missing":
+            return httpx.Response(404, json={"id": "not_found"})
+        return httpx.Response(200, content=file_id.encode() * 1000,
+                              headers={"Content-Type": "image/png"})
+
+    async with make_bot(handler) as bot:
+        files = [f async for f in bot.iter_files_by_ids(
+            ["a", "missing", "b"], dest_dir=str(tmp_path), chunk_size=256)]
+
+    assert sorted(f["file_id"] for f in files) == ["a", "b"]
+    for f in files:
+        assert "content" not in f
+        assert f["size"] == 1000
+        assert (tmp_path / f"{f['file_id']}.png").read_bytes() == f["file_id"].encode() * 1000
+
+
+async def test_forwarded_upload_has_content_length():
+    uploads = []
+
+    def handler(request):
+        if request.url.path.startswith("/api/v4/files/"):
+            return httpx.Response(200, content=b"x" * 5000,
+                                  headers={"Content-Type": "text/plain"})
+        if request.url.path == "/api/v4/files":
+            uploads.append(request)
+            return httpx.Response(201, json={"file_infos": [{"id": "new"}]})
+        return httpx.Response(201, json={"id": "post"})
+
+    async with make_bot(handler) as bot:
+        await bot.send_message_with_files("chan", "files", ["a"])
+
+    request = uploads[0]
+    assert int(request.headers["Content-Length"]) == len(request.content)
+    assert request.headers["Content-Type"].startswith("multipart/form-data")
+    assert b"x" * 5000 in request.content
+
+
+async def test_direct_messages_cache_bot_id_and_channels():
+    calls = []
+    deleted = set()
+
+    def handler(request):
+        path = request.url.path
+        calls.append(path)
+        if path == "/api/v4/users/me":
+            return httpx.Response(200, json={"id": "bot"})
+        if path == "/api/v4/channels/direct":
+            user_id = json.loads(request.content)[1]
+            generation = calls.count(path)
+            return httpx.Response(201, json={"id": f"dm-{user_id}-{generation}"})
+        channel_id = json.loads(request.content)["channel_id"]
+        if channel_id in deleted:
+            return httpx.Response(404, json={"id": "app.channel.get.existing.app_error"})
+        return httpx.Response(201, json={"channel_id": channel_id})
+
+    async with make_bot(handler) as bot:
+        results = [r async for r in bot.send_direct_messages(
+            [("u1", "a"), ("u2", "b"), ("u1", "c")], concurrency=3)]
+        assert all(r.ok for r in results)
+        assert calls.count("/api/v4/users/me") == 1
+        assert calls.count("/api/v4/channels/direct") == 2
+
+        deleted.add(bot.dm_channels.get("u1"))
+        post = await bot.send_direct_message("u1", "again")
+
+    assert post["channel_id"] == "dm-u1-3"
+    assert calls.count("/api/v4/users/me") == 1
+    assert bot.dm_channels.stats()["hits"] >= 1
+
+
+async def test_user_cache_by_id_and_username():
+    from aiomost import UserCache
+
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(200, json={"id": "u1", "username": "alice"})
+
+    cache = UserCache(maxsize=10, ttl=60)
+    async with make_bot(handler, user_cache=cache) as bot:
+        user = await bot.get_user_info("u1")
+        assert await bot.get_user_by_username("alice") is user
+        assert await bot.get_user_info("u1") is user
+        assert len(calls) == 1
+
+        cache.handle_event("user_updated", {
+            "event": "user_updated", "data": {"user": {"id": "u1"}}})
+        await bot.get_user_by_username("alice")
+        assert len(calls) == 2
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["invalidations"]) == (2, 2, 1)
+
+
+@pytest.mark.parametrize("batch_window", [None, 0.01])
+async def test_user_cache_ignores_username_case(batch_window):
+    from aiomost import UserCache
+
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        user = {"id": "u1", "username": "alice"}
+        return httpx.Response(200, json=[user] if batch_window else user)
+
+    cache = UserCache(maxsize=10, ttl=60)
+    async with make_bot(handler, user_cache=cache, user_batch_window=batch_window) as bot:
+        for username in ("Alice", "ALICE", "alice"):
+            assert (await bot.get_user_by_username(username)).id == "u1"
+        assert len(calls) == 1
+
+        cache.invalidate("u1")
+        assert cache.get_by_username("Alice") is None
+
+
+async def test_user_lookups_are_batched():
+    calls = []
+
+    def handler(request):
+        keys = json.loads(request.content)
+        calls.append((request.url.path, sorted(keys)))
+        if request.url.path == "/api/v4/users/ids":
+            users = [{"id": key, "username": f"name-{key}"} for key in keys if key != "gone"]
+        else:
+            users = [{"id": f"id-{key}", "username": key.lower()} for key in keys]
+        return httpx.Response(200, json=users)
+
+    async with make_bot(handler, user_batch_window=0.01) as bot:
+        users = await asyncio.gather(
+            bot.get_user_info("u1"), bot.get_user_info("u2"),
+            bot.get_user_info("u1"), bot.get_user_info("gone"),
+            bot.get_user_by_username("alice"), bot.get_user_by_username("Alice"))
+
+    assert calls == [("/api/v4/users/ids", ["gone", "u1", "u2"]),
+                     ("/api/v4/users/usernames", ["alice"])]
+    assert [u and u.id for u in users] == ["u1", "u2", "u1", None, "id-alice", "id-alice"]
+    assert users[0] is not users[2]
+    assert bot.user_id_loader.stats()["deduplicated"] == 1
+
+
+async def test_cancelled_batch_does_not_hang_waiters():
+    from aiomost.mattermost_actions.batcher import BatchLoader
+
+    started = asyncio.Event()
+
+    async def batch_fn(keys):
+        started.set()
+        await asyncio.sleep(10)
+
+    loader = BatchLoader(batch_fn, window=0)
+    waiters = [asyncio.ensure_future(loader.load(key)) for key in ("a", "b", "a")]
+    await started.wait()
+    for task in loader._tasks:
+        task.cancel()
+    results = await asyncio.wait_for(asyncio.gather(*waiters, return_exceptions=True), 1)
+    assert all(isinstance(result, asyncio.CancelledError) for result in results)
+    assert not loader._in_flight
+
+
+async def test_identical_gets_are_collapsed():
+    calls = []
+
+    async def handler(request):
+        calls.append(request.url.path)
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={"id": request.url.path.rsplit("/", 1)[-1]})
+
+    async with make_bot(handler, dedupe_gets=["api/v4/users/*"]) as bot:
+        users = await asyncio.gather(*(bot.get_user_info("u1") for _ in range(5)),
+                                     bot.get_user_info("u2"))
+        await asyncio.gather(bot.send_request("api/v4/teams/t", "GET"),
+                             bot.send_request("api/v4/teams/t", "GET"))
+        await asyncio.gather(bot.send_request("api/v4/teams/x", "GET", dedupe=True),
+                             bot.send_request("api/v4/teams/x", "GET", dedupe=True))
+
+    assert [u.id for u in users] == ["u1"] * 5 + ["u2"]
+    assert calls.count("/api/v4/users/u1") == 1
+    assert calls.count("/api/v4/teams/t") == 2
+    assert calls.count("/api/v4/teams/x") == 1
+    assert bot.request_dedupe.collapsed == 5
+
+
+async def test_outbox_orders_per_channel_and_retries():
+    posts = []
+    failed_once = set()
+    in_flight = {"now": 0, "peak": 0}
+
+    async def handler(request):
+        body = json.loads(request.content)
+        in_flight["now"] += 1
+        in_flight["peak"] = max(in_flight["peak"], in_flight["now"])
+        await asyncio.sleep(0.01)
+        in_flight["now"] -= 1
+        if body["message"] == "a2" and "a2" not in failed_once:
+            failed_once.add("a2")
+            return httpx.Response(503, headers={"Retry-After": "0"})
+        posts.append((body["channel_id"], body["message"], body["pending_post_id"]))
+        return httpx.Response(201, json={"id": body["message"]})
+
+    bot = make_bot(handler, outbox_workers=4)
+    futures = []
+    for i in range(1, 4):
+        futures.append(await bot.enqueue_message("A", f"a{i}"))
+        futures.append(await bot.enqueue_message("B", f"b{i}"))
+    await bot.aclose()
+
+    assert [f.result()["id"] for f in futures] == ["a1", "b1", "a2", "b2", "a3", "b3"]
+    assert [m for c, m, _ in posts if c == "A"] == ["a1", "a2", "a3"]
+    assert [m for c, m, _ in posts if c == "B"] == ["b1", "b2", "b3"]
+    assert in_flight["peak"] == 2
+    assert bot.outbox.stats()["retries"] == 1
+    assert len({key for _, _, key in posts}) == 6
+
+
+async def test_outbox_overflow_policies():
+    from aiomost import Outbox, OutboxFull
+
+    gate = asyncio.Event()
+
+    async def job():
+        await gate.wait()
+
+    outbox = Outbox(workers=1, maxsize=2, overflow="raise")
+    await outbox.put("A", job)
+    await asyncio.sleep(0)  # Воркер забирает первое задание
+    dropped = await outbox.put("A", job)
+    await outbox.put("B", job)
+    with pytest.raises(OutboxFull):
+        await outbox.put("C", job)
+
+    outbox.overflow = "drop_oldest"
+    await outbox.put("C", job)
+    assert isinstance(dropped.exception(), OutboxFull)
+    gate.set()
+    await outbox.aclose()
+    assert outbox.stats()["dropped"] == 1
+    assert outbox.stats()["sent"] == 3
+
+
+async def test_edit_message_coalesces_progress_updates():
+    edits = []
+
+    def handler(request):
+        edits.append(json.loads(request.content)["message"])
+        return httpx.Response(200, json={})
+
+    bot = make_bot(handler, edit_coalesce_interval=0.05)
+    for i in range(10):
+        bot.enqueue_edit("post", f"{i * 10}%")
+        await asyncio.sleep(0.002)
+    await asyncio.sleep(0.08)
+    final = bot.enqueue_edit("post", "done")
+    assert await bot.edit_message("other", "x") is None
+    await bot.aclose()
+
+    assert final.done()
+    assert edits[0] == "0%" and edits[1] == "90%"
+    assert edits[-2:] == ["done", "x"] or edits[-2:] == ["x", "done"]
+    assert len(edits) == 4
+    assert bot.edit_coalescer.stats()["coalesced"] == 8
+
+
+async def test_cancelled_edit_does_not_stall_later_edits():
+    from aiomost.mattermost_actions.coalescer import Coalescer
+
+    sent = []
+    gate = asyncio.Event()
+
+    async def send(key, payload):
+        await gate.wait()
+        sent.append(payload)
+
+    coalescer = Coalescer(send, interval=0)
+    first = coalescer.submit("post", "a")
+    await asyncio.sleep(0)
+    queued = coalescer.submit("post", "b")
+    coalescer._pending["post"].task.cancel()
+    await asyncio.sleep(0)
+    assert first.cancelled() and queued.cancelled()
+    assert coalescer.stats()["pending"] == 0
+
+    gate.set()
+    assert await asyncio.wait_for(coalescer.submit("post", "c"), 1) is None
+    assert sent == ["c"]
+
+
+async def test_pagination_prefetches_and_stops_early():
+    requested = []
+
+    async def handler(request):
+        page = int(request.url.params["page"])
+        requested.append((request.url.path, page))
+        await asyncio.sleep(0.005)
+        if request.url.path == "/api/v4/users":
+            assert request.url.params["in_team"] == "t1"
+            ids = [f"u{i}" for i in range(page * 2, min(page * 2 + 2, 5))]
+            return httpx.Response(200, json=[{"id": i, "username": i} for i in ids])
+        order = [f"p{page}-{i}" for i in range(2)]
+        return httpx.Response(200, json={
+            "order": order, "posts": {p: {"id": p, "create_at": 1} for p in order}})
+
+    async with make_bot(handler) as bot:
+        users = [u.id async for u in bot.iter_team_users("t1", per_page=2, prefetch=2)]
+        assert users == ["u0", "u1", "u2", "u3", "u4"]
+
+        requested.clear()
+        seen = []
+        async for post in bot.iter_channel_posts("c1", per_page=2, prefetch=1):
+            seen.append(post["id"])
+            await asyncio.sleep(0.02)  # Следующая страница грузится в это время
+            if len(seen) == 3:
+                break
+
+    assert seen == ["p0-0", "p0-1", "p1-0"]
+    assert requested == [("/api/v4/channels/c1/posts", 0), ("/api/v4/channels/c1/posts", 1),
+                         ("/api/v4/channels/c1/posts", 2)]
+
+
+async def test_etag_cache_serves_304_from_cache():
+    from aiomost import ResponseCache
+
+    conditional = []
+
+    def handler(request):
+        conditional.append(request.headers.get("If-None-Match"))
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304, headers={"ETag": '"v1"'})
+        return httpx.Response(200, json={"id": "u1", "username": "alice"},
+                              headers={"ETag": '"v1"'})
+
+    cache = ResponseCache(maxsize=10)
+    async with make_bot(handler, etag_cache=cache) as bot:
+        first = await bot.get_user_info("u1")
+        second = await bot.get_user_info("u1")
+        response = await bot.send_request("api/v4/users/u1", "GET")
+
+    assert conditional == [None, '"v1"', '"v1"']
+    assert first.username == second.username == "alice"
+    assert response.status_code == 200 and response.json()["id"] == "u1"
+    stats = cache.stats()
+    assert (stats["requests"], stats["conditional"], stats["not_modified"]) == (3, 2, 2)
+    assert stats["not_modified_ratio"] == 1.0
+
+
+async def test_etag_cache_serves_304_after_eviction():
+    from aiomost import ResponseCache
+
+    cache = ResponseCache(maxsize=10)
+
+    def handler(request):
+        if request.headers.get("If-None-Match") == '"v1"':
+            # Конкурентные GET вытеснили запись, пока запрос был в пути
+            cache.clear()
+            return httpx.Response(304, headers={"ETag": '"v1"'})
+        return httpx.Response(200, json={"id": "u1"}, headers={"ETag": '"v1"'})
+
+    async with make_bot(handler, etag_cache=cache) as bot:
+        await bot.send_request("api/v4/users/u1", "GET")
+        response = await bot.send_request("api/v4/users/u1", "GET")
+
+    assert response.status_code == 200 and response.json() == {"id": "u1"}
+    assert cache.stats()["not_modified"] == 1
+    assert len(cache.entries) == 1
+
+
+async def test_avatar_sync_skips_unchanged_images():
+    images = {"u1": b"png-1", "u2": b"png-2", "u3": None}
+    uploads = []
+
+    def handler(request):
+        if request.url.host == "cdn.test":
+            image = images[request.url.path.strip("/")]
+            if image is None:
+                return httpx.Response(404)
+            return httpx.Response(200, content=image, headers={"Content-Type": "image/png"})
+        assert b"image/png" in request.content
+        uploads.append(request.url.path)
+        return httpx.Response(200, json={"status": "OK"})
+
+    avatars = [(user_id, f"https://cdn.test/{user_id}") for user_id in images]
+    async with make_bot(handler) as bot:
+        first = {r.item[0]: r async for r in bot.sync_avatars(avatars, concurrency=2)}
+        images["u2"] = b"png-2-new"
+        second = {r.item[0]: r.result async for r in bot.sync_avatars(avatars)}
+        assert await bot.set_user_avatar("u1", "https://cdn.test/u1") is True
+        assert await bot.set_user_avatar("u3", "https://cdn.test/u3") is False
+
+    assert first["u1"].result == first["u2"].result == "updated"
+    assert isinstance(first["u3"].error, httpx.HTTPStatusError)
+    assert second == {"u1": "unchanged", "u2": "updated", "u3": None}
+    assert sorted(uploads) == ["/api/v4/users/u1/image", "/api/v4/users/u2/image",
+                               "/api/v4/users/u2/image"]
+
+
+async def test_request_metrics_by_templated_endpoint():
+    from aiomost import RequestMetrics
+    from aiomost.mattermost_actions.metrics import template_endpoint
+
+    user_ids = ["a" * 26, "b" * 26]
+    calls = {"n": 0}
+
+    def handler(request):
+        calls["n"] += 1
+        if request.url.path == "/api/v4/posts" and calls["n"] == 3:
+            return httpx.Response(503, headers={"Retry-After": "0"})
+        if request.url.path.startswith("/api/v4/users/"):
+            return httpx.Response(404, json={})
+        return httpx.Response(201, json={"id": "p"})
+
+    from aiomost import RetryPolicy
+
+    metrics = RequestMetrics(buckets=(0.1, 1.0))
+    async with make_bot(handler, metrics=metrics,
+                        retry_policy=RetryPolicy(backoff_base=0)) as bot:
+        for user_id in user_ids:
+            with pytest.raises(httpx.HTTPStatusError):
+                await bot.get_user_info(user_id)
+        await bot.send_message("c" * 26, "hi", idempotency_key="k1")
+
+    assert template_endpoint("api/v4/users/username/alice") == "api/v4/users/username/{name}"
+    snapshot = metrics.snapshot()
+    assert snapshot["GET api/v4/users/{id}"]["statuses"] == {"4xx": 2}
+    posts = snapshot["POST api/v4/posts"]
+    assert posts["statuses"] == {"5xx": 1, "2xx": 1}
+    assert posts["retries"] == 1 and posts["bytes_out"] > 0 and posts["bytes_in"] > 0
+
+    text = metrics.to_prometheus()
+    assert ('aiomost_http_requests_total{method="GET",endpoint="api/v4/users/{id}",'
+            'status_class="4xx"} 2') in text
+    assert ('aiomost_http_request_duration_seconds_bucket{method="POST",'
+            'endpoint="api/v4/posts",le="+Inf"} 2') in text
+
+    metrics.observe("GET", 'api/v4/emoji/"a\\b"\n', 200, 0.01)
+    assert 'endpoint="api/v4/emoji/\\"a\\\\b\\"\\n"' in metrics.to_prometheus()
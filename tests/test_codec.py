@@ -0,0 +1,121 @@
+"""Tests for the pluggable JSON codec"""
+
+import pytest
+
+from aiomost.mattermost_json import codec
+from aiomost.mattermost_models.posts.lazy_posts_model import LazyMessageEvent
+from aiomost.mattermost_models.posts.posts_model import MessageEvent
+from aiomost.mattermost_websockets.mm_websockets import MattermostUpdate, _parse_event
+
+
+@pytest.fixture(params=codec.available_backends())
+def backend(request):
+    previous = codec.backend
+    codec.set_backend(request.param)
+    yield request.param
+    codec.set_backend(previous)
+
+
+class Point:
+    def __init__(self):
+        self.x = 1
+        self.label = "точка"
+
+
+def test_backends_produce_identical_output(backend):
+    data = {"text": "привет", "n": [1, 2.5, None, True]}
+    assert codec.dumps(data) == '{"text":"привет","n":[1,2.5,null,true]}'
+    assert codec.loads(codec.dumps(data)) == data
+    assert codec.loads(codec.dumps(data).encode()) == data
+    assert codec.dumps(Point(), default=lambda o: o.__dict__) == '{"x":1,"label":"точка"}'
+    with pytest.raises(codec.DECODE_ERRORS):
+        codec.loads("{not json")
+
+
+def test_models_and_updates_use_codec(backend):
+    post = {"id": "p1", "create_at": 1, "update_at": 1, "edit_at": 0, "delete_at": 0,
+            "is_pinned": False, "user_id": "u1", "channel_id": "c1", "root_id": "",
+            "original_id": "", "message": "hi", "type": "", "props": {}}
+    frame = codec.loads(codec.dumps({
+        "event": "posted", "seq": 3, "broadcast": {"channel_id": "c1"},
+        "data": {"channel_display_name": "", "channel_name": "town", "channel_type": "O",
+                 "post": codec.dumps(post), "sender_name": "@u", "set_online": True,
+                 "team_id": "t", "mentions": '["u2"]'}}))
+
+    event = MessageEvent(**frame)
+    assert event.data.post.message == "hi"
+    assert event.data.mentions == ["u2"]
+
+    update = MattermostUpdate("custom", {"a": '{"b": 1}', "c": "text", "d": "true"})
+    assert codec.loads(update.to_json()) == {
+        "event_type": "custom", "data": {"a": {"b": 1}, "c": "text", "d": True}}
+
+
+def test_lazy_event_matches_eager_model(backend):
+    post = {"id": "p1", "create_at": 1, "update_at": 1, "edit_at": 0, "delete_at": 0,
+            "is_pinned": False, "user_id": "u1", "channel_id": "c1", "root_id": "",
+            "original_id": "", "message": "hi", "type": "",
+            "props": {"from_bot": "true", "attachments": [{"text": "a"}]},
+            "file_ids": ["f1"], "metadata": {"embeds": [{"type": "link"}]}}
+    raw = codec.dumps({
+        "event": "posted", "seq": 3, "broadcast": {"channel_id": "c1"},
+        "data": {"channel_display_name": "", "channel_name": "town", "channel_type": "O",
+                 "post": codec.dumps(post), "sender_name": "@u", "set_online": True,
+                 "team_id": "t", "mentions": '["u2"]'}})
+    eager = MessageEvent(**codec.loads(raw))
+    lazy = LazyMessageEvent(**codec.loads(raw))
+
+    assert isinstance(lazy, MessageEvent)
+    assert isinstance(lazy.data.__dict__["post"], str)  # Разбирается при первом обращении
+    assert lazy.data.post.message == "hi"
+    assert isinstance(lazy.data.post.__dict__["metadata"], dict)  # Ещё не разобрано
+    assert lazy.data.post.props.get("from_bot") == "true"
+    assert lazy.data.post.props["attachments"] == [{"text": "a"}]
+    assert lazy.data.post.hashtags == "" and lazy.data.post.participants == []
+    assert lazy.data.post.metadata.embeds == [{"type": "link"}]
+    assert lazy.data.post.file_ids == ["f1"]
+    assert lazy.data.mentions == ["u2"]
+    assert lazy.broadcast.channel_id == "c1" and lazy.event_type == "posted"
+    assert codec.loads(lazy.to_json()) == codec.loads(eager.to_json())
+    with pytest.raises(AttributeError):
+        lazy.data.post.missing
+
+
+def test_lazy_parse_filters_like_eager(backend):
+    def frame(**fields):
+        post = {"id": "p1", "create_at": 1, "update_at": 1, "edit_at": 0, "delete_at": 0,
+                "is_pinned": False, "user_id": "u1", "channel_id": "c1", "root_id": "",
+                "original_id": "", "message": "hi", "type": "", "props": {}, "metadata": {}}
+        post.update(fields)
+        return {"event": "posted", "seq": 1, "broadcast": {"channel_id": "c1"},
+                "data": {"channel_display_name": "", "channel_name": "town",
+                         "channel_type": "O", "post": codec.dumps(post), "sender_name": "@u",
+                         "set_online": True, "team_id": "t", "mentions": "[]"}}
+
+    for ignored in (frame(props={"from_bot": "true"}), frame(type="system_join_channel")):
+        assert _parse_event("posted", dict(ignored)) is None
+        assert _parse_event("posted", ignored, lazy=True) is None
+
+    # Во вложениях тоже есть ключи type и from_bot: фильтр смотрит только на поля сообщения
+    nested = {"attachments": [{"type": "button", "props": {"from_bot": "true"}}]}
+    assert _parse_event("posted", frame(props=nested)).data.post.message == "hi"
+    event = _parse_event("posted", frame(props=nested), lazy=True)
+    assert event.data.post.message == "hi"
+    assert isinstance(event.data.post.__dict__["props"], dict)  # PostProps ещё не построен
+    assert event.data.post.props["attachments"] == nested["attachments"]
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        codec.set_backend("simdjson")
+
+
+def test_unknown_env_backend_falls_back_to_json(monkeypatch, caplog):
+    previous = codec.backend
+    monkeypatch.setenv("AIOMOST_JSON", "simdjson")
+    try:
+        assert codec._backend_from_env() == "json"
+        assert codec.dumps({"a": 1}) == '{"a":1}'
+        assert "AIOMOST_JSON" in caplog.text
+    finally:
+        codec.set_backend(previous)
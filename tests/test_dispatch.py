@@ -0,0 +1,194 @@
+"""Tests for incoming event scheduling"""
+
+import asyncio
+
+import pytest
+
+from aiomost import (Dispatcher, EventShed, KeyedDispatchPool, MattermostButtonQuery,
+                     PriorityDispatchPool, Router)
+from aiomost.mattermost_dispatcher.event_pool import default_event_key
+
+
+def click(user_id, action="ok", channel_id="chan"):
+    return MattermostButtonQuery({"user_id": user_id, "channel_id": channel_id,
+                                  "context": {"action": action}})
+
+
+def test_default_event_key():
+    assert default_event_key("button_query", click("alice")) == "alice"
+    assert default_event_key("button_query", click(None, channel_id="chan")) == "chan"
+    assert default_event_key("webhook", {"data": {"user_id": "bob"}}) == "bob"
+    assert default_event_key("hello", {"event": "hello"}) is None
+
+
+async def test_keyed_pool_orders_per_user_and_runs_users_concurrently():
+    running = {}
+    log = []
+    overlap = []
+
+    async def dispatch(update_type, event):
+        user = event.user_id
+        assert not running.get(user), "события одного пользователя не должны пересекаться"
+        running[user] = True
+        if sum(running.values()) > 1:
+            overlap.append(user)
+        await asyncio.sleep(0.001)
+        log.append((user, event.action))
+        running[user] = False
+        return event.action
+
+    pool = KeyedDispatchPool(max_active_keys=4)
+    futures = [await pool.put("button_query", click(user, str(i)), dispatch)
+               for i in range(5) for user in ("alice", "bob")]
+    assert await asyncio.gather(*futures) == [str(i) for i in range(5) for _ in range(2)]
+    await pool.aclose()
+
+    assert [action for user, action in log if user == "alice"] == ["0", "1", "2", "3", "4"]
+    assert [action for user, action in log if user == "bob"] == ["0", "1", "2", "3", "4"]
+    assert overlap  # Разные пользователи обрабатывались одновременно
+    assert pool.stats()["dispatched"] == 10
+
+
+async def test_keyed_pool_caps_active_keys():
+    active = 0
+    peak = 0
+
+    async def dispatch(update_type, event):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.001)
+        active -= 1
+
+    pool = KeyedDispatchPool(max_active_keys=2)
+    for i in range(10):
+        await pool.put("button_query", click(f"user{i}"), dispatch)
+    await pool.aclose()
+    assert peak == 2
+
+
+async def test_dispatcher_runs_through_scheduler():
+    router = Router()
+    clicks = []
+
+    @router.button_query(button_data="ok")
+    async def on_click(event, **kwargs):
+        clicks.append(event.user_id)
+
+    dp = Dispatcher(scheduler=KeyedDispatchPool())
+    dp.include_router(router)
+    await dp.dispatch("button_query", click("alice"))
+    await dp.dispatch("button_query", click("bob", action="other"))
+    assert clicks == ["alice"]
+    assert dp.scheduler.stats()["dispatched"] == 2
+    await dp.scheduler.aclose()
+
+
+class Post:
+    def __init__(self, text, channel_type="O"):
+        self.text = text
+        self.data = type("Data", (), {"channel_type": channel_type})()
+
+
+async def blocked_pool(**kwargs):
+    """Пул с одним воркером, занятым до gate.set(); обработанные события - в handled."""
+    gate = asyncio.Event()
+    handled = []
+
+    async def dispatch(update_type, event):
+        if event == "block":
+            await gate.wait()
+        else:
+            handled.append(getattr(event, "text", None) or getattr(event, "action", None) or event)
+
+    pool = PriorityDispatchPool(workers=1, **kwargs)
+    await pool.put("block", "block", dispatch)
+    await asyncio.sleep(0)  # Воркер взял блокирующее событие
+    return pool, gate, handled, dispatch
+
+
+async def test_priority_lanes_run_clicks_and_dms_first():
+    pool, gate, handled, dispatch = await blocked_pool()
+    await pool.put("posted", Post("channel 1"), dispatch)
+    await pool.put("typing", {"event": "typing"}, dispatch)
+    await pool.put("posted", Post("channel 2"), dispatch)
+    await pool.put("posted", Post("dm", channel_type="D"), dispatch)
+    await pool.put("button_query", click("alice", action="click"), dispatch)
+    assert pool.stats()["lanes"] == {"high": 2, "normal": 2, "low": 1}
+
+    gate.set()
+    await pool.aclose()
+    assert handled == ["dm", "click", "channel 1", "channel 2", {"event": "typing"}]
+
+
+async def test_type_limit_drops_oldest():
+    pool, gate, handled, dispatch = await blocked_pool(policy="drop_oldest", limits={"posted": 2})
+    futures = [await pool.put("posted", Post(f"post {i}"), dispatch) for i in range(4)]
+    with pytest.raises(EventShed):
+        await futures[0]
+    assert futures[1].done() and isinstance(futures[1].exception(), EventShed)
+
+    gate.set()
+    await pool.aclose()
+    assert handled == ["post 2", "post 3"]
+    assert pool.stats()["shed_by_type"] == {"posted": 2}
+    assert 'aiomost_dispatch_events_shed_total{event_type="posted"} 2' in pool.to_prometheus()
+
+
+async def test_type_limit_drop_oldest_keeps_direct_messages():
+    pool, gate, handled, dispatch = await blocked_pool(policy="drop_oldest", limits={"posted": 2})
+    dm = await pool.put("posted", Post("dm", channel_type="D"), dispatch)
+    for i in range(3):
+        await pool.put("posted", Post(f"chatter {i}"), dispatch)
+    assert not dm.done()
+
+    gate.set()
+    await pool.aclose()
+    assert handled == ["dm", "chatter 2"]
+    assert pool.stats()["shed_by_type"] == {"posted": 2}
+
+
+async def test_type_limit_drop_lowest_admits_direct_message():
+    pool, gate, handled, dispatch = await blocked_pool(limits={"posted": 2})
+    await pool.put("posted", Post("chatter 0"), dispatch)
+    await pool.put("posted", Post("chatter 1"), dispatch)
+    await pool.put("posted", Post("dm", channel_type="D"), dispatch)  # Вытесняет chatter 1
+    await pool.put("posted", Post("dm 2", channel_type="G"), dispatch)  # Вытесняет chatter 0
+    # Сообщений в каналах больше нет: новое личное сообщение вытесняет самое новое в своей полосе
+    await pool.put("posted", Post("dm 3", channel_type="D"), dispatch)
+    late = await pool.put("posted", Post("chatter 2"), dispatch)  # Все posted выше - отброшено
+    assert isinstance(late.exception(), EventShed)
+
+    gate.set()
+    await pool.aclose()
+    assert handled == ["dm", "dm 3"]
+    assert pool.stats()["shed_by_type"] == {"posted": 4}
+
+
+async def test_drop_lowest_keeps_high_priority_events():
+    pool, gate, handled, dispatch = await blocked_pool(maxsize=2)
+    await pool.put("typing", "typing 1", dispatch)
+    await pool.put("posted", Post("post"), dispatch)
+    await pool.put("button_query", click("alice", action="click"), dispatch)  # Вытесняет typing
+    await pool.put("typing", "typing 2", dispatch)  # Ниже всех в полной очереди - отброшено
+
+    gate.set()
+    await pool.aclose()
+    assert handled == ["click", "post"]
+    assert pool.stats()["shed_by_type"] == {"typing": 2}
+
+
+async def test_sample_policy_sheds_only_below_high():
+    pool, gate, handled, dispatch = await blocked_pool(
+        maxsize=100, policy="sample", sample_rate=0.2, sample_watermark=0.1, seed=1)
+    for i in range(50):
+        await pool.put("posted", Post(f"post {i}"), dispatch)
+        await pool.put("button_query", click("alice", action=f"click {i}"), dispatch)
+
+    gate.set()
+    await pool.aclose()
+    clicks = [item for item in handled if item.startswith("click")]
+    posts = [item for item in handled if item.startswith("post")]
+    assert len(clicks) == 50
+    assert 10 <= len(posts) < 30
+    assert pool.stats()["shed"] == 50 - len(posts)
@@ -0,0 +1,403 @@
+"""Tests for the in-process Mattermost stub"""
+
+import asyncio
+
+import httpx
+import pytest
+
+from aiomost import MMBot, RetryPolicy, Router
+from aiomost.mattermost_websockets.mm_websockets import mattermost_ws_listener
+from tests.stub.server import MattermostStub
+
+
+def make_bot(stub, **kwargs):
+    return MMBot(stub.api_url, stub.token, transport=stub.transport, **kwargs)
+
+
+async def test_rest_endpoints_used_by_bot():
+    stub = MattermostStub()
+    alice = stub.add_user("alice")
+    channel = stub.add_channel("town-square", members=(alice["id"],), admins=(alice["id"],))
+    file_id = stub.add_file(b"report", "report.txt", "text/plain")
+
+    async with make_bot(stub) as bot:
+        post = await bot.send_message(channel["id"], "hello")
+        await bot.edit_message(post["id"], "hello, edited")
+        await bot.send_message_with_files(channel["id"], "files", [file_id])
+        dm = await bot.send_direct_message(alice["id"], "hi")
+        await bot.send_ephemeral_message(alice["id"], channel["id"], "psst")
+        assert (await bot.get_user_by_username("alice")).id == alice["id"]
+        assert await bot.is_channel_admin(alice["id"], channel["id"])
+        assert await bot.get_bot_user_id() == stub.bot_user["id"]
+        await bot.delete_message(post["id"])
+
+    assert post["id"] not in stub.posts
+    assert stub.channels[dm["channel_id"]]["type"] == "D"
+    with_files = [p for p in stub.posts.values() if p["file_ids"]]
+    assert stub.files[with_files[0]["file_ids"][0]][1] == b"report"
+    assert stub.ephemeral_posts[0]["message"] == "psst"
+
+
+async def test_error_injection_and_auth():
+    stub = MattermostStub(seed=1)
+    channel = stub.add_channel("town-square")
+    stub.fail_next(2)
+
+    async with make_bot(stub, retry_policy=RetryPolicy(backoff_base=0)) as bot:
+        await bot.send_message(channel["id"], "survives", idempotency_key="k")
+    assert stub.injected_errors == 2 and len(stub.posts) == 1
+
+    async with MMBot(stub.api_url, "wrong", transport=stub.transport) as bot:
+        with pytest.raises(httpx.HTTPStatusError):
+            await bot.get_bot_user_id()
+
+
+async def test_websocket_stream_reaches_router():
+    stub = MattermostStub()
+    alice = stub.add_user("alice")
+    channel = stub.add_channel("town-square", members=(alice["id"],))
+    received = asyncio.Queue()
+
+    router = Router(bot_user_id=stub.bot_user["id"])
+
+    @router.posted()
+    async def on_post(event, **kwargs):
+        await received.put(event.data.post.message)
+
+    bot = make_bot(stub)
+    listener = asyncio.ensure_future(
+        mattermost_ws_listener([router], stub.ws_url, stub.token, bot=bot, connect=stub.connect))
+    while not stub.sockets or not stub.sockets[0].authenticated:
+        await asyncio.sleep(0.001)
+
+    await bot.send_message(channel["id"], "from bot")  # Сообщения бота слушатель пропускает
+    stub.emit_post(channel["id"], alice["id"], "from alice")
+    assert await asyncio.wait_for(received.get(), 1) == "from alice"
+
+    listener.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await listener
+
+
+async def test_resp_stub_backs_state_manager():
+    from aiomost import RedisStateManager
+    from aiomost.mattermost_state_storage.matter_states import State
+    from tests.stub.resp import RespStub
+
+    async with RespStub() as server:
+        manager = RedisStateManager(host=server.host, port=server.port, db=0)
+        await manager.set_state("user", State("waiting_name", group_name="Form"))
+        assert await manager.get_state("user") == "Form:waiting_name"
+        await manager.update_data("user", name="Alice")
+        assert (await manager.get_data("user"))["name"] == "Alice"
+        await manager.delete_state("user")
+        assert await manager.get_state("user") is None
+
+
+async def test_slow_handler_does_not_block_socket_reads():
+    from aiomost.mattermost_dispatcher.event_pool import DispatchPool
+
+    stub = MattermostStub()
+    alice = stub.add_user("alice")
+    channel = stub.add_channel("town-square", members=(alice["id"],))
+    gate = asyncio.Event()
+    handled = asyncio.Queue()
+    router = Router(bot_user_id=stub.bot_user["id"])
+
+    @router.posted()
+    async def on_post(event, **kwargs):
+        if event.data.post.message == "slow":
+            await gate.wait()
+        await handled.put(event.data.post.message)
+
+    pool = DispatchPool(workers=2, maxsize=10)
+    listener = asyncio.ensure_future(mattermost_ws_listener(
+        [router], stub.ws_url, stub.token, connect=stub.connect, dispatch_pool=pool))
+    while not stub.sockets or not stub.sockets[0].authenticated:
+        await asyncio.sleep(0.001)
+
+    for message in ("slow", "fast", "fast"):
+        stub.emit_post(channel["id"], alice["id"], message)
+    # Второй воркер обрабатывает сообщения, пока первый занят
+    assert await asyncio.wait_for(handled.get(), 1) == "fast"
+    assert await asyncio.wait_for(handled.get(), 1) == "fast"
+    assert pool.stats()["active"] == 1
+
+    gate.set()
+    assert await asyncio.wait_for(handled.get(), 1) == "slow"
+    await pool.join()
+    stats = pool.stats()
+    assert stats["received"] == stats["dispatched"]  # Вместе с hello и ответом на авторизацию
+    assert stats["depth"] == 0 and stats["lag_max"] >= 0
+    assert "aiomost_dispatch_queue_depth 0" in pool.to_prometheus()
+
+    listener.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await listener
+    await pool.aclose()
+
+
+async def run_listener_through_drop(allow_resume):
+    """Разрывает соединение, пишет сообщения во время разрыва и возвращает доставленные."""
+    from aiomost.mattermost_websockets.session import SessionState
+
+    stub = MattermostStub()
+    stub.allow_resume = allow_resume
+    alice = stub.add_user("alice")
+    channel = stub.add_channel("town-square", members=(alice["id"],))
+    received = asyncio.Queue()
+    router = Router(bot_user_id=stub.bot_user["id"])
+
+    @router.posted()
+    async def on_post(event, **kwargs):
+        await received.put(event.data.post.message)
+
+    session = SessionState()
+    listener = asyncio.ensure_future(mattermost_ws_listener(
+        [router], stub.ws_url, stub.token, bot=make_bot(stub), connect=stub.connect,
+        session=session))
+    while not stub.sockets or not stub.sockets[0].authenticated:
+        await asyncio.sleep(0.001)
+
+    stub.emit_post(channel["id"], alice["id"], "before")
+    assert await asyncio.wait_for(received.get(), 1) == "before"
+    stub.drop_connections()
+    stub.emit_post(channel["id"], alice["id"], "during 1")
+    stub.emit_post(channel["id"], alice["id"], "during 2")
+    messages = [await asyncio.wait_for(received.get(), 3) for _ in range(2)]
+    stub.emit_post(channel["id"], alice["id"], "after")
+    messages.append(await asyncio.wait_for(received.get(), 1))
+
+    listener.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await listener
+    assert received.empty()
+    return stub, session, messages
+
+
+async def test_reconnect_resumes_session():
+    stub, session, messages = await run_listener_through_drop(allow_resume=True)
+    assert messages == ["during 1", "during 2", "after"]
+    assert stub.resumed_sessions == 1
+    assert session.stats()["resumed"] == 1 and session.caught_up == 0
+
+
+async def test_reconnect_falls_back_to_rest_catch_up():
+    stub, session, messages = await run_listener_through_drop(allow_resume=False)
+    assert messages == ["during 1", "during 2", "after"]
+    assert stub.resumed_sessions == 0
+    assert session.caught_up == 2
+
+
+class GatedTransport(httpx.AsyncBaseTransport):
+    """Транспорт заглушки, в котором запросы сообщений канала ждут gate."""
+
+    def __init__(self, transport, gate: asyncio.Event):
+        self.transport = transport
+        self.gate = gate
+
+    async def handle_async_request(self, request):
+        if request.method == "GET" and request.url.path.endswith("/posts"):
+            await self.gate.wait()
+        return await self.transport.handle_async_request(request)
+
+
+async def start_listener_through_drop(session, wrap_transport=None):
+    """Слушатель, который после первого сообщения теряет сессию (сервер её не возобновит)."""
+    stub = MattermostStub()
+    stub.allow_resume = False
+    alice = stub.add_user("alice")
+    channel = stub.add_channel("town-square", members=(alice["id"],))
+    received = asyncio.Queue()
+    router = Router(bot_user_id=stub.bot_user["id"])
+
+    @router.posted()
+    async def on_post(event, **kwargs):
+        await received.put(event.data.post.message)
+
+    transport = wrap_transport(stub.transport) if wrap_transport else stub.transport
+    bot = MMBot(stub.api_url, stub.token, transport=transport)
+    listener = asyncio.ensure_future(mattermost_ws_listener(
+        [router], stub.ws_url, stub.token, bot=bot, connect=stub.connect, session=session))
+    while not stub.sockets or not stub.sockets[0].authenticated:
+        await asyncio.sleep(0.001)
+    stub.emit_post(channel["id"], alice["id"], "before")
+    assert await asyncio.wait_for(received.get(), 1) == "before"
+    stub.drop_connections()
+    stub.emit_post(channel["id"], alice["id"], "during")
+    return stub, listener, received, (channel["id"], alice["id"])
+
+
+def test_catch_up_targets_are_capped_and_retry_failed_channels_first():
+    from aiomost.mattermost_websockets.session import SessionState
+
+    session = SessionState(catch_up_channels=2)
+    for i, channel_id in enumerate(("a", "b", "c")):
+        post = type("Post", (), {"id": f"p{i}", "channel_id": channel_id, "create_at": i + 1})
+        session.track_post({}, post)
+    assert session.catch_up_targets() == {"c": 3, "b": 2}
+    session.failed_channels["a"] = 1
+    assert session.catch_up_targets() == {"a": 1, "c": 3}
+
+
+async def test_catch_up_does_not_block_socket_reads():
+    from aiomost.mattermost_websockets.session import SessionState
+
+    gate = asyncio.Event()
+    session = SessionState()
+    stub, listener, received, (channel_id, user_id) = await start_listener_through_drop(
+        session, lambda transport: GatedTransport(transport, gate))
+
+    while not stub.sockets or not stub.sockets[0].authenticated:
+        await asyncio.sleep(0.001)
+    stub.emit_post(channel_id, user_id, "live")
+    # Догрузка ждёт REST, а живые кадры продолжают приходить
+    assert await asyncio.wait_for(received.get(), 1) == "live"
+    assert session.caught_up == 0
+
+    gate.set()
+    assert await asyncio.wait_for(received.get(), 1) == "during"
+    assert session.caught_up == 1
+
+    listener.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await listener
+
+
+async def test_failed_catch_up_is_counted_and_retried():
+    from aiomost.mattermost_websockets.session import SessionState
+
+    session = SessionState(catch_up_backoff=0.01)
+    stub, listener, received, _ = await start_listener_through_drop(session)
+    stub.fail_next(1, status=502)  # Первая страница догрузки
+
+    assert await asyncio.wait_for(received.get(), 3) == "during"
+    stats = session.stats()
+    assert stats["catch_up_errors"] == 1 and stats["failed_channels"] == 0
+    assert session.caught_up == 1
+
+    listener.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await listener
+
+
+async def test_listener_with_lazy_models():
+    from aiomost.mattermost_models.posts.lazy_posts_model import LazyMessageEvent
+
+    stub = MattermostStub()
+    alice = stub.add_user("alice")
+    channel = stub.add_channel("town-square", members=(alice["id"],))
+    received = asyncio.Queue()
+    router = Router(bot_user_id=stub.bot_user["id"])
+
+    @router.posted()
+    async def on_post(event, **kwargs):
+        await received.put(event)
+
+    listener = asyncio.ensure_future(mattermost_ws_listener(
+        [router], stub.ws_url, stub.token, connect=stub.connect, lazy_models=True))
+    while not stub.sockets or not stub.sockets[0].authenticated:
+        await asyncio.sleep(0.001)
+
+    stub.emit_post(channel["id"], alice["id"], "hi")
+    event = await asyncio.wait_for(received.get(), 1)
+    assert isinstance(event, LazyMessageEvent)
+    assert event.data.post.message == "hi"
+    assert event.data.post.user_id == alice["id"]
+
+    listener.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await listener
+
+
+async def test_unsubscribed_events_are_not_parsed():
+    from aiomost.mattermost_websockets.session import SessionState
+
+    stub = MattermostStub()
+    alice = stub.add_user("alice")
+    channel = stub.add_channel("town-square", members=(alice["id"],))
+    received = asyncio.Queue()
+    router = Router(bot_user_id=stub.bot_user["id"])
+
+    @router.posted()
+    async def on_post(event, **kwargs):
+        await received.put(event.data.post.message)
+
+    assert router.subscribed_event_types() == {"posted"}
+    session = SessionState()
+    listener = asyncio.ensure_future(mattermost_ws_listener(
+        [router], stub.ws_url, stub.token, connect=stub.connect, session=session))
+    while not stub.sockets or not stub.sockets[0].authenticated:
+        await asyncio.sleep(0.001)
+
+    for _ in range(3):
+        stub.emit("typing", {"parent_id": "", "user_id": alice["id"]}, {"channel_id": channel["id"]})
+    stub.emit_post(channel["id"], alice["id"], "hi")
+    assert await asyncio.wait_for(received.get(), 1) == "hi"
+    assert session.skipped == 3
+    assert session.gaps == 0  # seq пропущенных кадров учтён
+
+    @router.user_added()
+    async def on_user_added(event, **kwargs):
+        await received.put(event.data.user_id)
+
+    stub.emit("user_added", {"team_id": stub.team_id, "user_id": alice["id"]},
+              {"omit_users": None, "user_id": "", "channel_id": channel["id"], "team_id": "",
+               "connection_id": "", "omit_connection_id": ""})
+    assert await asyncio.wait_for(received.get(), 1) == alice["id"]
+
+    listener.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await listener
+
+
+async def test_routers_attached_after_start_are_subscribed():
+    from aiomost.mattermost_websockets.session import SessionState
+
+    stub = MattermostStub()
+    alice = stub.add_user("alice")
+    channel = stub.add_channel("town-square", members=(alice["id"],))
+    received = asyncio.Queue()
+    router = Router(bot_user_id=stub.bot_user["id"])
+    routers = [router]
+    session = SessionState()
+
+    listener = asyncio.ensure_future(mattermost_ws_listener(
+        routers, stub.ws_url, stub.token, connect=stub.connect, session=session))
+    while not stub.sockets or not stub.sockets[0].authenticated:
+        await asyncio.sleep(0.001)
+    stub.emit_post(channel["id"], alice["id"], "skipped")
+    while session.skipped < 1:
+        await asyncio.sleep(0.001)
+
+    # Обработчики регистрируются до подключения роутеров, и слушатель успевает
+    # разобрать кадр с новой версией обработчиков, пока роутеры ещё не подключены
+    sub_router = Router(bot_user_id=stub.bot_user["id"])
+    extra_router = Router(bot_user_id=stub.bot_user["id"])
+
+    @sub_router.posted()
+    async def on_post(event, **kwargs):
+        await received.put(event.data.post.message)
+
+    @extra_router.user_added()
+    async def on_user_added(event, **kwargs):
+        await received.put(event.data.user_id)
+
+    stub.emit("typing", {"parent_id": "", "user_id": alice["id"]}, {"channel_id": channel["id"]})
+    while session.skipped < 2:
+        await asyncio.sleep(0.001)
+
+    router.sub_routers.append(sub_router)
+    stub.emit_post(channel["id"], alice["id"], "hi")
+    assert await asyncio.wait_for(received.get(), 1) == "hi"
+
+    routers.append(extra_router)
+    stub.emit("user_added", {"team_id": stub.team_id, "user_id": alice["id"]},
+              {"omit_users": None, "user_id": "", "channel_id": channel["id"], "team_id": "",
+               "connection_id": "", "omit_connection_id": ""})
+    assert await asyncio.wait_for(received.get(), 1) == alice["id"]
+    assert session.skipped == 2
+
+    listener.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await listener